@@ -0,0 +1,246 @@
+"""Admission control for both Flask apps.
+
+Every request takes a slot before its view runs. When all slots are busy
+it waits in a bounded queue, and waiters are admitted by priority class:
+checkout and order routes first, ordinary routes next, bulk catalog reads
+last. Bulk routes also have their own smaller cap, so they can never take
+all the slots. A full queue or a wait longer than ``queue_timeout`` gets an
+immediate 503 with Retry-After instead of a timeout further down the line.
+
+The slot count adapts AIMD-style. It grows by about one per limit's worth
+of requests while their smoothed service time stays under
+``target_latency``, and shrinks by ``backoff`` once it goes over.
+
+Limits are per process. They only matter where one process serves requests
+concurrently: threaded servers, gunicorn's gthread workers or
+backend_asgi's thread pool. A sync gunicorn worker only ever has one
+request in flight.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from fnmatch import fnmatchcase
+
+from flask import Response, g, request
+
+from metrics import registry
+
+CRITICAL = 0
+NORMAL = 1
+BULK = 2
+# Not counted against any limit, e.g. /metrics and long-polls that only wait
+EXEMPT = None
+
+CLASS_NAMES = {CRITICAL: 'critical', NORMAL: 'normal', BULK: 'bulk'}
+
+ADMISSION_REQUESTS = registry.counter(
+    'admission_requests_total', 'Requests admitted straight away, queued first, or shed.',
+    ('app', 'priority', 'outcome')
+)
+
+
+class Shed(Exception):
+    """Raised instead of admitting a request; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('route', 'event', 'admitted', 'shed')
+
+    def __init__(self, route):
+        self.route = route
+        self.event = threading.Event()
+        self.admitted = False
+        self.shed = False
+
+
+class AdmissionController:
+    """Concurrency limit with a priority wait queue and per-route caps.
+
+    ``route_limits`` maps route names to a cap on that route's own
+    in-flight requests, on top of the shared limit.
+    """
+
+    def __init__(self, limit=32, min_limit=4, max_limit=128, max_queue=64, queue_timeout=2.0,
+                 target_latency=1.0, backoff=0.9, route_limits=None, clock=time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.route_limits = dict(route_limits or {})
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limit = float(min(max(limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._route_in_flight = {}
+        self._waiting = []
+        self._order = itertools.count()
+        self._latency = None
+        self._last_decrease = None
+        self._stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'decreases': 0}
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, route, priority=NORMAL):
+        """Take a slot for ``route``, waiting if needed; raises Shed."""
+        with self._lock:
+            # Waiters are dispatched as soon as there's room for them, so any
+            # still queued are blocked on the shared limit or their route's cap
+            if self._has_room(route):
+                self._admit(route)
+                self._stats['admitted'] += 1
+                return 'admitted'
+            if len(self._waiting) >= self.max_queue:
+                victim = max(self._waiting) if self._waiting else None
+                if victim is None or victim[0] <= priority:
+                    self._stats['shed'] += 1
+                    raise Shed('queue full', self._retry_after())
+                # A more important request takes the least important waiter's place
+                self._waiting.remove(victim)
+                heapq.heapify(self._waiting)
+                victim[2].shed = True
+                victim[2].event.set()
+            waiter = _Waiter(route)
+            heapq.heappush(self._waiting, (priority, next(self._order), waiter))
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.admitted:
+                self._stats['queued'] += 1
+                return 'queued'
+            if not waiter.shed:
+                self._waiting = [entry for entry in self._waiting if entry[2] is not waiter]
+                heapq.heapify(self._waiting)
+            self._stats['shed'] += 1
+            raise Shed('queue timeout' if not waiter.shed else 'displaced', self._retry_after())
+
+    def release(self, route, elapsed):
+        """Give back a slot; ``elapsed`` is the request's service time."""
+        with self._lock:
+            self._in_flight -= 1
+            self._route_in_flight[route] -= 1
+            self._adapt(elapsed)
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(limit=self.limit, in_flight=self._in_flight, waiting=len(self._waiting),
+                         latency=self._latency)
+        return stats
+
+    # Everything below runs with self._lock held
+
+    def _has_room(self, route):
+        if self._in_flight >= int(self._limit):
+            return False
+        cap = self.route_limits.get(route)
+        return cap is None or self._route_in_flight.get(route, 0) < cap
+
+    def _admit(self, route):
+        self._in_flight += 1
+        self._route_in_flight[route] = self._route_in_flight.get(route, 0) + 1
+
+    def _dispatch(self):
+        # Highest priority first, skipping waiters whose own route is at its cap
+        for entry in sorted(self._waiting):
+            if self._in_flight >= int(self._limit):
+                break
+            waiter = entry[2]
+            if self._has_room(waiter.route):
+                self._waiting.remove(entry)
+                self._admit(waiter.route)
+                waiter.admitted = True
+                waiter.event.set()
+        heapq.heapify(self._waiting)
+
+    def _adapt(self, elapsed):
+        self._latency = elapsed if self._latency is None else 0.8 * self._latency + 0.2 * elapsed
+        now = self._clock()
+        if self._latency > self.target_latency:
+            # At most one cut per target_latency, so a single slow burst
+            # doesn't collapse the limit before the cuts take effect
+            if self._last_decrease is None or now - self._last_decrease >= self.target_latency:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._last_decrease = now
+                self._stats['decreases'] += 1
+        else:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def _retry_after(self):
+        # Roughly how long the current backlog takes to drain
+        latency = self._latency or self.target_latency
+        backlog = (len(self._waiting) + 1) / max(int(self._limit), 1)
+        return min(max(math.ceil(latency * backlog), 1), 30)
+
+
+def classify(rule, priorities, default=NORMAL):
+    """Priority class of URL rule ``rule``; ``priorities`` is (pattern, class) pairs, first match wins."""
+    for pattern, priority in priorities:
+        if fnmatchcase(rule, pattern):
+            return priority
+    return default
+
+
+def _busy_response(retry_after):
+    return Response('Server busy, please retry shortly\n', status=503, mimetype='text/plain')
+
+
+def init_admission(app, name, priorities, bulk_routes=(), busy_response=_busy_response):
+    """Admit ``app``'s requests through an AdmissionController built from its config.
+
+    ``priorities`` classifies URL rules (see classify()). ``bulk_routes``
+    share ADMISSION_BULK_LIMIT slots each. ``busy_response(retry_after)``
+    builds the 503 for shed requests; Retry-After is added to it. Returns
+    the controller, or None when ADMISSION_LIMIT is 0.
+    """
+    config = app.config
+    if not config['ADMISSION_LIMIT']:
+        return None
+    controller = AdmissionController(
+        limit=config['ADMISSION_LIMIT'],
+        min_limit=min(4, config['ADMISSION_LIMIT']),
+        max_limit=max(config['ADMISSION_LIMIT'] * 4, 4),
+        max_queue=config['ADMISSION_MAX_QUEUE'],
+        queue_timeout=config['ADMISSION_QUEUE_TIMEOUT'],
+        target_latency=config['ADMISSION_TARGET_LATENCY'],
+        route_limits={route: config['ADMISSION_BULK_LIMIT'] for route in bulk_routes}
+    )
+
+    @app.before_request
+    def admit_request():
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        priority = EXEMPT if rule is None else classify(rule, priorities)
+        if priority is EXEMPT:
+            return None
+        labels = {'app': name, 'priority': CLASS_NAMES[priority]}
+        try:
+            outcome = controller.acquire(rule, priority)
+        except Shed as e:
+            ADMISSION_REQUESTS.inc(outcome='shed', **labels)
+            response = busy_response(e.retry_after)
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        ADMISSION_REQUESTS.inc(outcome=outcome, **labels)
+        g.admission = (rule, time.perf_counter())
+        return None
+
+    @app.teardown_request
+    def release_slot(error=None):
+        admitted = g.pop('admission', None)
+        if admitted is not None:
+            rule, started = admitted
+            controller.release(rule, time.perf_counter() - started)
+
+    return controller
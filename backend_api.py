@@ -1,22 +1,122 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import base64
+import binascii
+import gc
+import json
 import os
+import threading
+import time
 import requests
+import http_client
 from flask_cors import CORS
+from catalog import CatalogCache
+from catalog_sync import CatalogSyncJob
+from order_queue import OrderQueue, OrderWorkers
+from exports import Export, ExportTable
+from sales_rollups import SalesRollups, SalesTally
+from product_search import MAX_PER_PAGE, ProductIndex, ProductQuery, SORT_OPTIONS, fts_prefix_query
+from sqlalchemy import DDL, and_, delete, event, func, insert, inspect, or_, select, text, update
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from migrations import PRODUCT_FTS_DDL, upgrade_schema
+from storage import database_uri, engine_options, install_sqlite_pragmas
+from password_hashing import DEFAULT_METHOD, HasherBusy, PasswordHasher
+from http_caching import cached_json, init_compression, make_etag
+from fast_json import FastJSONProvider
+from admission import BULK, CRITICAL, EXEMPT, init_admission
+from metrics import PASSWORD_HASH_DURATION, init_metrics, instrument_engine, timed
+import fast_json
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Configuration
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DATABASE_PATH = os.path.join(BASE_DIR, 'ecommerce.db')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATABASE_PATH}'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(DATABASE_PATH)
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'concurrent')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLITE_PROFILE']
+)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['CATALOG_CACHE_TTL'] = int(os.environ.get('CATALOG_CACHE_TTL', 60))
+app.config['CATALOG_CACHE_STALE_TTL'] = int(os.environ.get('CATALOG_CACHE_STALE_TTL', 600))
+# 'remote' reads the upstream feed through the cache, 'local' reads the synced Product table
+app.config['CATALOG_SOURCE'] = os.environ.get('CATALOG_SOURCE', 'remote')
+app.config['CATALOG_SYNC_INTERVAL'] = int(os.environ.get('CATALOG_SYNC_INTERVAL', 300))
+# Largest share of local products one sync may delete; a feed missing more
+# than that is treated as truncated and nothing is pruned
+app.config['CATALOG_SYNC_MAX_PRUNE'] = float(os.environ.get('CATALOG_SYNC_MAX_PRUNE', 0.5))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_QUEUE'] = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 32))
+app.config['PRODUCTS_CACHE_CONTROL'] = os.environ.get('PRODUCTS_CACHE_CONTROL', 'public, max-age=30')
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# Requests slower than this are logged with their timing breakdown; 0 disables
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+# 'sync' prices and stores orders inside the checkout request; 'async' queues
+# them for the order workers and answers with a pending order straight away
+app.config['CHECKOUT_MODE'] = os.environ.get('CHECKOUT_MODE', 'sync')
+app.config['ORDER_WORKERS'] = int(os.environ.get('ORDER_WORKERS', 2))
+app.config['ORDER_POLL_INTERVAL'] = float(os.environ.get('ORDER_POLL_INTERVAL', 1.0))
+app.config['ORDER_MAX_ATTEMPTS'] = int(os.environ.get('ORDER_MAX_ATTEMPTS', 5))
+# Longest a client may long-poll /api/orders/<id>/status
+app.config['ORDER_STATUS_MAX_WAIT'] = float(os.environ.get('ORDER_STATUS_MAX_WAIT', 30))
+# Long-polls that may hold a request thread at once; more answer right away.
+# backend_asgi waits on the event loop instead and isn't limited by this
+app.config['ORDER_STATUS_MAX_WAITERS'] = int(os.environ.get('ORDER_STATUS_MAX_WAITERS', 4))
+# Admission control: requests in flight per process before others queue
+# (0 disables), queue size, longest wait for a slot before a 503, the
+# service time the adaptive limit aims for, and the cap per bulk route
+app.config['ADMISSION_LIMIT'] = int(os.environ.get('ADMISSION_LIMIT', 32))
+app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 64))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2.0))
+app.config['ADMISSION_TARGET_LATENCY'] = float(os.environ.get('ADMISSION_TARGET_LATENCY', 1.0))
+app.config['ADMISSION_BULK_LIMIT'] = int(os.environ.get('ADMISSION_BULK_LIMIT', 8))
 
 db = SQLAlchemy(app)
+init_compression(app, min_size=app.config['COMPRESS_MIN_SIZE'])
+init_metrics(app, 'backend', slow_request_seconds=app.config['SLOW_REQUEST_SECONDS'])
+admission = init_admission(
+    app, 'backend',
+    priorities=[
+        ('/metrics', EXEMPT),
+        ('/api/*/stats', EXEMPT),
+        ('/api/orders/queue', EXEMPT),
+        # Long-polls mostly sleep; holding a slot would starve real work
+        ('/api/orders/<int:order_id>/status', EXEMPT),
+        # Long streams would skew the latency the limit adapts to
+        ('/api/exports/*', EXEMPT),
+        ('/api/checkout', CRITICAL),
+        ('/api/orders/*', CRITICAL),
+        ('/products*', BULK),
+        ('/fetch-products', BULK),
+    ],
+    bulk_routes=['/products', '/fetch-products'],
+    busy_response=lambda retry_after: jsonify({'error': 'Server busy, please retry shortly'})
+)
+
+with app.app_context():
+    install_sqlite_pragmas(db.engine, app.config['SQLITE_PROFILE'])
+    instrument_engine(db.engine)
+
+# Password hashing runs on its own bounded process pool
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_queue=app.config['PASSWORD_HASH_MAX_QUEUE']
+)
+
+# Shared product catalog cache, used by every route that needs product data
+catalog_cache = CatalogCache(
+    ttl=app.config['CATALOG_CACHE_TTL'],
+    stale_ttl=app.config['CATALOG_CACHE_STALE_TTL']
+)
 
 # Models
 class User(db.Model):
@@ -27,15 +127,17 @@ class User(db.Model):
     cart_items = db.relationship('CartItem', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        with timed('password_hash', PASSWORD_HASH_DURATION, operation='hash'):
+            self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        with timed('password_hash', PASSWORD_HASH_DURATION, operation='verify'):
+            return password_hasher.verify(self.password_hash, password)
 
 class Product(db.Model):
     id = db.Column(db.String(100), primary_key=True)
     title = db.Column(db.String(255), nullable=False)
-    category = db.Column(db.String(100))
+    category = db.Column(db.String(100), index=True)
     description = db.Column(db.Text)
     price = db.Column(db.Float)
     rentprice = db.Column(db.Float)
@@ -43,6 +145,39 @@ class Product(db.Model):
     image = db.Column(db.String(255))
     rating_rate = db.Column(db.Float)
     rating_count = db.Column(db.Integer)
+    # Sync generation that last inserted or changed this row; see catalog_sync.py
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Full-text index of the searched columns that sync_catalog keeps current
+    search_table = 'product_fts'
+
+    def to_dict(self):
+        # Same shape as an entry of the upstream feed
+        return {
+            '_id': self.id,
+            'title': self.title,
+            'category': self.category,
+            'description': self.description,
+            'price': self.price,
+            'rentprice': self.rentprice,
+            'size': self.size,
+            'image': self.image,
+            'rating': {
+                'rate': self.rating_rate,
+                'count': self.rating_count
+            }
+        }
+
+# create_all() and drop_all() don't know the virtual table, so it follows product's
+event.listen(Product.__table__, 'after_create', DDL(PRODUCT_FTS_DDL).execute_if(dialect='sqlite'))
+event.listen(
+    Product.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS product_fts').execute_if(dialect='sqlite')
+)
+
+class JobLease(db.Model):
+    # Which process runs a periodic job, until when; see CatalogSyncJob
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -52,57 +187,126 @@ class CartItem(db.Model):
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
     product = db.relationship('Product')
 
+    # One row per (user, product); also serves every lookup by user_id
+    __table_args__ = (
+        db.Index('ux_cart_item_user_product', 'user_id', 'product_id', unique=True),
+    )
+
+# Catalog access
+def use_local_catalog():
+    return app.config['CATALOG_SOURCE'] == 'local'
+
+def catalog_products():
+    if use_local_catalog():
+        return [p.to_dict() for p in Product.query.order_by(Product.id)]
+    return catalog_cache.products()
+
+def catalog_lookup(product_ids):
+    """Return {product_id: product} for the requested ids that exist."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    if use_local_catalog():
+        rows = Product.query.filter(Product.id.in_(product_ids)).all()
+        return {p.id: p.to_dict() for p in rows}
+    products = catalog_cache.by_id()
+    return {pid: products[pid] for pid in product_ids if pid in products}
+
+catalog_sync_job = CatalogSyncJob(
+    app, db, Product, app.config['CATALOG_SYNC_INTERVAL'],
+    max_prune_ratio=app.config['CATALOG_SYNC_MAX_PRUNE'], lease_model=JobLease
+)
+
+@app.before_request
+def start_catalog_sync():
+    # Also called by gunicorn's post_fork hook, backend_asgi's startup and
+    # LocalBackend, so each serving process syncs without waiting for a request
+    if use_local_catalog():
+        catalog_sync_job.start()
+
+# Service functions
+#
+# Each one returns a (payload, status) pair. The Flask views below wrap them
+# for HTTP clients and backend_client.LocalBackend calls them directly when
+# both apps share a process.
+
 # Authentication Routes
-@app.route('/api/register', methods=['POST'])
-def register():
-    data = request.get_json()
-    
-    if User.query.filter_by(username=data['username']).first():
-        return jsonify({'error': 'Username already exists'}), 400
-    
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({'error': 'Email already exists'}), 400
+HASHER_BUSY = {'error': 'Too many sign-ins in progress, please retry shortly'}, 503
+
+def register_user(data):
+    # One lookup for both unique fields, before paying for a hash
+    existing = User.query.filter(
+        or_(User.username == data['username'], User.email == data['email'])
+    ).first()
+    if existing:
+        if existing.username == data['username']:
+            return {'error': 'Username already exists'}, 400
+        return {'error': 'Email already exists'}, 400
     
     user = User(username=data['username'], email=data['email'])
-    user.set_password(data['password'])
+    try:
+        user.set_password(data['password'])
+    except HasherBusy:
+        return HASHER_BUSY
     
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Someone registered the same name or email since the lookup
+        db.session.rollback()
+        return {'error': 'Username or email already exists'}, 400
     
-    return jsonify({'message': 'User registered successfully'}), 201
+    return {'message': 'User registered successfully'}, 201
 
-@app.route('/api/login', methods=['POST'])
-def login():
-    data = request.get_json()
+def login_user(data):
     user = User.query.filter_by(username=data['username']).first()
     
-    if user and user.check_password(data['password']):
-        return jsonify({
+    try:
+        authenticated = user is not None and user.check_password(data['password'])
+    except HasherBusy:
+        return HASHER_BUSY
+    
+    if authenticated and password_hasher.needs_rehash(user.password_hash):
+        # Hash parameters changed since this password was stored. The
+        # upgrade is optional, so a busy hasher just leaves it for next time
+        try:
+            user.set_password(data['password'])
+            db.session.commit()
+        except HasherBusy:
+            db.session.rollback()
+    
+    if authenticated:
+        return {
             'message': 'Login successful',
             'user_id': user.id,
             'username': user.username
-        })
+        }, 200
     
-    return jsonify({'error': 'Invalid username or password'}), 401
+    return {'error': 'Invalid username or password'}, 401
+
+@app.route('/api/register', methods=['POST'])
+def register():
+    payload, status = register_user(request.get_json())
+    return jsonify(payload), status
+
+@app.route('/api/login', methods=['POST'])
+def login():
+    payload, status = login_user(request.get_json())
+    return jsonify(payload), status
 
 # Cart Routes
-@app.route('/api/cart', methods=['GET'])
-def get_cart():
-    user_id = request.args.get('user_id')
+def cart_contents(user_id):
     cart_items = CartItem.query.filter_by(user_id=user_id).all()
     
-    # Fetch all products from external API
-    url = 'http://shopa.beauty:5000/freelancer/products'
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch products'}), 500
-    
-    products = {p['_id']: p for p in response.json()}
+    # Product details come from the catalog
+    try:
+        products = catalog_lookup(item.product_id for item in cart_items)
+    except requests.exceptions.RequestException:
+        return {'error': 'Failed to fetch products'}, 500
     
     items = []
     for item in cart_items:
-        # Get product details from external API data
         product = products.get(item.product_id)
         if product:
             items.append({
@@ -117,140 +321,403 @@ def get_cart():
                 'added_at': item.added_at.isoformat()
             })
     
-    return jsonify({'cart_items': items})
+    return {'cart_items': items, 'totals': cart_totals(items)}, 200
 
-@app.route('/api/cart/add', methods=['POST'])
-def add_to_cart():
-    data = request.get_json()
+def cart_totals(items):
+    """What checkout would charge for ``items`` right now."""
+    subtotal = sum(item['product']['price'] * item['quantity'] for item in items)
+    shipping = SHIPPING_COST if items else 0.0
+    tax = subtotal * TAX_RATE
+    return {
+        'items': sum(item['quantity'] for item in items),
+        'subtotal': subtotal,
+        'shipping': shipping,
+        'tax': tax,
+        'total': subtotal + shipping + tax
+    }
+
+def upsert_cart_item(user_id, product_id, quantity):
+    """Statement that inserts a cart row or adds ``quantity`` to the existing one."""
+    stmt = sqlite_insert(CartItem).values(
+        user_id=user_id,
+        product_id=product_id,
+        quantity=quantity,
+        added_at=datetime.utcnow()
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id],
+        set_={'quantity': func.coalesce(CartItem.quantity, 0) + stmt.excluded.quantity}
+    )
+
+def add_cart_item(data):
     user_id = data['user_id']
     product_id = data['product_id']
     quantity = data.get('quantity', 1)
     
-    # Verify product exists in external API
-    url = f'http://shopa.beauty:5000/freelancer/products'
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch products'}), 500
-    
-    products = response.json()
-    product_exists = any(p['_id'] == product_id for p in products)
-    
-    if not product_exists:
-        return jsonify({'error': 'Product not found'}), 404
-    
-    existing_item = CartItem.query.filter_by(
-        user_id=user_id,
-        product_id=product_id
-    ).first()
+    # Verify product exists in the catalog
+    try:
+        products = catalog_lookup([product_id])
+    except requests.exceptions.RequestException:
+        return {'error': 'Failed to fetch products'}, 500
     
-    if existing_item:
-        existing_item.quantity += quantity
-    else:
-        cart_item = CartItem(
-            user_id=user_id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.session.add(cart_item)
+    if product_id not in products:
+        return {'error': 'Product not found'}, 404
     
+    # Insert or increment in one statement, so concurrent adds never race
+    db.session.execute(upsert_cart_item(user_id, product_id, quantity))
     db.session.commit()
-    return jsonify({'message': 'Item added to cart successfully'})
+    return {'message': 'Item added to cart successfully'}, 200
 
-@app.route('/api/cart/update', methods=['PUT'])
-def update_cart_item():
-    data = request.get_json()
+def update_cart_quantity(data):
     cart_item = CartItem.query.get(data['cart_item_id'])
     
     if not cart_item:
-        return jsonify({'error': 'Cart item not found'}), 404
+        return {'error': 'Cart item not found'}, 404
     
     cart_item.quantity = data['quantity']
     db.session.commit()
     
-    return jsonify({'message': 'Cart item updated successfully'})
+    return {'message': 'Cart item updated successfully'}, 200
 
-@app.route('/api/cart/remove', methods=['DELETE'])
-def remove_from_cart():
-    cart_item_id = request.args.get('cart_item_id')
+def remove_cart_item(cart_item_id):
     cart_item = CartItem.query.get(cart_item_id)
     
     if not cart_item:
-        return jsonify({'error': 'Cart item not found'}), 404
+        return {'error': 'Cart item not found'}, 404
     
     db.session.delete(cart_item)
     db.session.commit()
     
-    return jsonify({'message': 'Item removed from cart successfully'})
+    return {'message': 'Item removed from cart successfully'}, 200
 
-# Product Routes
-@app.route('/products', methods=['GET'])
-def get_products():
-    search = request.args.get('search')
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 5))
+CART_OPERATIONS = ('add', 'update', 'remove')
+
+def _cart_operation_error(index, details):
+    return {'error': 'Invalid cart operation', 'operation': index, 'details': details}, 400
+
+def _validate_cart_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        return _cart_operation_error(None, 'operations must be a non-empty list')
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            return _cart_operation_error(index, f'op must be one of {", ".join(CART_OPERATIONS)}')
+        if operation['op'] == 'add' and 'product_id' not in operation:
+            return _cart_operation_error(index, 'add needs a product_id')
+        if operation['op'] != 'add' and 'cart_item_id' not in operation and 'product_id' not in operation:
+            return _cart_operation_error(index, 'needs a cart_item_id or product_id')
+        if operation['op'] == 'update' and 'quantity' not in operation:
+            return _cart_operation_error(index, 'update needs a quantity')
+        if operation['op'] != 'remove':
+            quantity = operation.get('quantity', 1)
+            minimum = 1 if operation['op'] == 'add' else 0
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < minimum:
+                return _cart_operation_error(index, f'quantity must be an integer of at least {minimum}')
+        if not str(operation.get('cart_item_id', 0)).isdigit():
+            return _cart_operation_error(index, 'cart_item_id must be an integer')
+    return None
+
+def _cart_item_target(user_id, operation):
+    # Scoped to the user, so one batch can never touch another user's cart
+    if 'cart_item_id' in operation:
+        return (CartItem.user_id == user_id, CartItem.id == int(operation['cart_item_id']))
+    return (CartItem.user_id == user_id, CartItem.product_id == operation['product_id'])
+
+def apply_cart_operations(data):
+    """Apply a list of add/update/remove operations in one transaction.
+
+    Either every operation is applied or none is. An update to quantity 0
+    removes the item, and removing an item that is already gone is not an
+    error, so resubmitting the same batch is harmless. Returns the updated
+    cart with totals.
+    """
+    user_id = data['user_id']
+    operations = data.get('operations')
+    error = _validate_cart_operations(operations)
+    if error:
+        return error
     
+    # Every product being added is checked with one catalog lookup
+    added = {op['product_id'] for op in operations if op['op'] == 'add'}
     try:
-        # Fetch products directly from external API
-        url = 'http://shopa.beauty:5000/freelancer/products'
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes
+        products = catalog_lookup(added)
+    except requests.exceptions.RequestException:
+        return {'error': 'Failed to fetch products'}, 500
+    for index, operation in enumerate(operations):
+        if operation['op'] == 'add' and operation['product_id'] not in products:
+            return {'error': 'Product not found', 'operation': index}, 404
+    
+    for index, operation in enumerate(operations):
+        if operation['op'] == 'add':
+            db.session.execute(upsert_cart_item(user_id, operation['product_id'], operation.get('quantity', 1)))
+            continue
         
-        all_products = response.json()
+        target = _cart_item_target(user_id, operation)
+        if operation['op'] == 'remove' or operation['quantity'] == 0:
+            db.session.execute(delete(CartItem).where(*target).execution_options(synchronize_session=False))
+            continue
         
-        # Wrap the products in a 'products' object
-        return jsonify({'products': all_products})
-    except requests.exceptions.RequestException as e:
-        return jsonify({'error': 'Failed to fetch products', 'details': str(e)}), 500
-    except ValueError as e:
-        return jsonify({'error': 'Invalid JSON response from external API', 'details': str(e)}), 500
-    
-    # Filter products if search parameter is provided
-    if search:
-        all_products = [p for p in all_products if search.lower() in p['title'].lower()]
-    
-    # Calculate pagination
-    total = len(all_products)
-    pages = (total + per_page - 1) // per_page
-    start_idx = (page - 1) * per_page
-    end_idx = min(start_idx + per_page, total)
-    
-    # Get products for current page
-    paged_products = all_products[start_idx:end_idx]
+        result = db.session.execute(
+            update(CartItem).where(*target).values(quantity=operation['quantity'])
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.session.rollback()
+            return {'error': 'Cart item not found', 'operation': index}, 404
     
-    # Format products for response
-    result = [{
+    db.session.commit()
+    return cart_contents(user_id)
+
+@app.route('/api/cart', methods=['GET'])
+def get_cart():
+    payload, status = cart_contents(request.args.get('user_id'))
+    return jsonify(payload), status
+
+@app.route('/api/cart', methods=['PATCH'])
+def patch_cart():
+    payload, status = apply_cart_operations(request.get_json())
+    return jsonify(payload), status
+
+@app.route('/api/cart/add', methods=['POST'])
+def add_to_cart():
+    payload, status = add_cart_item(request.get_json())
+    return jsonify(payload), status
+
+@app.route('/api/cart/update', methods=['PUT'])
+def update_cart_item():
+    payload, status = update_cart_quantity(request.get_json())
+    return jsonify(payload), status
+
+@app.route('/api/cart/remove', methods=['DELETE'])
+def remove_from_cart():
+    payload, status = remove_cart_item(request.args.get('cart_item_id'))
+    return jsonify(payload), status
+
+# Product Routes
+def serialize_product(product):
+    rating = product.get('rating') or {}
+    return {
         'id': product['_id'],
         'title': product['title'],
-        'category': product['category'],
-        'description': product['description'],
-        'price': product['price'],
-        'rentprice': product['rentprice'],
-        'size': product['size'],
-        'image': product['image'],
+        'category': product.get('category'),
+        'description': product.get('description'),
+        'price': product.get('price'),
+        'rentprice': product.get('rentprice'),
+        'size': product.get('size'),
+        'image': product.get('image'),
         'rating': {
-            'rate': product['rating']['rate'],
-            'count': product['rating']['count']
+            'rate': rating.get('rate'),
+            'count': rating.get('count')
         }
-    } for product in paged_products]
+    }
+
+_LOCAL_SORT_COLUMNS = {
+    'price': Product.price,
+    'rating': Product.rating_rate,
+    # ProductIndex sorts titles lowercased
+    'title': func.lower(Product.title),
+}
+
+def local_products_query(query):
+    q = Product.query
+    match = fts_prefix_query(query.search)
+    if match:
+        # Same rule as ProductIndex: every token starts some word of the
+        # title, description or category
+        q = q.filter(Product.id.in_(
+            text(f'SELECT product_id FROM {Product.search_table} WHERE {Product.search_table} MATCH :match')
+            .bindparams(match=match)
+            .columns(Product.id)
+        ))
+    if query.category is not None:
+        q = q.filter(Product.category == query.category)
+    if query.min_price is not None:
+        q = q.filter(Product.price >= query.min_price)
+    if query.max_price is not None:
+        q = q.filter(Product.price <= query.max_price)
+    if query.min_rating is not None:
+        q = q.filter(Product.rating_rate >= query.min_rating)
 
-    return jsonify({
-        'products': result,
+    if query.sort:
+        field, descending = SORT_OPTIONS[query.sort]
+        column = _LOCAL_SORT_COLUMNS[field]
+        q = q.order_by(column.is_(None), column.desc() if descending else column.asc(), Product.id)
+    else:
+        q = q.order_by(Product.id)
+    return q
+
+def search_local_products(query):
+    q = local_products_query(query)
+    total = q.count()
+    rows = q.offset(query.offset).limit(query.per_page).all()
+    return [p.to_dict() for p in rows], total
+
+# Products per chunk written to a streamed response
+STREAM_BATCH_SIZE = 200
+
+def stream_products(query, ndjson):
+    """Stream every matching product, ignoring pagination.
+
+    The catalog source is resolved up front, so upstream failures still
+    produce a normal error response. After that the body is generated
+    lazily, one batch of products at a time.
+    """
+    if use_local_catalog():
+        products = (p.to_dict() for p in local_products_query(query).yield_per(STREAM_BATCH_SIZE))
+    else:
+        products = catalog_search_index().iter_search(query)
+
+    def generate():
+        batch = []
+        first = True
+        if not ndjson:
+            yield b'{"products":['
+        for product in products:
+            encoded = fast_json.dumps(serialize_product(product))
+            if ndjson:
+                batch.append(encoded + b'\n')
+            else:
+                batch.append(encoded if first else b',' + encoded)
+                first = False
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield b''.join(batch)
+                batch = []
+        if batch:
+            yield b''.join(batch)
+        if not ndjson:
+            yield b']}'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+# The search index is rebuilt only when the catalog's contents change. A
+# refresh that fetched the same feed keeps the same store, so the index
+# preloaded by the gunicorn master stays shared with the workers. The
+# (store, index) pair is replaced as one tuple, so a request thread never
+# sees one snapshot's store with another's index.
+_search_index = {'current': (None, None)}
+
+def catalog_search_index(snapshot=None):
+    if snapshot is None:
+        snapshot = catalog_cache.get()
+    store, index = _search_index['current']
+    if store is not snapshot.store:
+        index = ProductIndex(snapshot.products)
+        _search_index['current'] = (snapshot.store, index)
+    return index
+
+def search_products(args):
+    try:
+        query = ProductQuery.from_args(args)
+    except ValueError as e:
+        return {'error': 'Invalid query parameters', 'details': str(e)}, 400
+    
+    try:
+        if use_local_catalog():
+            page_products, total = search_local_products(query)
+            products = [serialize_product(p) for p in page_products]
+            version = make_etag(products)
+        else:
+            snapshot = catalog_cache.get()
+            page_products, total = catalog_search_index(snapshot).search(query)
+            products = [serialize_product(p) for p in page_products]
+            version = snapshot.version
+    except requests.exceptions.RequestException as e:
+        return {'error': 'Failed to fetch products', 'details': str(e)}, 500
+    except ValueError as e:
+        return {'error': 'Invalid JSON response from external API', 'details': str(e)}, 500
+
+    return {
+        'products': products,
         'total': total,
-        'pages': pages,
-        'current_page': page
-    })
+        'pages': query.pages(total),
+        'current_page': query.page,
+        'per_page': query.per_page,
+        # Changes whenever any product on this page could have changed;
+        # the frontend keys its rendered fragments on it
+        'version': version
+    }, 200
+
+def wants_stream():
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    if best == 'application/x-ndjson':
+        return 'ndjson'
+    if request.args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+@app.route('/products', methods=['GET'])
+def get_products():
+    # Accept: application/x-ndjson or ?stream=1 returns the whole result set, streamed
+    stream = wants_stream()
+    if stream:
+        try:
+            query = ProductQuery.from_args(request.args)
+            return stream_products(query, ndjson=stream == 'ndjson')
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        except requests.exceptions.RequestException as e:
+            return jsonify({'error': 'Failed to fetch products', 'details': str(e)}), 500
+    
+    cache_control = app.config['PRODUCTS_CACHE_CONTROL']
+    if use_local_catalog():
+        # Every sync that changes a row stamps it with a new generation, and
+        # deletions change the count, so the pair stands in for the table's version
+        count, generation = db.session.execute(select(func.count(), func.max(Product.version))).one()
+        etag = make_etag('local', count, generation, sorted(request.args.items(multi=True)))
+        return cached_json(etag, cache_control, lambda: search_products(request.args))
+    
+    try:
+        snapshot = catalog_cache.get()
+    except requests.exceptions.RequestException:
+        payload, status = search_products(request.args)
+        return jsonify(payload), status
+    
+    # The answer only depends on the catalog version and the query, so a
+    # matching If-None-Match skips the search and the serialization
+    etag = make_etag(snapshot.version, sorted(request.args.items(multi=True)))
+    return cached_json(etag, cache_control, lambda: search_products(request.args))
+
+def product_categories():
+    try:
+        if use_local_catalog():
+            rows = db.session.query(Product.category).filter(Product.category.isnot(None)).distinct()
+            categories = sorted(row[0] for row in rows)
+        else:
+            categories = catalog_search_index().categories()
+    except requests.exceptions.RequestException:
+        return {'error': 'Failed to fetch products'}, 500
+    
+    return {'categories': categories}, 200
+
+@app.route('/products/categories', methods=['GET'])
+def get_product_categories():
+    payload, status = product_categories()
+    return jsonify(payload), status
 
 # Fetch Products from External API (kept for reference but not used anymore)
 @app.route('/fetch-products', methods=['GET'])
 def fetch_products():
-    url = 'http://shopa.beauty:5000/freelancer/products'
-    response = requests.get(url)
-    if response.status_code != 200:
+    try:
+        if use_local_catalog():
+            count = Product.query.count()
+        else:
+            count = len(catalog_cache.products())
+    except requests.exceptions.RequestException:
         return jsonify({'error': 'Failed to fetch products'}), 500
     
-    products = response.json()
-    return jsonify({'message': 'Products fetched successfully', 'count': len(products)}), 200
+    return jsonify({'message': 'Products fetched successfully', 'count': count}), 200
+
+@app.route('/api/catalog/stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(catalog_cache.stats())
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    return jsonify(http_client.stats())
+
+@app.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats() if admission is not None else {})
 
 # Order model for checkout process
 class Order(db.Model):
@@ -260,8 +727,36 @@ class Order(db.Model):
     status = db.Column(db.String(50), default='pending')
     shipping_address = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Unique per user; see ux_order_user_idempotency_key
+    idempotency_key = db.Column(db.String(64))
+    # Bumped by the ORM on every update; part of the order's ETag
+    version = db.Column(db.Integer, nullable=False, default=1)
     items = db.relationship('OrderItem', backref='order', lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        # Order history: a user's orders newest first, seeked by (created_at, id)
+        db.Index('ix_order_user_created', 'user_id', 'created_at', 'id'),
+        # A key only identifies a retry of the same user's checkout
+        db.Index('ux_order_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    )
+
+class OrderJob(db.Model):
+    """An async-mode order waiting for the order workers; see order_queue.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, unique=True)
+    # JSON list of [product_id, quantity] taken from the cart at checkout
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_order_job_claim', 'status', 'available_at'),
+    )
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
@@ -270,115 +765,656 @@ class OrderItem(db.Model):
     price = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Integer, default=1)
 
+    __table_args__ = (
+        db.Index('ix_order_item_order', 'order_id'),
+    )
+
+# Sales rollups, kept current by checkout; see sales_rollups.py
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+class ProductDailySales(db.Model):
+    product_id = db.Column(db.String(100), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_product_daily_sales_day', 'day', 'product_id'),
+    )
+
+class UserSales(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    first_order_at = db.Column(db.DateTime)
+    last_order_at = db.Column(db.DateTime)
+
+sales_rollups = SalesRollups(DailySales, ProductDailySales, UserSales)
+
+def record_sale(user_id, placed_at, total, order_items):
+    """Add a confirmed order to the sales rollups; part of the caller's transaction."""
+    tally = SalesTally()
+    tally.add_order(user_id, placed_at, total, order_items)
+    sales_rollups.record(db.session, tally)
+
 # Checkout and Order Routes
-@app.route('/api/checkout', methods=['POST'])
-def checkout():
-    data = request.get_json()
-    user_id = data['user_id']
-    shipping_info = data['shipping_info']
-    
-    # Get cart items
-    cart_items = CartItem.query.filter_by(user_id=user_id).all()
-    if not cart_items:
-        return jsonify({'error': 'Cart is empty'}), 400
-    
-    # Fetch products from external API
-    url = 'http://shopa.beauty:5000/freelancer/products'
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch products'}), 500
-    
-    products = {p['_id']: p for p in response.json()}
-    
-    # Calculate order total
+SHIPPING_COST = 5.0
+TAX_RATE = 0.1
+
+def price_order_items(cart_rows, products):
+    """Turn (product_id, quantity) rows into order item values and a subtotal."""
     subtotal = 0
     order_items = []
     
-    for item in cart_items:
-        product = products.get(item.product_id)
+    for product_id, quantity in cart_rows:
+        product = products.get(product_id)
         if not product:
             continue
             
-        item_total = product['price'] * item.quantity
+        item_total = product['price'] * quantity
         subtotal += item_total
         
         order_items.append({
-            'product_id': item.product_id,
+            'product_id': product_id,
             'product_title': product['title'],
             'price': item_total,
-            'quantity': item.quantity
+            'quantity': quantity
         })
     
-    # Add shipping and tax
-    shipping = 5.0
-    tax = subtotal * 0.1
-    total = subtotal + shipping + tax
+    return order_items, subtotal
+
+def checkout_result(order):
+    pending = order.status == 'pending'
+    return {
+        'message': 'Order received' if pending else 'Order placed successfully',
+        'order_id': order.id,
+        'status': order.status,
+        'total': None if pending else order.total
+    }
+
+def existing_order(user_id, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+
+def empty_cart_result(user_id, idempotency_key):
+    """Answer a checkout that found the cart empty.
+
+    A retry sent while its first attempt was still running passes the
+    idempotency check before that attempt commits, then finds the cart
+    already taken. It gets the order the first attempt placed.
+    """
+    db.session.rollback()
+    existing = existing_order(user_id, idempotency_key)
+    if existing is not None:
+        return checkout_result(existing), 200
+    return {'error': 'Cart is empty'}, 400
+
+def take_cart(user_id):
+    """Clear the user's cart and return what was in it, as one statement.
+
+    Items added concurrently are never dropped without being ordered.
+    """
+    return db.session.execute(
+        delete(CartItem)
+        .where(CartItem.user_id == user_id)
+        .returning(CartItem.product_id, CartItem.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+def enqueue_checkout(user_id, shipping_address, idempotency_key):
+    """Async mode: take the cart and queue the order for the order workers."""
+    try:
+        cart_rows = take_cart(user_id)
+        if not cart_rows:
+            return empty_cart_result(user_id, idempotency_key)
+        
+        # Priced by finalize_order; the total is filled in then
+        order_id = db.session.execute(
+            insert(Order).values(
+                user_id=user_id,
+                total=0.0,
+                status='pending',
+                shipping_address=shipping_address,
+                idempotency_key=idempotency_key
+            ).returning(Order.id)
+        ).scalar_one()
+        order_queue.enqueue(db.session, order_id, cart_rows)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing = existing_order(user_id, idempotency_key)
+        if existing is None:
+            raise
+        return checkout_result(existing), 200
     
-    # Create order
-    shipping_address = f"{shipping_info['address']}, {shipping_info['city']}, {shipping_info['state']} {shipping_info['zip']}"
+    start_order_workers()
+    order_workers.notify()
+    return {
+        'message': 'Order received',
+        'order_id': order_id,
+        'status': 'pending',
+        'total': None
+    }, 202
+
+def place_checkout(data):
+    user_id = data['user_id']
+    shipping_info = data['shipping_info']
+    idempotency_key = data.get('idempotency_key')
     
-    order = Order(
-        user_id=user_id,
-        total=total,
-        shipping_address=shipping_address
-    )
+    # A retried request gets back the order its first attempt created
+    existing = existing_order(user_id, idempotency_key)
+    if existing:
+        return checkout_result(existing), 200
     
-    db.session.add(order)
-    db.session.flush()
-    
-    # Add order items
-    for item_data in order_items:
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item_data['product_id'],
-            product_title=item_data['product_title'],
-            price=item_data['price'],
-            quantity=item_data['quantity']
-        )
-        db.session.add(order_item)
+    shipping_address = f"{shipping_info['address']}, {shipping_info['city']}, {shipping_info['state']} {shipping_info['zip']}"
+    if app.config['CHECKOUT_MODE'] == 'async':
+        return enqueue_checkout(user_id, shipping_address, idempotency_key)
     
-    # Clear cart
-    for item in cart_items:
-        db.session.delete(item)
+    # Resolve prices before taking the write lock, so a catalog miss never
+    # holds up other writers
+    cart_rows = db.session.execute(
+        select(CartItem.product_id, CartItem.quantity).where(CartItem.user_id == user_id)
+    ).all()
+    if not cart_rows:
+        return empty_cart_result(user_id, idempotency_key)
     
-    db.session.commit()
+    try:
+        products = catalog_lookup(row.product_id for row in cart_rows)
+    except requests.exceptions.RequestException:
+        return {'error': 'Failed to fetch products'}, 500
+    
+    try:
+        cart_rows = take_cart(user_id)
+        if not cart_rows:
+            return empty_cart_result(user_id, idempotency_key)
+        
+        missing = {row.product_id for row in cart_rows} - products.keys()
+        if missing:
+            products.update(catalog_lookup(missing))
+        
+        order_items, subtotal = price_order_items(cart_rows, products)
+        tax = subtotal * TAX_RATE
+        total = subtotal + SHIPPING_COST + tax
+        placed_at = datetime.utcnow()
+        
+        order_id = db.session.execute(
+            insert(Order).values(
+                user_id=user_id,
+                total=total,
+                status='confirmed',
+                shipping_address=shipping_address,
+                created_at=placed_at,
+                idempotency_key=idempotency_key
+            ).returning(Order.id)
+        ).scalar_one()
+        
+        if order_items:
+            for item in order_items:
+                item['order_id'] = order_id
+            db.session.execute(insert(OrderItem), order_items)
+        record_sale(user_id, placed_at, total, order_items)
+        
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent retry carrying the same key
+        db.session.rollback()
+        existing = existing_order(user_id, idempotency_key)
+        if existing is None:
+            raise
+        return checkout_result(existing), 200
+    except requests.exceptions.RequestException:
+        db.session.rollback()
+        return {'error': 'Failed to fetch products'}, 500
     
-    return jsonify({
+    return {
         'message': 'Order placed successfully',
-        'order_id': order.id,
+        'order_id': order_id,
+        'status': 'confirmed',
         'total': total
-    })
+    }, 200
 
-@app.route('/api/orders/<int:order_id>', methods=['GET'])
-def get_order(order_id):
-    order = Order.query.get_or_404(order_id)
+def finalize_order(claimed):
+    """Order worker: price a queued order and mark it confirmed.
+
+    Catalog errors propagate, so the queue retries the job later.
+    """
+    cart_rows = order_queue.items(claimed)
+    products = catalog_lookup(product_id for product_id, _ in cart_rows)
+    order_items, subtotal = price_order_items(cart_rows, products)
     
-    order_items = [{
+    order = db.session.get(Order, claimed.order_id)
+    if order.status != 'pending':
+        # Already settled by an earlier claim of this job
+        order_queue.complete(db.session, claimed)
+        db.session.commit()
+        return
+    order.total = subtotal + SHIPPING_COST + subtotal * TAX_RATE
+    order.status = 'confirmed'
+    if order_items:
+        for item in order_items:
+            item['order_id'] = order.id
+        db.session.execute(insert(OrderItem), order_items)
+    record_sale(order.user_id, order.created_at, order.total, order_items)
+    order_queue.complete(db.session, claimed)
+    db.session.commit()
+
+def fail_order(claimed):
+    """Order worker: give up on an order and put its items back in the cart."""
+    order = db.session.get(Order, claimed.order_id)
+    order.status = 'failed'
+    for product_id, quantity in order_queue.items(claimed):
+        db.session.execute(upsert_cart_item(order.user_id, product_id, quantity))
+
+order_queue = OrderQueue(OrderJob, max_attempts=app.config['ORDER_MAX_ATTEMPTS'])
+order_workers = OrderWorkers(
+    app, db, order_queue, finalize_order,
+    on_failure=fail_order,
+    workers=app.config['ORDER_WORKERS'],
+    poll_interval=app.config['ORDER_POLL_INTERVAL']
+)
+
+@app.before_request
+def start_order_workers():
+    # Also called by the services, since LocalBackend never goes through a request
+    if app.config['CHECKOUT_MODE'] == 'async':
+        order_workers.ensure_started()
+
+status_waiters = threading.BoundedSemaphore(app.config['ORDER_STATUS_MAX_WAITERS'])
+
+def order_status(order_id, wait=0):
+    """Current status of an order, waiting up to ``wait`` seconds while it is pending.
+
+    Long-polls are exempt from admission control, so they have their own
+    limit instead: past ORDER_STATUS_MAX_WAITERS the current status is
+    returned at once and the client polls again.
+    """
+    start_order_workers()
+    if wait > 0 and status_waiters.acquire(blocking=False):
+        try:
+            return _order_status(order_id, wait)
+        finally:
+            status_waiters.release()
+    return _order_status(order_id, 0)
+
+def _order_status(order_id, wait):
+    deadline = time.monotonic() + min(max(wait, 0), app.config['ORDER_STATUS_MAX_WAIT'])
+    while True:
+        row = db.session.execute(
+            select(Order.user_id, Order.status, Order.total).where(Order.id == order_id)
+        ).first()
+        # End the read so the next poll sees orders committed since
+        db.session.rollback()
+        if row is None:
+            return {'error': 'Order not found'}, 404
+        
+        remaining = deadline - time.monotonic()
+        if row.status != 'pending' or remaining <= 0:
+            return {
+                'order_id': order_id,
+                'user_id': row.user_id,
+                'status': row.status,
+                'total': None if row.status == 'pending' else row.total
+            }, 200
+        # Woken early when a worker in this process finishes a job; the
+        # timeout covers workers in other processes
+        order_workers.wait_for_update(min(remaining, 0.5))
+
+def serialize_order_item(item):
+    return {
         'id': item.id,
         'product_id': item.product_id,
         'product_title': item.product_title,
         'price': item.price,
         'quantity': item.quantity
-    } for item in order.items]
+    }
+
+def order_details(order_id):
+    # Order and items in one joined query instead of a lazy load per order
+    order = db.session.get(Order, order_id, options=[joinedload(Order.items)])
+    if order is None:
+        return {'error': 'Order not found'}, 404
     
-    return jsonify({
+    return {
         'id': order.id,
         'user_id': order.user_id,
         'total': order.total,
         'status': order.status,
         'shipping_address': order.shipping_address,
         'created_at': order.created_at.isoformat(),
-        'items': order_items
-    })
+        'items': [serialize_order_item(item) for item in order.items]
+    }, 200
+
+MAX_ORDERS_PER_PAGE = 100
+
+def encode_order_cursor(created_at, order_id):
+    raw = json.dumps([created_at.isoformat(), order_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_order_cursor(cursor):
+    """(created_at, id) from a cursor made by encode_order_cursor; ValueError if it is not one."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+def user_orders(user_id, args):
+    """One page of ``user_id``'s orders, newest first.
+
+    Pages are seeked by (created_at, id) rather than offset, so every page
+    is one range scan of ix_order_user_created however many orders the
+    user has. ``next_cursor`` is passed back as ``?before=`` for the next
+    page. ``?include=items`` embeds each order's items, loaded for the
+    whole page in one query.
+    """
+    try:
+        limit = min(max(int(args.get('limit', 20)), 1), MAX_ORDERS_PER_PAGE)
+        before = decode_order_cursor(args['before']) if args.get('before') else None
+    except ValueError as e:
+        return {'error': 'Invalid query parameters', 'details': str(e)}, 400
+    if db.session.get(User, user_id) is None:
+        return {'error': 'User not found'}, 404
+
+    query = (
+        select(Order.id, Order.total, Order.status, Order.shipping_address, Order.created_at)
+        .where(Order.user_id == user_id)
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        created_at, order_id = before
+        query = query.where(or_(
+            Order.created_at < created_at,
+            and_(Order.created_at == created_at, Order.id < order_id)
+        ))
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    orders = [{
+        'id': row.id,
+        'total': row.total,
+        'status': row.status,
+        'shipping_address': row.shipping_address,
+        'created_at': row.created_at.isoformat()
+    } for row in rows]
+
+    if args.get('include') == 'items':
+        items_by_order = {order['id']: [] for order in orders}
+        if items_by_order:
+            items = db.session.execute(
+                select(OrderItem)
+                .where(OrderItem.order_id.in_(list(items_by_order)))
+                .order_by(OrderItem.order_id, OrderItem.id)
+            ).scalars()
+            for item in items:
+                items_by_order[item.order_id].append(serialize_order_item(item))
+        for order in orders:
+            order['items'] = items_by_order[order['id']]
+
+    last = rows[-1] if rows else None
+    return {
+        'orders': orders,
+        'limit': limit,
+        'next_cursor': encode_order_cursor(last.created_at, last.id) if has_more else None
+    }, 200
+
+# Sales reports; these read only the rollup tables
+MAX_REPORT_DAYS = 366
+
+def report_range(args):
+    """(start, end) dates from ``?start=&end=``, inclusive; the last 30 days by default."""
+    end = date.fromisoformat(args['end']) if args.get('end') else datetime.utcnow().date()
+    start = date.fromisoformat(args['start']) if args.get('start') else end - timedelta(days=29)
+    if start > end:
+        raise ValueError('start is after end')
+    if (end - start).days >= MAX_REPORT_DAYS:
+        raise ValueError(f'Reports cover at most {MAX_REPORT_DAYS} days')
+    return start, end
+
+def sales_totals(rows):
+    return {
+        'orders': sum(row['orders'] for row in rows),
+        'units': sum(row['units'] for row in rows),
+        'revenue': sum(row['revenue'] for row in rows)
+    }
+
+def sales_report(args):
+    """Orders, units and revenue per day."""
+    try:
+        start, end = report_range(args)
+    except ValueError as e:
+        return {'error': 'Invalid query parameters', 'details': str(e)}, 400
+    days = [{
+        'day': row.day.isoformat(),
+        'orders': row.orders,
+        'units': row.units,
+        'revenue': row.revenue
+    } for row in db.session.execute(
+        select(DailySales).where(DailySales.day.between(start, end)).order_by(DailySales.day)
+    ).scalars()]
+    return {'start': start.isoformat(), 'end': end.isoformat(), 'days': days, 'totals': sales_totals(days)}, 200
+
+def product_sales_report(product_id, args):
+    """One product's orders, units and revenue per day."""
+    try:
+        start, end = report_range(args)
+    except ValueError as e:
+        return {'error': 'Invalid query parameters', 'details': str(e)}, 400
+    days = [{
+        'day': row.day.isoformat(),
+        'orders': row.orders,
+        'units': row.units,
+        'revenue': row.revenue
+    } for row in db.session.execute(
+        select(ProductDailySales)
+        .where(ProductDailySales.product_id == product_id, ProductDailySales.day.between(start, end))
+        .order_by(ProductDailySales.day)
+    ).scalars()]
+    return {
+        'product_id': product_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'days': days,
+        'totals': sales_totals(days)
+    }, 200
+
+def top_products_report(args):
+    """Best-selling products over a date range, by revenue or units.
+
+    Sums the per-product daily rollups in range, so the cost follows the
+    number of days and products sold in them, not the number of orders.
+    """
+    try:
+        start, end = report_range(args)
+        limit = min(max(int(args.get('limit', 10)), 1), MAX_PER_PAGE)
+    except ValueError as e:
+        return {'error': 'Invalid query parameters', 'details': str(e)}, 400
+    by = args.get('by', 'revenue')
+    if by not in ('revenue', 'units'):
+        return {'error': 'Invalid query parameters', 'details': f'Unsupported ranking: {by}'}, 400
+    
+    revenue = func.sum(ProductDailySales.revenue).label('revenue')
+    units = func.sum(ProductDailySales.units).label('units')
+    rows = db.session.execute(
+        select(ProductDailySales.product_id, func.sum(ProductDailySales.orders).label('orders'), units, revenue)
+        .where(ProductDailySales.day.between(start, end))
+        .group_by(ProductDailySales.product_id)
+        .order_by((revenue if by == 'revenue' else units).desc(), ProductDailySales.product_id)
+        .limit(limit)
+    ).all()
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'by': by,
+        'products': [{
+            'product_id': row.product_id,
+            'orders': row.orders,
+            'units': row.units,
+            'revenue': row.revenue
+        } for row in rows]
+    }, 200
+
+def user_sales_report(user_id):
+    totals = db.session.get(UserSales, user_id)
+    if totals is None:
+        if db.session.get(User, user_id) is None:
+            return {'error': 'User not found'}, 404
+        return {'user_id': user_id, 'orders': 0, 'units': 0, 'revenue': 0.0,
+                'first_order_at': None, 'last_order_at': None}, 200
+    return {
+        'user_id': user_id,
+        'orders': totals.orders,
+        'units': totals.units,
+        'revenue': totals.revenue,
+        'first_order_at': totals.first_order_at.isoformat(),
+        'last_order_at': totals.last_order_at.isoformat()
+    }, 200
+
+# Bulk exports for finance and analytics; see exports.py
+EXPORT_TABLES = {
+    table.name: table for table in (
+        # An async order is pending until its job is confirmed or fails for good
+        ExportTable('orders', Order, [
+            Order.id, Order.user_id, Order.status, Order.total, Order.shipping_address, Order.created_at
+        ], created=Order.created_at, unsettled=(
+            select(func.min(OrderJob.order_id)).where(OrderJob.status != 'failed')
+        )),
+        ExportTable('order_items', OrderItem, [
+            OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.product_title,
+            OrderItem.price, OrderItem.quantity
+        ], created=Order.created_at, join=(Order, Order.id == OrderItem.order_id)),
+        ExportTable('carts', CartItem, [
+            CartItem.id, CartItem.user_id, CartItem.product_id, CartItem.quantity, CartItem.added_at
+        ], created=CartItem.added_at, incremental=False),
+    )
+}
+
+def create_export(table_name, options):
+    """Build an Export from request-style options; raises KeyError or ValueError."""
+    since = options.get('since')
+    return Export(
+        EXPORT_TABLES[table_name],
+        fmt=options.get('format', 'jsonl'),
+        compress=options.get('gzip') in ('1', 'true', True),
+        after_id=int(options.get('after', 0)),
+        since=datetime.fromisoformat(since) if since else None,
+        batch_size=min(max(int(options.get('batch_size', 1000)), 1), 10000)
+    )
+
+@app.route('/api/checkout', methods=['POST'])
+def checkout():
+    payload, status = place_checkout(request.get_json())
+    return jsonify(payload), status
+
+@app.route('/api/orders/<int:order_id>/status', methods=['GET'])
+def get_order_status(order_id):
+    payload, status = order_status(order_id, request.args.get('wait', 0, type=float))
+    return jsonify(payload), status
+
+@app.route('/api/orders/queue', methods=['GET'])
+def order_queue_stats():
+    return jsonify(order_queue.stats(db.session))
+
+@app.route('/api/users/<int:user_id>/orders', methods=['GET'])
+def get_user_orders(user_id):
+    payload, status = user_orders(user_id, request.args)
+    return jsonify(payload), status
+
+@app.route('/api/reports/sales', methods=['GET'])
+def get_sales_report():
+    payload, status = sales_report(request.args)
+    return jsonify(payload), status
+
+@app.route('/api/reports/products/top', methods=['GET'])
+def get_top_products_report():
+    payload, status = top_products_report(request.args)
+    return jsonify(payload), status
+
+@app.route('/api/reports/products/<product_id>/sales', methods=['GET'])
+def get_product_sales_report(product_id):
+    payload, status = product_sales_report(product_id, request.args)
+    return jsonify(payload), status
+
+@app.route('/api/reports/users/<int:user_id>', methods=['GET'])
+def get_user_sales_report(user_id):
+    payload, status = user_sales_report(user_id)
+    return jsonify(payload), status
+
+@app.route('/api/exports/<table>', methods=['GET'])
+def export_table(table):
+    if table not in EXPORT_TABLES:
+        return jsonify({'error': 'Unknown export', 'tables': sorted(EXPORT_TABLES)}), 404
+    try:
+        export = create_export(table, request.args)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+    
+    # Known before the first row is read, so it can go in a header
+    watermark = export.prepare(db.session)
+    response = Response(stream_with_context(export.chunks(db.session)), mimetype=export.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={export.filename}'
+    response.headers['X-Export-Watermark'] = str(watermark)
+    return response
+
+@app.route('/api/orders/<int:order_id>', methods=['GET'])
+def get_order(order_id):
+    row = db.session.execute(
+        select(Order.status, Order.version).where(Order.id == order_id)
+    ).first()
+    if row is None:
+        return jsonify({'error': 'Order not found'}), 404
+    
+    etag = make_etag('order', order_id, row.status, row.version)
+    return cached_json(etag, 'private, no-cache', lambda: order_details(order_id))
+
+def prepare_for_fork():
+    """Load shared state in the parent so forked workers inherit it.
+
+    Called once from gunicorn's master (see gunicorn.conf.py) after the app
+    is preloaded. The schema is created and migrated first, before any
+    worker can query it. The catalog and its search index are built next,
+    then frozen out of the garbage collector so workers don't dirty the
+    shared pages by scanning them. Sockets and database connections are
+    closed so each worker opens its own.
+
+    The sharing outlives the first refresh: a worker that refetches an
+    unchanged feed keeps the preloaded store and index. Only when the feed
+    really changes does each worker build, and hold privately, its own copy
+    until it is recycled (max_requests). benchmarks/fork_memory.py measures
+    both cases.
+    """
+    create_database()
+    if not use_local_catalog():
+        try:
+            catalog_search_index()
+        except requests.exceptions.RequestException:
+            # Workers fetch it themselves on first use
+            pass
+    http_client.close()
+    with app.app_context():
+        db.engine.dispose()
+    gc.collect()
+    gc.freeze()
 
 # Create database
 def create_database():
-    if not os.path.exists(DATABASE_PATH):
-        with app.app_context():
-            db.create_all()
-            print('Database created successfully.')
+    with app.app_context():
+        exists = inspect(db.engine).has_table('user')
+        db.create_all()
+        upgrade_schema(db.engine)
+    if not exists:
+        print('Database created successfully.')
 
 if __name__ == '__main__':
     create_database()
+    start_catalog_sync()
     app.run(port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,302 @@
+"""ASGI entry point for the backend.
+
+Run with: uvicorn backend_asgi:app (or hypercorn, or any other ASGI server)
+
+Flask handlers are synchronous, so every request still ends up in
+backend_api's WSGI app. Here that happens on a bounded thread pool
+(ASGI_DB_THREADS), which caps concurrent database work no matter how many
+connections the server has open. The event loop keeps the waiting that
+needs no thread.
+
+The upstream product feed is the one slow dependency. Routes that need the
+catalog first await a usable snapshot on the event loop. The feed is
+fetched with httpx's async client when httpx is installed, and one fetch is
+shared by every request that is waiting for it. A pool thread is only taken
+once the catalog is in memory, so hundreds of requests can wait out a slow
+feed while the pool keeps serving everything else.
+
+Order status long-polls (``?wait=``) wait on the event loop too. Each poll
+is one quick status read on the pool; between polls the request holds no
+thread, so clients waiting on pending orders can't use up the pool.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode
+
+import catalog
+import http_client
+from backend_api import (
+    app as flask_app, catalog_cache, catalog_sync_job, create_database, start_catalog_sync, use_local_catalog
+)
+
+try:
+    import httpx
+except ImportError:  # httpx is optional; without it a pool thread fetches the feed
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Path prefixes whose handlers read the product catalog
+CATALOG_PATHS = ('/products', '/api/cart', '/api/checkout')
+ORDER_STATUS_PATH = re.compile(r'/api/orders/\d+/status')
+# Seconds between status reads while an order is pending
+STATUS_POLL_INTERVAL = 0.5
+
+
+class AsyncCatalog:
+    """Makes sure catalog_cache has a snapshot without blocking the event loop.
+
+    ``fetch`` is an async callable that returns the feed as a list. It
+    defaults to httpx when that is installed. Without it, the cache's own
+    blocking fetch runs on ``executor``; concurrent waiters still share it.
+    """
+
+    def __init__(self, cache, executor, fetch=None, url=catalog.CATALOG_URL):
+        self.cache = cache
+        self.executor = executor
+        self.url = url
+        self._fetch = fetch
+        self._client = None
+        self._pending = None
+
+    async def ensure(self):
+        if not self.cache.needs_fetch():
+            return
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._load())
+            self._pending.add_done_callback(self._clear)
+        try:
+            await asyncio.shield(self._pending)
+        except Exception as e:
+            # The handler retries through the cache and reports the error as usual
+            logger.warning('Catalog fetch failed: %s', e)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _clear(self, future):
+        self._pending = None
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        fetch = self._fetch
+        if fetch is None and httpx is not None:
+            fetch = self._fetch_with_httpx
+        if fetch is None:
+            await loop.run_in_executor(self.executor, self.cache.get)
+            return
+        products = await fetch()
+        # Building the snapshot is CPU work; keep it off the loop
+        await loop.run_in_executor(self.executor, self.cache.prime, products)
+
+    async def _fetch_with_httpx(self):
+        if self._client is None:
+            connect, read = http_client.client.timeout
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(read, connect=connect))
+        response = await self._client.get(self.url)
+        response.raise_for_status()
+        return response.json()
+
+
+class WSGIBridge:
+    """Runs a WSGI app for ASGI HTTP requests, one pool thread per request.
+
+    The whole request, including iterating a streamed body, stays on one
+    thread because Flask's contexts can't move between threads. Each chunk
+    is handed to the event loop to send, and the thread waits for the send
+    to finish, so slow clients apply backpressure.
+    """
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        body = await self._read_body(receive)
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(self.executor, self._run, self._environ(scope, body), send_from_thread)
+
+    def _run(self, environ, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        def send_start():
+            # Deferred to the first chunk, as WSGI allows start_response to change until then
+            if not response.get('sent'):
+                send({'type': 'http.response.start', 'status': response['status'],
+                      'headers': response['headers']})
+                response['sent'] = True
+
+        body = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in body:
+                send_start()
+                if chunk:
+                    send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_start()
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI wants the raw path bytes as latin-1 text
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        environ.setdefault('CONTENT_LENGTH', str(len(body)))
+        return environ
+
+
+class OrderStatusPoller:
+    """Long-polls an order's status without holding a pool thread while it waits.
+
+    The handler is called without ``wait``, so each read returns at once.
+    While the order is still pending the poller sleeps on the event loop
+    and reads again, until the order settles or the wait runs out. Only
+    the final response is sent.
+    """
+
+    def __init__(self, bridge, max_wait, interval=STATUS_POLL_INTERVAL):
+        self.bridge = bridge
+        self.max_wait = max_wait
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send, wait):
+        query = [(name, value) for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1'))
+                 if name != 'wait']
+        scope = dict(scope, query_string=urlencode(query).encode('latin-1'))
+        deadline = time.monotonic() + min(wait, self.max_wait)
+        while True:
+            messages = []
+
+            async def collect(message):
+                messages.append(message)
+
+            await self.bridge(scope, self._no_body, collect)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._pending(messages):
+                break
+            await asyncio.sleep(min(remaining, self.interval))
+        for message in messages:
+            await send(message)
+
+    @staticmethod
+    async def _no_body():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    @staticmethod
+    def _pending(messages):
+        start = messages[0]
+        if start['status'] != 200 or any(name == b'content-encoding' for name, _ in start['headers']):
+            return False
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        return json.loads(body).get('status') == 'pending'
+
+    @staticmethod
+    def requested_wait(scope):
+        """The ``wait`` a status request asks for, or 0 when it doesn't long-poll."""
+        if scope['method'] != 'GET' or not ORDER_STATUS_PATH.fullmatch(scope['path']):
+            return 0
+        query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        try:
+            return max(float(query.get('wait', 0)), 0)
+        except ValueError:
+            # Let the handler treat it as it would any other request
+            return 0
+
+
+class BackendASGI:
+    def __init__(self, wsgi_app, threads=16, fetch_catalog=None):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='backend-db')
+        self.bridge = WSGIBridge(wsgi_app, self.executor)
+        self.catalog = AsyncCatalog(catalog_cache, self.executor, fetch=fetch_catalog)
+        self.order_status = OrderStatusPoller(self.bridge, wsgi_app.config['ORDER_STATUS_MAX_WAIT'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if not use_local_catalog() and scope['path'].startswith(CATALOG_PATHS):
+                await self.catalog.ensure()
+            wait = OrderStatusPoller.requested_wait(scope)
+            if wait:
+                await self.order_status(scope, receive, send, wait)
+            else:
+                await self.bridge(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close'})
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await loop.run_in_executor(self.executor, create_database)
+                start_catalog_sync()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                catalog_sync_job.stop()
+                await self.catalog.close()
+                await loop.run_in_executor(self.executor, http_client.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = BackendASGI(flask_app, threads=int(os.environ.get('ASGI_DB_THREADS', 16)))
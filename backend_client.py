@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+
+import http_client
+
+
+class BackendResponse:
+    """Mimics the parts of ``requests.Response`` the frontend uses."""
+
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise BackendError(self.status_code, self._data)
+
+
+class BackendError(Exception):
+    def __init__(self, status_code, data):
+        super().__init__(f'Backend returned {status_code}: {data}')
+        self.status_code = status_code
+        self.data = data
+
+
+class HttpBackend:
+    """Talks to backend_api over HTTP, for split deployments.
+
+    Catalog and order reads are revalidated with If-None-Match. When the
+    backend answers 304, the copy remembered from the last 200 is reused
+    instead of downloading the body again.
+    """
+
+    def __init__(self, base_url='http://localhost:5001', etag_cache_size=256):
+        self.base_url = base_url.rstrip('/')
+        self.api_url = f'{self.base_url}/api'
+        self.etag_cache_size = etag_cache_size
+        self._etag_cache = OrderedDict()
+        self._etag_lock = threading.Lock()
+
+    def _revalidating_get(self, url, params=None):
+        key = (url, tuple(sorted((params or {}).items())))
+        with self._etag_lock:
+            cached = self._etag_cache.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+
+        response = http_client.get(url, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            with self._etag_lock:
+                if key in self._etag_cache:
+                    self._etag_cache.move_to_end(key)
+            return BackendResponse(200, cached[1])
+
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag:
+            data = response.json()
+            with self._etag_lock:
+                self._etag_cache[key] = (etag, data)
+                self._etag_cache.move_to_end(key)
+                while len(self._etag_cache) > self.etag_cache_size:
+                    self._etag_cache.popitem(last=False)
+            return BackendResponse(200, data)
+        return response
+
+    def products(self, params=None):
+        return self._revalidating_get(f'{self.base_url}/products', params=params)
+
+    def categories(self):
+        return self._revalidating_get(f'{self.base_url}/products/categories')
+
+    def register(self, data):
+        return http_client.post(f'{self.api_url}/register', json=data)
+
+    def login(self, data):
+        return http_client.post(f'{self.api_url}/login', json=data)
+
+    def cart(self, user_id):
+        return http_client.get(f'{self.api_url}/cart', params={'user_id': user_id})
+
+    def add_to_cart(self, data):
+        return http_client.post(f'{self.api_url}/cart/add', json=data)
+
+    def update_cart(self, data):
+        return http_client.patch(f'{self.api_url}/cart', json=data)
+
+    def update_cart_item(self, data):
+        return http_client.put(f'{self.api_url}/cart/update', json=data)
+
+    def remove_from_cart(self, cart_item_id):
+        return http_client.delete(f'{self.api_url}/cart/remove', params={'cart_item_id': cart_item_id})
+
+    def checkout(self, data):
+        # Safe to retry once the request carries an idempotency key
+        return http_client.post(f'{self.api_url}/checkout', json=data,
+                                idempotent='idempotency_key' in data)
+
+    def order(self, order_id):
+        return self._revalidating_get(f'{self.api_url}/orders/{order_id}')
+
+    def order_status(self, order_id, wait=0):
+        # The backend may hold a long-poll open for ``wait`` seconds
+        connect_timeout, read_timeout = http_client.client.timeout
+        return http_client.get(f'{self.api_url}/orders/{order_id}/status', params={'wait': wait},
+                               timeout=(connect_timeout, read_timeout + wait))
+
+
+class LocalBackend:
+    """Calls backend_api's service functions directly in this process.
+
+    Skips JSON encoding, the loopback socket and the backend's own worker
+    pool. Each call runs inside a backend app context so it gets its own
+    database session.
+    """
+
+    def __init__(self):
+        # Imported lazily so split deployments never load the backend
+        import backend_api
+        self._api = backend_api
+        # No backend process runs the migrations in this mode, so do it
+        # here before any service touches an older database
+        backend_api.create_database()
+        # Nor does any backend request start the catalog sync
+        backend_api.start_catalog_sync()
+
+    def _call(self, service, *args):
+        with self._api.app.app_context():
+            payload, status = service(*args)
+        return BackendResponse(status, payload)
+
+    def products(self, params=None):
+        return self._call(self._api.search_products, params or {})
+
+    def categories(self):
+        return self._call(self._api.product_categories)
+
+    def register(self, data):
+        return self._call(self._api.register_user, data)
+
+    def login(self, data):
+        return self._call(self._api.login_user, data)
+
+    def cart(self, user_id):
+        return self._call(self._api.cart_contents, user_id)
+
+    def add_to_cart(self, data):
+        return self._call(self._api.add_cart_item, data)
+
+    def update_cart(self, data):
+        return self._call(self._api.apply_cart_operations, data)
+
+    def update_cart_item(self, data):
+        return self._call(self._api.update_cart_quantity, data)
+
+    def remove_from_cart(self, cart_item_id):
+        return self._call(self._api.remove_cart_item, cart_item_id)
+
+    def checkout(self, data):
+        return self._call(self._api.place_checkout, data)
+
+    def order(self, order_id):
+        return self._call(self._api.order_details, int(order_id))
+
+    def order_status(self, order_id, wait=0):
+        return self._call(self._api.order_status, int(order_id), wait)
+
+
+def create_backend(mode='http', base_url='http://localhost:5001'):
+    if mode == 'inprocess':
+        return LocalBackend()
+    if mode == 'http':
+        return HttpBackend(base_url)
+    raise ValueError(f'Unknown BACKEND_MODE: {mode}')
@@ -0,0 +1,21 @@
+import argparse
+
+from backend_api import app, db, Order, OrderItem, OrderJob, sales_rollups
+
+parser = argparse.ArgumentParser(description='Rebuild the sales rollup tables from existing orders.')
+parser.add_argument('--chunk-size', type=int, default=1000,
+                    help='Orders read and written per transaction')
+args = parser.parse_args()
+
+with app.app_context():
+    db.create_all()
+
+
+def report(counted, last_id, high_water):
+    print(f'{counted} orders counted, up to order {last_id} of {high_water}.')
+
+
+with app.app_context():
+    counted = sales_rollups.rebuild(db.session, Order, OrderItem, OrderJob,
+                                    chunk_size=args.chunk_size, progress=report)
+print(f'Sales rollups rebuilt from {counted} orders.')
@@ -0,0 +1,84 @@
+"""Login throughput benchmark for the backend's password hashing.
+
+    python -m benchmarks.bench_login --threads 16 --seconds 10 --hash-workers 4
+    python -m benchmarks.bench_login --method pbkdf2:sha256:100000 --hash-workers 0
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+USERS = 50
+PASSWORD = 'correct horse battery staple'
+
+
+def run_benchmark(threads=8, seconds=5.0, method=None, hash_workers=2, max_queue=32):
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    if method:
+        os.environ['PASSWORD_HASH_METHOD'] = method
+    os.environ['PASSWORD_HASH_WORKERS'] = str(hash_workers)
+    os.environ['PASSWORD_HASH_MAX_QUEUE'] = str(max_queue)
+
+    import backend_api
+    from sqlalchemy import insert
+
+    backend_api.create_database()
+    with backend_api.app.app_context():
+        # Every user shares one hash so setup costs a single hashing round
+        pwhash = backend_api.password_hasher.hash(PASSWORD)
+        backend_api.db.session.execute(insert(backend_api.User), [
+            {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': pwhash}
+            for i in range(USERS)
+        ])
+        backend_api.db.session.commit()
+
+    client = backend_api.app.test_client()
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(n):
+        i = n
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/api/login', json={'username': f'bench{i % USERS}', 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            i += threads
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    return {
+        'method': backend_api.password_hasher.method,
+        'hash_workers': hash_workers,
+        'threads': threads,
+        'logins': ok,
+        'logins_per_second': ok / elapsed,
+        'statuses': statuses,
+        'p50': latencies[len(latencies) // 2] if latencies else None,
+        'p95': latencies[int(len(latencies) * 0.95)] if latencies else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--method', help='werkzeug hash method, e.g. pbkdf2:sha256:100000 or scrypt')
+    parser.add_argument('--hash-workers', type=int, default=2, help='0 hashes on the request thread')
+    parser.add_argument('--max-queue', type=int, default=32)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.threads, args.seconds, args.method, args.hash_workers, args.max_queue)))
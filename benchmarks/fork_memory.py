@@ -0,0 +1,102 @@
+"""Per-worker memory of the preloaded catalog, right after fork and after refreshes.
+
+Builds the catalog and its search index once in the parent and freezes
+them out of the garbage collector, as gunicorn's master does in
+prepare_for_fork(). Then it forks workers that report their private dirty
+memory just after the fork and again after a TTL refresh: once with
+workers that refetch the same feed, once with workers that get a changed
+one. Both refreshes grow the heap by what parsing the feed took; the
+difference between them is the catalog each worker copies for itself.
+Linux only, as it reads /proc/self/smaps_rollup.
+
+    python -m benchmarks.fork_memory --products 20000 --workers 4
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+
+from catalog import CatalogCache
+from product_search import ProductIndex
+
+from benchmarks.stubs import make_catalog
+
+
+def private_dirty_kb():
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+    raise RuntimeError('Private_Dirty missing from /proc/self/smaps_rollup')
+
+
+class Worker:
+    """What one worker holds: the cache, and an index rebuilt only for a new store."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.store = None
+        self.index = None
+
+    def serve(self):
+        snapshot = self.cache.get()
+        if snapshot.store is not self.store:
+            self.index = ProductIndex(snapshot.products)
+            self.store = snapshot.store
+        return self.index
+
+
+def _child(worker, now, feed, seed, results):
+    gc.collect()
+    after_fork = private_dirty_kb()
+    feed[0] = seed
+    # Past ttl + stale_ttl, so get() refetches inline
+    now[0] += worker.cache.ttl + worker.cache.stale_ttl + 1
+    worker.serve()
+    gc.collect()
+    results.put((after_fork, private_dirty_kb()))
+
+
+def run_benchmark(products=20000, workers=4):
+    feed = [0]
+    # Serialized, so each fetch parses fresh objects like a real one does
+    feeds = {seed: json.dumps(make_catalog(products, seed=seed)) for seed in (0, 1)}
+    now = [0.0]
+    cache = CatalogCache(fetch=lambda: json.loads(feeds[feed[0]]), clock=lambda: now[0])
+    worker = Worker(cache)
+    worker.serve()
+    gc.collect()
+    gc.freeze()
+
+    # Mean private dirty memory per worker, in MB
+    report = {'products': products, 'workers': workers}
+    context = multiprocessing.get_context('fork')
+    for name, seed in (('unchanged_feed', 0), ('changed_feed', 1)):
+        results = context.Queue()
+        children = [
+            context.Process(target=_child, args=(worker, now, feed, seed, results))
+            for _ in range(workers)
+        ]
+        for child in children:
+            child.start()
+        samples = [results.get() for _ in children]
+        for child in children:
+            child.join()
+        report[name] = {
+            'after_fork_mb': round(sum(sample[0] for sample in samples) / len(samples) / 1024, 1),
+            'after_refresh_mb': round(sum(sample[1] for sample in samples) / len(samples) / 1024, 1),
+        }
+    gc.unfreeze()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.products, args.workers), indent=2))
+
+
+if __name__ == '__main__':
+    main()
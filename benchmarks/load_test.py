@@ -0,0 +1,340 @@
+"""Load test for frontend_app or backend_api against local upstream stubs.
+
+The stubs, the backend and (for the frontend target) the frontend each run
+in their own process on a local port, as they would in a split deployment.
+Simulated shoppers then send a weighted mix of home, cart, add_to_cart,
+checkout and place_order requests. The report gives throughput and
+p50/p95/p99 latency per route.
+
+An action counts as an error when it didn't do what it was for, not only
+when it returned a 5xx. The frontend reports most failures as a redirect
+or a flashed message, so each shopper checks where it was sent and, for
+add_to_cart, what the cart page it lands on says. Shoppers remember
+whether their cart has items, so checking out an empty cart is expected
+to be turned away rather than counted as an error.
+
+    python -m benchmarks.load_test --target frontend --users 16 --seconds 30 --output before.json
+    python -m benchmarks.load_test --target frontend --users 16 --seconds 30 --compare before.json
+    python -m benchmarks.load_test --target backend --latency 0.05 --failure-rate 0.02
+"""
+import argparse
+import importlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+
+# Relative weights of each action in a shopper's session
+DEFAULT_MIX = {'home': 50, 'add_to_cart': 20, 'cart': 15, 'checkout': 10, 'place_order': 5}
+SHIPPING_FORM = {
+    'firstName': 'Load', 'lastName': 'Test', 'address': '1 Main St', 'city': 'Springfield',
+    'state': 'IL', 'zip': '62701', 'phone': '555-0100'
+}
+SHIPPING_INFO = {'address': '1 Main St', 'city': 'Springfield', 'state': 'IL', 'zip': '62701'}
+# Logging in is not what this measures, so setup uses a cheap hash
+SETUP_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
+def _serve(name, port, env, stub_options):
+    os.environ.update(env)
+    # Keep server chatter out of the report printed on stdout
+    sys.stdout = open(os.devnull, 'w')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from werkzeug.serving import make_server
+
+    if name == 'upstream':
+        from benchmarks.stubs import stub_app
+        app = stub_app(**stub_options)
+    else:
+        module = importlib.import_module(name)
+        if hasattr(module, 'create_database'):
+            module.create_database()
+        app = module.app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f'Server on port {port} exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Server on port {port} did not start within {timeout}s')
+
+
+def _redirects_to(response, path):
+    return response.status_code == 302 and urlsplit(response.headers.get('Location', '')).path == path
+
+
+class _FrontendShopper:
+    """One logged-in browser session against frontend_app.
+
+    Each action returns whether it succeeded.
+    """
+
+    def __init__(self, base_url, name, product_ids, rng):
+        self.base_url = base_url
+        self.product_ids = product_ids
+        self.rng = rng
+        self.has_items = False
+        self.session = requests.Session()
+        self.session.post(f'{base_url}/register', data={
+            'username': name, 'email': f'{name}@example.com', 'password': 'pw'
+        }, allow_redirects=False)
+        response = self.session.post(f'{base_url}/login', data={'username': name, 'password': 'pw'},
+                                     allow_redirects=False)
+        if not _redirects_to(response, '/'):
+            raise RuntimeError(f'Could not log in {name}: {response.status_code}')
+
+    def home(self):
+        response = self.session.get(f'{self.base_url}/', allow_redirects=False)
+        return response.status_code == 200 and b'Products are temporarily unavailable' not in response.content
+
+    def cart(self):
+        return self.session.get(f'{self.base_url}/cart', allow_redirects=False).status_code == 200
+
+    def add_to_cart(self):
+        product_id = self.rng.choice(self.product_ids)
+        response = self.session.post(f'{self.base_url}/cart/add/{product_id}',
+                                     data={'quantity': self.rng.randint(1, 3)}, allow_redirects=False)
+        if not _redirects_to(response, '/cart'):
+            return False
+        # Success and failure both land on the cart; its flash tells them apart
+        page = self.session.get(f'{self.base_url}/cart', allow_redirects=False)
+        added = page.status_code == 200 and b'Item added to cart!' in page.content
+        self.has_items = self.has_items or added
+        return added
+
+    def checkout(self):
+        response = self.session.get(f'{self.base_url}/checkout', allow_redirects=False)
+        if not self.has_items:
+            return _redirects_to(response, '/cart')
+        return response.status_code == 200
+
+    def place_order(self):
+        data = dict(SHIPPING_FORM, idempotency_key=uuid.uuid4().hex)
+        response = self.session.post(f'{self.base_url}/place-order', data=data, allow_redirects=False)
+        if not self.has_items:
+            # An empty cart is sent back to checkout
+            return _redirects_to(response, '/checkout')
+        # The confirmation or pending-order page; a failure redirects to checkout
+        placed = response.status_code == 200
+        if placed:
+            self.has_items = False
+        return placed
+
+
+class _BackendShopper:
+    """The same session expressed as calls to backend_api's JSON routes."""
+
+    def __init__(self, base_url, name, product_ids, rng):
+        self.base_url = base_url
+        self.product_ids = product_ids
+        self.rng = rng
+        self.has_items = False
+        self.session = requests.Session()
+        self.session.post(f'{base_url}/api/register', json={
+            'username': name, 'email': f'{name}@example.com', 'password': 'pw'
+        })
+        response = self.session.post(f'{base_url}/api/login', json={'username': name, 'password': 'pw'})
+        response.raise_for_status()
+        self.user_id = response.json()['user_id']
+
+    def home(self):
+        return self.session.get(f'{self.base_url}/products').status_code == 200
+
+    def cart(self):
+        return self.session.get(f'{self.base_url}/api/cart', params={'user_id': self.user_id}).status_code == 200
+
+    def add_to_cart(self):
+        response = self.session.post(f'{self.base_url}/api/cart/add', json={
+            'user_id': self.user_id,
+            'product_id': self.rng.choice(self.product_ids),
+            'quantity': self.rng.randint(1, 3)
+        })
+        added = response.status_code == 200
+        self.has_items = self.has_items or added
+        return added
+
+    def checkout(self):
+        # The checkout page only reads the cart
+        return self.cart()
+
+    def place_order(self):
+        response = self.session.post(f'{self.base_url}/api/checkout', json={
+            'user_id': self.user_id,
+            'shipping_info': SHIPPING_INFO,
+            'idempotency_key': uuid.uuid4().hex
+        })
+        if not self.has_items:
+            return response.status_code == 400
+        if response.status_code not in (200, 202):
+            return False
+        self.has_items = False
+        # Like the frontend, follow up with the order details
+        order_id = response.json()['order_id']
+        return self.session.get(f'{self.base_url}/api/orders/{order_id}').status_code == 200
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(math.ceil(p / 100 * len(ordered)) - 1, 0))]
+
+
+def _summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': len(ordered) / elapsed,
+        'p50': _percentile(ordered, 50),
+        'p95': _percentile(ordered, 95),
+        'p99': _percentile(ordered, 99),
+        'max': ordered[-1] if ordered else None
+    }
+
+
+def run_load_test(target='frontend', users=8, seconds=10.0, mix=None, catalog_size=500,
+                  latency=0.0, failure_rate=0.0, seed=0):
+    """Start the servers, run the mix for ``seconds`` and return the report."""
+    mix = mix or DEFAULT_MIX
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    ports = {'upstream': _free_port(), 'backend_api': _free_port(), 'frontend_app': _free_port()}
+    upstream = f"http://127.0.0.1:{ports['upstream']}"
+    env = {
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'CATALOG_URL': f'{upstream}/freelancer/products',
+        'EXCHANGE_RATE_URL': upstream + '/v6/{api_key}/latest/{base}',
+        'EXCHANGE_RATE_API_KEY': 'stub',
+        'EXCHANGE_RATE_SNAPSHOT': os.path.join(workdir, 'exchange_rates.json'),
+        'BACKEND_MODE': 'http',
+        'BACKEND_URL': f"http://127.0.0.1:{ports['backend_api']}",
+        'PASSWORD_HASH_METHOD': SETUP_HASH_METHOD,
+        'PASSWORD_HASH_WORKERS': '0',
+    }
+    stub_options = {'catalog_size': catalog_size, 'latency': latency,
+                    'failure_rate': failure_rate, 'seed': seed}
+    names = ['upstream', 'backend_api'] + (['frontend_app'] if target == 'frontend' else [])
+
+    ctx = multiprocessing.get_context('spawn')
+    processes = []
+    try:
+        for name in names:
+            process = ctx.Process(target=_serve, args=(name, ports[name], env, stub_options), daemon=True)
+            process.start()
+            processes.append(process)
+            _wait_for_port(ports[name], process)
+
+        shopper_class = _FrontendShopper if target == 'frontend' else _BackendShopper
+        base_url = f"http://127.0.0.1:{ports[names[-1]]}"
+        product_ids = [f'p{i}' for i in range(catalog_size)]
+        actions = list(mix)
+        weights = [mix[action] for action in actions]
+        samples = {action: [] for action in actions}
+        errors = {action: 0 for action in actions}
+        lock = threading.Lock()
+        shoppers = [shopper_class(base_url, f'shopper{n}', product_ids, random.Random(seed + n))
+                    for n in range(users)]
+        start = threading.Barrier(users + 1)
+
+        def shop(shopper):
+            rng = shopper.rng
+            start.wait()
+            while time.perf_counter() < deadline:
+                action = rng.choices(actions, weights)[0]
+                started = time.perf_counter()
+                try:
+                    failed = not getattr(shopper, action)()
+                except requests.exceptions.RequestException:
+                    failed = True
+                elapsed = time.perf_counter() - started
+                with lock:
+                    samples[action].append(elapsed)
+                    errors[action] += failed
+
+        threads = [threading.Thread(target=shop, args=(shopper,)) for shopper in shoppers]
+        for t in threads:
+            t.start()
+        deadline = time.perf_counter() + seconds
+        started = time.perf_counter()
+        start.wait()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    all_latencies = [value for values in samples.values() for value in values]
+    return {
+        'target': target,
+        'users': users,
+        'seconds': seconds,
+        'mix': mix,
+        'upstream': stub_options,
+        'total': _summarize(all_latencies, sum(errors.values()), elapsed),
+        'routes': {action: _summarize(samples[action], errors[action], elapsed) for action in actions}
+    }
+
+
+def compare(baseline, result):
+    """Per-route latency changes against an earlier report, as fractions."""
+    changes = {}
+    for route, current in dict(result['routes'], total=result['total']).items():
+        previous = baseline['total'] if route == 'total' else baseline['routes'].get(route)
+        if not previous:
+            continue
+        changes[route] = {
+            key: (current[key] - previous[key]) / previous[key]
+            for key in ('p50', 'p95', 'p99', 'throughput')
+            if current[key] is not None and previous[key]
+        }
+    return changes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['frontend', 'backend'], default='frontend')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--mix', type=json.loads, help='JSON weights, e.g. \'{"home": 80, "cart": 20}\'')
+    parser.add_argument('--catalog-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='upstream latency in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of upstream calls that fail')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report to this JSON file')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    report = run_load_test(args.target, args.users, args.seconds, args.mix, args.catalog_size,
+                           args.latency, args.failure_rate, args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            report['changes'] = compare(json.load(f), report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
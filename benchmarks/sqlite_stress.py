@@ -0,0 +1,134 @@
+"""Multi-process write stress test for the backend's SQLite configuration.
+
+Each worker process imports backend_api against a shared database file and
+hammers add-to-cart and checkout through the Flask test client, the way
+several gunicorn workers would.
+
+    python -m benchmarks.sqlite_stress --workers 4 --requests 500 --compare
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+PRODUCTS = [
+    {'_id': f'p{i}', 'title': f'Product {i}', 'price': 1.0 + i, 'image': f'p{i}.png'}
+    for i in range(20)
+]
+USERS = 8
+SHIPPING_INFO = {'address': '1 Main St', 'city': 'Springfield', 'state': 'IL', 'zip': '62701'}
+
+
+def _worker(requests_per_worker, seed, ready, go, results):
+    import backend_api
+    from sqlalchemy.exc import OperationalError
+
+    backend_api.app.config['PROPAGATE_EXCEPTIONS'] = True
+    backend_api.catalog_cache.prime(PRODUCTS)
+    client = backend_api.app.test_client()
+    rng = random.Random(seed)
+    ok = locked = 0
+    added = 0
+    ready.put(seed)
+    go.wait()
+
+    for i in range(requests_per_worker):
+        user_id = rng.randint(1, USERS)
+        try:
+            if i % 10 == 9:
+                response = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO})
+            else:
+                response = client.post('/api/cart/add', json={
+                    'user_id': user_id,
+                    'product_id': rng.choice(PRODUCTS)['_id'],
+                    'quantity': 1
+                })
+                added += response.status_code == 200
+            ok += response.status_code < 500
+        except (OperationalError, sqlite3.OperationalError) as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+
+    results.put({'ok': ok, 'locked': locked, 'added': added})
+
+
+def run_stress(profile='concurrent', workers=4, requests_per_worker=200):
+    """Run one stress round and return throughput and error counts."""
+    db_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    env = {
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'SQLITE_PROFILE': profile,
+    }
+    previous = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        setup = ctx.Process(target=_setup_database)
+        setup.start()
+        setup.join()
+
+        ready, go, results = ctx.Queue(), ctx.Event(), ctx.Queue()
+        processes = [
+            ctx.Process(target=_worker, args=(requests_per_worker, seed, ready, go, results))
+            for seed in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        # Time only the requests, not interpreter start-up and imports
+        for _ in processes:
+            ready.get()
+        started = time.perf_counter()
+        go.set()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    total = workers * requests_per_worker
+    return {
+        'profile': profile,
+        'workers': workers,
+        'requests': total,
+        'ok': sum(o['ok'] for o in outcomes),
+        'locked': sum(o['locked'] for o in outcomes),
+        'added': sum(o['added'] for o in outcomes),
+        'seconds': elapsed,
+        'requests_per_second': total / elapsed,
+        'database': db_path
+    }
+
+
+def _setup_database():
+    import backend_api
+    from sqlalchemy import insert
+
+    backend_api.create_database()
+    with backend_api.app.app_context():
+        backend_api.db.session.execute(insert(backend_api.User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com'} for i in range(1, USERS + 1)
+        ])
+        backend_api.db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500, help='requests per worker')
+    parser.add_argument('--profile', default='concurrent')
+    parser.add_argument('--compare', action='store_true', help="also run SQLite's default profile")
+    args = parser.parse_args()
+
+    profiles = ['default', args.profile] if args.compare else [args.profile]
+    for profile in profiles:
+        print(json.dumps(run_stress(profile, args.workers, args.requests)))
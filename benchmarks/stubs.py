@@ -0,0 +1,94 @@
+"""Local stand-ins for the product feed and the exchange-rate API.
+
+One WSGI app answers both upstreams, so the apps can be benchmarked
+without network access:
+
+    python -m benchmarks.stubs --port 5050 --catalog-size 2000 --latency 0.05 --failure-rate 0.01
+    CATALOG_URL=http://127.0.0.1:5050/freelancer/products \\
+    EXCHANGE_RATE_URL='http://127.0.0.1:5050/v6/{api_key}/latest/{base}' \\
+    EXCHANGE_RATE_API_KEY=stub python backend_api.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+CATEGORIES = ['lips', 'eyes', 'face', 'skincare', 'hair', 'nails', 'fragrance', 'tools']
+WORDS = ['matte', 'glow', 'volume', 'silk', 'velvet', 'hydrating', 'long', 'wear',
+         'rose', 'nude', 'classic', 'bold', 'soft', 'shine', 'natural', 'vegan']
+RATES = {'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'INR': 83.1, 'JPY': 149.5, 'CAD': 1.36}
+
+
+def make_catalog(size, seed=0):
+    """Deterministic feed of ``size`` products in the upstream's shape."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(size):
+        title = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+        products.append({
+            '_id': f'p{i}',
+            'title': f'{title} {i}',
+            'category': rng.choice(CATEGORIES),
+            # Real descriptions are long; checkout and cart never read them
+            'description': ' '.join(rng.choice(WORDS) for _ in range(60)),
+            'price': round(rng.uniform(2, 120), 2),
+            'rentprice': None,
+            'size': rng.choice([None, '10ml', '30ml', '50ml']),
+            'image': f'https://example.com/images/p{i}.png',
+            'rating': {'rate': round(rng.uniform(1, 5), 1), 'count': rng.randint(0, 500)}
+        })
+    return products
+
+
+def stub_app(catalog_size=500, latency=0.0, failure_rate=0.0, seed=0):
+    """WSGI app serving /freelancer/products and /v6/<key>/latest/<base>.
+
+    Every request sleeps ``latency`` seconds, then fails with a 503 with
+    probability ``failure_rate``.
+    """
+    catalog_body = json.dumps(make_catalog(catalog_size, seed)).encode('utf-8')
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def app(environ, start_response):
+        if latency:
+            time.sleep(latency)
+        with lock:
+            failed = rng.random() < failure_rate
+        path = environ.get('PATH_INFO', '')
+
+        if failed:
+            status, body = '503 Service Unavailable', b'{"error": "stub failure"}'
+        elif path == '/freelancer/products':
+            status, body = '200 OK', catalog_body
+        elif path.startswith('/v6/') and '/latest/' in path:
+            base = path.rsplit('/', 1)[-1]
+            status, body = '200 OK', json.dumps({
+                'result': 'success',
+                'base_code': base,
+                'conversion_rates': RATES
+            }).encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'{"error": "not found"}'
+
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
+    return app
+
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--catalog-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+    run_simple('127.0.0.1', args.port, stub_app(args.catalog_size, args.latency, args.failure_rate),
+               threaded=True)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import http_client
+from catalog_store import CatalogStore
+
+try:
+    import ijson
+except ImportError:  # ijson is optional; without it the feed is parsed in one go
+    ijson = None
+
+# External product feed
+CATALOG_URL = os.environ.get('CATALOG_URL', 'http://shopa.beauty:5000/freelancer/products')
+
+
+def iter_catalog(url=CATALOG_URL):
+    """Yield feed entries one at a time while the body is still downloading."""
+    response = http_client.get(url, stream=True)
+    try:
+        response.raise_for_status()
+        if ijson is None:
+            yield from response.json()
+            return
+        response.raw.decode_content = True
+        # use_float keeps prices as floats rather than Decimal
+        yield from ijson.items(response.raw, 'item', use_float=True)
+    finally:
+        response.close()
+
+
+def fetch_catalog(url=CATALOG_URL):
+    return list(iter_catalog(url))
+
+
+class CatalogSnapshot:
+    """One immutable copy of the upstream catalog plus its id index.
+
+    The feed's dicts are only kept long enough to hash them; the snapshot
+    itself holds a compact CatalogStore.
+    """
+
+    def __init__(self, products, fetched_at, previous=None):
+        products = list(products)
+        # Content hash, identical in every worker that fetched the same feed
+        self.version = hashlib.sha1(
+            json.dumps(products, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        if previous is not None and previous.version == self.version:
+            # Unchanged feed: keep the store already built. In a gunicorn
+            # worker that is the copy preloaded by the master, so routine
+            # refreshes leave it in pages shared with every other worker
+            self.store = previous.store
+        else:
+            self.store = CatalogStore(products)
+        self.products = self.store.records
+        self.by_id = self.store
+        self.fetched_at = fetched_at
+
+
+class _PendingFetch:
+    def __init__(self):
+        self.event = threading.Event()
+        self.snapshot = None
+        self.error = None
+
+
+class CatalogCache:
+    """TTL cache in front of the product feed.
+
+    Fresh snapshots are served directly. Once a snapshot is older than
+    ``ttl`` it is still served for up to ``stale_ttl`` more seconds while a
+    background thread refreshes it. Concurrent misses share a single
+    upstream fetch.
+    """
+
+    def __init__(self, fetch=fetch_catalog, ttl=60, stale_ttl=600, clock=time.monotonic):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._pending = None
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+
+    def get(self):
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                age = self._clock() - snapshot.fetched_at
+                if age < self.ttl:
+                    self._stats['hits'] += 1
+                    return snapshot
+                if age < self.ttl + self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    self._refresh_in_background()
+                    return snapshot
+
+            self._stats['misses'] += 1
+            pending = self._pending
+            leader = pending is None
+            if leader:
+                pending = self._pending = _PendingFetch()
+            else:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            self._refresh(pending)
+        pending.event.wait()
+
+        if pending.error is not None:
+            # Serve an expired copy rather than failing outright
+            if snapshot is not None:
+                return snapshot
+            raise pending.error
+        return pending.snapshot
+
+    def needs_fetch(self):
+        """True when get() would have to wait for the feed instead of serving a snapshot."""
+        with self._lock:
+            snapshot = self._snapshot
+            return snapshot is None or self._clock() - snapshot.fetched_at >= self.ttl + self.stale_ttl
+
+    def products(self):
+        return self.get().products
+
+    def by_id(self):
+        return self.get().by_id
+
+    def prime(self, products):
+        """Install ``products`` as a fresh snapshot, e.g. to warm up before serving."""
+        snapshot = CatalogSnapshot(products, self._clock())
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            snapshot = self._snapshot
+        stats['age'] = None if snapshot is None else self._clock() - snapshot.fetched_at
+        stats['size'] = 0 if snapshot is None else len(snapshot.products)
+        return stats
+
+    def _refresh_in_background(self):
+        # Caller holds self._lock
+        if self._pending is not None:
+            return
+        pending = self._pending = _PendingFetch()
+        thread = threading.Thread(target=self._refresh, args=(pending,), daemon=True)
+        thread.start()
+
+    def _refresh(self, pending):
+        try:
+            snapshot = CatalogSnapshot(self._fetch(), self._clock(), previous=self._snapshot)
+        except Exception as e:
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+                self._pending = None
+            pending.error = e
+        else:
+            with self._lock:
+                self._snapshot = snapshot
+                self._stats['refreshes'] += 1
+                self._pending = None
+            pending.snapshot = snapshot
+        finally:
+            pending.event.set()
@@ -0,0 +1,120 @@
+import sys
+
+# Feed key -> ProductRecord attribute for the flat fields
+_FIELDS = {
+    '_id': 'id',
+    'title': 'title',
+    'category': 'category',
+    'price': 'price',
+    'rentprice': 'rentprice',
+    'size': 'size',
+    'image': 'image',
+}
+
+
+class ProductRecord:
+    """Compact, read-only catalog entry.
+
+    Holds only the fields the cart, checkout and listing need, in slots
+    rather than a per-product dict. The long description lives out of line
+    in the owning CatalogStore. Mapping-style access (``record['price']``,
+    ``record.get('rating')``) mirrors the feed's dicts, so a record can be
+    used anywhere a feed entry was.
+    """
+
+    __slots__ = ('_store', 'row', 'id', 'title', 'category', 'price', 'rentprice',
+                 'size', 'image', 'rating_rate', 'rating_count')
+
+    def __init__(self, store, row, product):
+        rating = product.get('rating') or {}
+        category = product.get('category')
+        self._store = store
+        self.row = row
+        self.id = product['_id']
+        self.title = product['title']
+        # Many products share a category, so share the string too
+        self.category = sys.intern(category) if isinstance(category, str) else category
+        self.price = product.get('price')
+        self.rentprice = product.get('rentprice')
+        self.size = product.get('size')
+        self.image = product.get('image')
+        self.rating_rate = rating.get('rate')
+        self.rating_count = rating.get('count')
+
+    @property
+    def description(self):
+        return self._store.description(self.row)
+
+    def __getitem__(self, key):
+        if key == 'description':
+            return self.description
+        if key == 'rating':
+            return {'rate': self.rating_rate, 'count': self.rating_count}
+        try:
+            return getattr(self, _FIELDS[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """The record in the feed's original shape."""
+        return {
+            '_id': self.id,
+            'title': self.title,
+            'category': self.category,
+            'description': self.description,
+            'price': self.price,
+            'rentprice': self.rentprice,
+            'size': self.size,
+            'image': self.image,
+            'rating': {'rate': self.rating_rate, 'count': self.rating_count}
+        }
+
+
+class CatalogStore:
+    """Immutable catalog built once from the feed.
+
+    ``records`` keeps feed order for listings. Lookups by product id go
+    through one dict to a row number, so a cart or checkout price lookup is
+    a dict probe plus an attribute read and allocates nothing.
+    """
+
+    def __init__(self, products):
+        records = []
+        descriptions = []
+        index = {}
+        for product in products:
+            if product['_id'] in index:
+                continue
+            row = len(records)
+            index[product['_id']] = row
+            records.append(ProductRecord(self, row, product))
+            descriptions.append(product.get('description'))
+        self.records = tuple(records)
+        self._descriptions = tuple(descriptions)
+        self._index = index
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, product_id):
+        return product_id in self._index
+
+    def __getitem__(self, product_id):
+        return self.records[self._index[product_id]]
+
+    def get(self, product_id, default=None):
+        row = self._index.get(product_id)
+        return default if row is None else self.records[row]
+
+    def price(self, product_id):
+        row = self._index.get(product_id)
+        return None if row is None else self.records[row].price
+
+    def description(self, row):
+        return self._descriptions[row]
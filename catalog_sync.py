@@ -0,0 +1,209 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, func, or_, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from catalog import fetch_catalog
+
+logger = logging.getLogger(__name__)
+
+SYNCED_COLUMNS = (
+    'title', 'category', 'description', 'price', 'rentprice',
+    'size', 'image', 'rating_rate', 'rating_count'
+)
+# Columns copied into the model's full-text table, if it has one
+SEARCHED_COLUMNS = ('title', 'description', 'category')
+
+
+def product_row(product):
+    """Map one upstream feed entry onto Product column values."""
+    rating = product.get('rating') or {}
+    return {
+        'id': product['_id'],
+        'title': product['title'],
+        'category': product.get('category'),
+        'description': product.get('description'),
+        'price': product.get('price'),
+        'rentprice': product.get('rentprice'),
+        'size': product.get('size'),
+        'image': product.get('image'),
+        'rating_rate': rating.get('rate'),
+        'rating_count': rating.get('count')
+    }
+
+
+def sync_catalog(session, model, products, prune=True, max_prune_ratio=0.5):
+    """Upsert ``products`` into ``model``'s table, touching only changed rows.
+
+    With ``prune``, products missing from the feed are deleted, unless the
+    feed is empty or would delete more than ``max_prune_ratio`` of the
+    table. That looks like a truncated or broken feed rather than a real
+    change, so those rows are kept and the refusal is logged.
+
+    Inserted and changed rows are stamped with a new ``version``, one more
+    than the highest in the table, so readers can tell the catalog changed.
+    If ``model`` names a ``search_table`` (an FTS5 table, SQLite only), its
+    entries for those rows and the pruned ones are replaced in the same
+    transaction.
+
+    Returns a dict with inserted/updated/deleted/unchanged counts, plus
+    ``kept`` for stale rows a refused prune left in place.
+    """
+    table = model.__table__
+    columns = [table.c.id] + [table.c[name] for name in SYNCED_COLUMNS]
+    existing = {row[0]: tuple(row[1:]) for row in session.execute(select(*columns))}
+
+    to_insert = []
+    to_update = []
+    seen = set()
+    for product in products:
+        row = product_row(product)
+        if row['id'] in seen:
+            continue
+        seen.add(row['id'])
+        current = existing.get(row['id'])
+        if current is None:
+            to_insert.append(row)
+        elif current != tuple(row[name] for name in SYNCED_COLUMNS):
+            to_update.append(row)
+
+    stale_ids = [product_id for product_id in existing if product_id not in seen] if prune else []
+    kept = 0
+    if stale_ids and (not seen or len(stale_ids) > max_prune_ratio * len(existing)):
+        logger.warning(
+            'Catalog sync: not pruning %d of %d products; the feed had %d',
+            len(stale_ids), len(existing), len(seen)
+        )
+        kept = len(stale_ids)
+        stale_ids = []
+
+    if to_insert or to_update:
+        generation = (session.execute(select(func.max(table.c.version))).scalar() or 0) + 1
+        for row in to_insert + to_update:
+            row['version'] = generation
+    if to_insert:
+        # Upsert, so a row another process inserted since we read is updated instead
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={name: stmt.excluded[name] for name in SYNCED_COLUMNS + ('version',)}
+        )
+        session.execute(stmt, to_insert)
+    if to_update:
+        session.execute(update(model), to_update)
+    if stale_ids:
+        session.execute(delete(model).where(model.id.in_(stale_ids)))
+    search_table = getattr(model, 'search_table', None)
+    if search_table and session.get_bind().dialect.name == 'sqlite':
+        reindex(session, search_table, to_insert + to_update, stale_ids)
+    session.commit()
+
+    return {
+        'inserted': len(to_insert),
+        'updated': len(to_update),
+        'deleted': len(stale_ids),
+        'unchanged': len(seen) - len(to_insert) - len(to_update),
+        'kept': kept
+    }
+
+
+def reindex(session, search_table, rows, removed_ids):
+    """Replace the full-text entries of ``rows`` and drop those of ``removed_ids``."""
+    product_ids = [row['id'] for row in rows] + list(removed_ids)
+    if product_ids:
+        session.execute(
+            text(f'DELETE FROM {search_table} WHERE product_id IN :ids')
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': product_ids}
+        )
+    if rows:
+        session.execute(
+            text(
+                f'INSERT INTO {search_table} (product_id, {", ".join(SEARCHED_COLUMNS)})'
+                f' VALUES (:id, {", ".join(":" + name for name in SEARCHED_COLUMNS)})'
+            ),
+            [{name: row[name] for name in ('id',) + SEARCHED_COLUMNS} for row in rows]
+        )
+
+
+class CatalogSyncJob:
+    """Periodically mirrors the upstream catalog into the local Product table.
+
+    Every serving process starts the job, but with a ``lease_model`` only
+    the process holding the lease row syncs; the others just check the
+    lease each interval. The holder renews it before every sync, and once
+    it stops doing so for two intervals another process takes over.
+    """
+
+    LEASE_NAME = 'catalog_sync'
+
+    def __init__(self, app, db, model, interval, fetch=fetch_catalog, max_prune_ratio=0.5,
+                 lease_model=None, clock=datetime.utcnow):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.interval = interval
+        self.fetch = fetch
+        self.max_prune_ratio = max_prune_ratio
+        self.lease_model = lease_model
+        self._clock = clock
+        self.last_result = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread_pid = None
+
+    def run_once(self):
+        with self.app.app_context():
+            self.last_result = sync_catalog(
+                self.db.session, self.model, self.fetch(), max_prune_ratio=self.max_prune_ratio
+            )
+        return self.last_result
+
+    def acquire_lease(self):
+        """Take or renew the sync lease; True when this process should sync."""
+        if self.lease_model is None:
+            return True
+        lease = self.lease_model
+        holder = f'{socket.gethostname()}:{os.getpid()}'
+        now = self._clock()
+        # One statement, so processes starting together can't both win
+        stmt = sqlite_insert(lease).values(
+            name=self.LEASE_NAME, holder=holder, expires_at=now + timedelta(seconds=2 * self.interval)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[lease.name],
+            set_={'holder': stmt.excluded.holder, 'expires_at': stmt.excluded.expires_at},
+            where=or_(lease.holder == holder, lease.expires_at < now)
+        )
+        with self.app.app_context():
+            acquired = self.db.session.execute(stmt).rowcount == 1
+            self.db.session.commit()
+        return acquired
+
+    def start(self):
+        # Threads don't survive a fork, so each process starts its own
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._stop.clear()
+            threading.Thread(target=self._run, name='catalog-sync', daemon=True).start()
+            self._thread_pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.acquire_lease():
+                    result = self.run_once()
+                    logger.info('Catalog sync: %s', result)
+            except Exception:
+                logger.exception('Catalog sync failed')
+            self._stop.wait(self.interval)
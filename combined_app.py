@@ -0,0 +1,21 @@
+import os
+
+# The frontend calls the backend's service functions directly in this mode
+os.environ['BACKEND_MODE'] = 'inprocess'
+
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from backend_api import app as backend_app, create_database, prepare_for_fork, start_catalog_sync
+from frontend_app import app as frontend_app
+
+# Single-process deployment: the pages are served at / and the JSON API
+# stays reachable under /backend for external clients.
+# Run with: gunicorn -c gunicorn.conf.py combined_app:application
+# (gunicorn.conf.py calls prepare_for_fork, which migrates the database,
+# and start_catalog_sync in each worker)
+application = DispatcherMiddleware(frontend_app, {'/backend': backend_app})
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+    create_database()
+    start_catalog_sync()
+    run_simple('localhost', 5000, application, use_reloader=True, use_debugger=True)
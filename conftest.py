@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Keep the test suite away from the real ecommerce.db
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+# Cheap inline hashing keeps the suite fast
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+# Async checkout tests drive the order queue themselves
+os.environ.setdefault('ORDER_WORKERS', '0')
@@ -1,5 +1,7 @@
 from backend_api import app, db
+from migrations import upgrade_schema
 
 with app.app_context():
     db.create_all()
+    upgrade_schema(db.engine)
     print('Database tables created successfully.')
\ No newline at end of file
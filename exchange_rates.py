@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_RATE_URL = os.environ.get(
+    'EXCHANGE_RATE_URL', 'https://v6.exchangerate-api.com/v6/{api_key}/latest/{base}'
+)
+
+
+class ExchangeRateProvider:
+    """Serves conversion rates from memory, falling back to a disk snapshot.
+
+    Rates older than ``ttl`` are still served while a background thread
+    fetches new ones. The snapshot file holds the last rates that were
+    fetched successfully. It is used on cold start and whenever the rates
+    API is failing.
+    """
+
+    def __init__(self, api_key, base='USD', ttl=6 * 3600, snapshot_path=None,
+                 fetch=None, clock=time.time):
+        self.api_key = api_key
+        self.base = base
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._fetch = fetch or self._fetch_from_api
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._rates = None
+        self._fetched_at = None
+        self._stats = {'refreshes': 0, 'refresh_errors': 0, 'snapshot_loads': 0}
+
+    def rates(self):
+        """Return conversion rates, or {} if none have ever been fetched."""
+        with self._lock:
+            if self._rates is None:
+                self._load_snapshot()
+            rates = self._rates
+            stale = rates is None or self._clock() - self._fetched_at >= self.ttl
+            if rates is not None and stale:
+                self._refresh_in_background()
+
+        if rates is None:
+            # Cold start with no snapshot on disk: this is the only blocking fetch
+            self.refresh()
+            rates = self._rates
+        return rates or {}
+
+    @property
+    def version(self):
+        return self._fetched_at
+
+    def refresh(self):
+        if not self.api_key:
+            logger.warning('EXCHANGE_RATE_API_KEY is not set; currency conversion is disabled')
+            return False
+        try:
+            rates = self._fetch()
+        except Exception:
+            logger.exception('Exchange rate refresh failed')
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+                self._refreshing = False
+            return False
+
+        with self._lock:
+            self._rates = rates
+            self._fetched_at = self._clock()
+            self._stats['refreshes'] += 1
+            self._refreshing = False
+            self._save_snapshot()
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['age'] = None if self._fetched_at is None else self._clock() - self._fetched_at
+        return stats
+
+    def _refresh_in_background(self):
+        # Caller holds self._lock
+        if self._refreshing or not self.api_key:
+            return
+        self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def _fetch_from_api(self):
+        url = EXCHANGE_RATE_URL.format(api_key=self.api_key, base=self.base)
+        response = http_client.get(url)
+        response.raise_for_status()
+        data = response.json()
+        if data.get('result', 'success') != 'success':
+            raise ValueError(f"Exchange rate API error: {data.get('error-type')}")
+        return data['conversion_rates']
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            logger.exception('Could not read exchange rate snapshot %s', self.snapshot_path)
+            return
+        if snapshot.get('base') != self.base:
+            return
+        self._rates = snapshot['conversion_rates']
+        self._fetched_at = snapshot['fetched_at']
+        self._stats['snapshot_loads'] += 1
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        tmp_path = f'{self.snapshot_path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'base': self.base,
+                    'fetched_at': self._fetched_at,
+                    'conversion_rates': self._rates
+                }, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            logger.exception('Could not write exchange rate snapshot %s', self.snapshot_path)
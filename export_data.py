@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+
+from backend_api import app, db, EXPORT_TABLES, create_export
+
+parser = argparse.ArgumentParser(description='Export orders, order items and carts for finance and analytics.')
+parser.add_argument('tables', nargs='*', default=sorted(EXPORT_TABLES),
+                    help=f"Tables to export (default: all of {', '.join(sorted(EXPORT_TABLES))})")
+parser.add_argument('--format', choices=['csv', 'jsonl'], default='jsonl')
+parser.add_argument('--gzip', action='store_true', help='Compress each file with gzip')
+parser.add_argument('--output-dir', default='exports', help='Directory the files are written to')
+parser.add_argument('--state', default=None,
+                    help='JSON file holding each table\'s watermark (default: OUTPUT_DIR/watermarks.json)')
+parser.add_argument('--full', action='store_true', help='Ignore saved watermarks and export everything')
+parser.add_argument('--since', help='Only rows created at or after this ISO date/time')
+parser.add_argument('--batch-size', type=int, default=1000, help='Rows read per transaction')
+args = parser.parse_args()
+
+unknown = set(args.tables) - EXPORT_TABLES.keys()
+if unknown:
+    parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+
+os.makedirs(args.output_dir, exist_ok=True)
+state_path = args.state or os.path.join(args.output_dir, 'watermarks.json')
+watermarks = {}
+if os.path.exists(state_path) and not args.full:
+    with open(state_path) as f:
+        watermarks = json.load(f)
+
+with app.app_context():
+    for table in args.tables:
+        export = create_export(table, {
+            'format': args.format,
+            'gzip': args.gzip,
+            'after': watermarks.get(table, 0),
+            'since': args.since,
+            'batch_size': args.batch_size,
+        })
+        watermark = export.prepare(db.session)
+        name, ext = export.filename.split('.', 1)
+        path = os.path.join(args.output_dir, f'{name}-{export.after_id}-{watermark}.{ext}')
+        # Written under a temporary name so a failed run leaves no partial file behind
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in export.chunks(db.session):
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+        watermarks[table] = watermark
+        print(f'{table}: {export.rows} rows written to {path}.')
+
+# Saved only once every file is in place, so a failed run is simply repeated
+with open(state_path + '.tmp', 'w') as f:
+    json.dump(watermarks, f, indent=2)
+os.replace(state_path + '.tmp', state_path)
@@ -0,0 +1,155 @@
+"""Bulk export of orders, order items and carts as CSV or JSON Lines.
+
+Rows are read in id order, ``batch_size`` at a time, and each batch is
+its own short read transaction. A table of any size is exported in
+constant memory, and no transaction stays open long enough to hold up
+checkpoints or writers.
+
+Exports are incremental. Each one stops at the newest id that existed
+when it started and reports that id as its watermark. Passing it back as
+``after_id`` emits only rows added since. The watermark is an id rather
+than created_at: SQLite commits one writer at a time, so ids become
+visible in order. A timestamp taken before a slow commit could land
+behind a watermark that has already moved past it. Rows that can still
+change hold the watermark back: in async checkout an order is stored as
+pending and priced later, so the watermark stops just below the oldest
+order still waiting for the order workers. Newer rows are exported once
+it settles, rather than being emitted early and never again. ``since``
+can trim a first export by creation time. Cart rows are deleted at checkout and
+their ids can be reused, so carts are always exported as a full snapshot.
+"""
+import csv
+import io
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import func, select
+
+import fast_json
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class ExportTable:
+    """What to export from one model: its columns, and how to filter by creation time.
+
+    ``unsettled`` is an optional select of the lowest id whose row may
+    still change; exports stop short of it.
+    """
+
+    def __init__(self, name, model, columns, created=None, join=None, incremental=True, unsettled=None):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.created = created
+        self.join = join
+        self.incremental = incremental
+        self.unsettled = unsettled
+
+    @property
+    def column_names(self):
+        return [column.key for column in self.columns]
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class Export:
+    """One export run; call prepare() and then iterate chunks() for the bytes."""
+
+    def __init__(self, table, fmt='jsonl', compress=False, after_id=0, since=None, batch_size=1000):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Unsupported export format: {fmt}')
+        self.table = table
+        self.fmt = fmt
+        self.compress = compress
+        self.after_id = after_id if table.incremental else 0
+        self.since = since
+        self.batch_size = batch_size
+        self.watermark = None
+        self.rows = 0
+
+    @property
+    def mimetype(self):
+        return 'application/gzip' if self.compress else EXPORT_FORMATS[self.fmt]
+
+    @property
+    def filename(self):
+        return f'{self.table.name}.{self.fmt}' + ('.gz' if self.compress else '')
+
+    def prepare(self, session):
+        """Fix the newest id this export covers; it becomes the watermark."""
+        model = self.table.model
+        newest = session.execute(select(func.max(model.id))).scalar() or 0
+        if self.table.unsettled is not None:
+            # Same read transaction, so both come from one snapshot
+            oldest_unsettled = session.execute(self.table.unsettled).scalar()
+            if oldest_unsettled is not None:
+                newest = min(newest, oldest_unsettled - 1)
+        session.rollback()
+        self.watermark = max(newest, self.after_id)
+        return self.watermark
+
+    def chunks(self, session):
+        if self.watermark is None:
+            self.prepare(session)
+        chunks = self._encode(self._batches(session))
+        return _gzip(chunks) if self.compress else chunks
+
+    def _batches(self, session):
+        model = self.table.model
+        last_id = self.after_id
+        while last_id < self.watermark:
+            query = (
+                select(*self.table.columns)
+                .where(model.id > last_id, model.id <= self.watermark)
+                .order_by(model.id)
+                .limit(self.batch_size)
+            )
+            if self.table.join is not None:
+                query = query.join(*self.table.join)
+            if self.since is not None and self.table.created is not None:
+                query = query.where(self.table.created >= self.since)
+            rows = session.execute(query).all()
+            # End the read transaction before the batch is written out
+            session.rollback()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            self.rows += len(rows)
+            yield rows
+
+    def _encode(self, batches):
+        names = self.table.column_names
+        if self.fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            for rows in batches:
+                writer.writerows([_plain(value) for value in row] for row in rows)
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
+        else:
+            for rows in batches:
+                yield b''.join(
+                    fast_json.dumps({name: _plain(value) for name, value in zip(names, row)}) + b'\n'
+                    for row in rows
+                )
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,37 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    """Runs independent upstream fetches in parallel under one deadline."""
+
+    def __init__(self, max_workers=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fanout')
+
+    def fetch_all(self, tasks, deadline):
+        """Run ``{name: callable}`` concurrently and wait at most ``deadline`` seconds.
+
+        Returns ``{name: result}`` for the tasks that finished in time and
+        without raising. Missing names mean that source is unavailable for
+        this page, so callers render whatever came back.
+        """
+        # Each task runs in a copy of the caller's context, so per-request
+        # state such as the metrics breakdown follows it onto the pool
+        futures = {
+            name: self._executor.submit(contextvars.copy_context().run, fn)
+            for name, fn in tasks.items()
+        }
+        done, _ = wait(futures.values(), timeout=deadline)
+
+        results = {}
+        for name, future in futures.items():
+            if future not in done:
+                logger.warning('%s missed the %.2fs page deadline', name, deadline)
+            elif future.exception() is not None:
+                logger.warning('%s failed: %s', name, future.exception())
+            else:
+                results[name] = future.result()
+        return results
@@ -0,0 +1,43 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj):
+        """Serialize ``obj`` to compact JSON bytes."""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj):
+        """Serialize ``obj`` to compact JSON bytes."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    loads = json.loads
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson for jsonify() when it is installed."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option).decode('utf-8')
+        except TypeError:
+            # Types only Flask's encoder knows about, e.g. dataclasses or Decimal
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """LRU cache of rendered HTML fragments.
+
+    Entries are never invalidated, only evicted, so a key must name every
+    input the fragment depends on: catalog or rate versions, login state
+    and so on. Two requests missing the same key may both render it; the
+    result is identical either way.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return html
+            self._stats['misses'] += 1
+
+        html = Markup(render())
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
@@ -1,26 +1,163 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, flash, session
 import requests
 import os
+import threading
+import uuid
+from backend_client import BackendError, create_backend
+from exchange_rates import ExchangeRateProvider
+from fanout import FanOut
+from fragments import FragmentCache
+from http_caching import init_compression
+from admission import BULK, CRITICAL, EXEMPT, init_admission
+from metrics import init_metrics
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
+# Seconds a page waits on its upstream fetches before rendering with what it has
+app.config['PAGE_DEADLINE'] = float(os.environ.get('PAGE_DEADLINE', 3.0))
+# Requests slower than this are logged with their timing breakdown; 0 disables
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+app.config['PRODUCTS_PER_PAGE'] = int(os.environ.get('PRODUCTS_PER_PAGE', 24))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 512))
+# Longest the pending-order page long-polls for a status change per request
+app.config['ORDER_STATUS_WAIT'] = float(os.environ.get('ORDER_STATUS_WAIT', 20))
+# Long-polls that may hold a request thread at once; more answer right away
+app.config['ORDER_STATUS_MAX_WAITERS'] = int(os.environ.get('ORDER_STATUS_MAX_WAITERS', 4))
+# Admission control: requests in flight per process before others queue
+# (0 disables), queue size, longest wait for a slot before a 503, the
+# service time the adaptive limit aims for, and the cap per bulk route
+app.config['ADMISSION_LIMIT'] = int(os.environ.get('ADMISSION_LIMIT', 32))
+app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 64))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2.0))
+app.config['ADMISSION_TARGET_LATENCY'] = float(os.environ.get('ADMISSION_TARGET_LATENCY', 2.0))
+app.config['ADMISSION_BULK_LIMIT'] = int(os.environ.get('ADMISSION_BULK_LIMIT', 8))
+init_compression(app)
+init_metrics(app, 'frontend', slow_request_seconds=app.config['SLOW_REQUEST_SECONDS'])
+init_admission(
+    app, 'frontend',
+    priorities=[
+        ('/metrics', EXEMPT),
+        ('/static/*', EXEMPT),
+        ('/orders/<int:order_id>/status', EXEMPT),
+        ('/checkout', CRITICAL),
+        ('/place-order', CRITICAL),
+        ('/orders/*', CRITICAL),
+        ('/', BULK),
+        ('/products/page', BULK),
+    ],
+    bulk_routes=['/', '/products/page']
+)
 
-# Backend API URL
-API_URL = 'http://localhost:5001/api'
+# Backend transport: 'http' for split deployments, 'inprocess' when both apps share a process
+backend = create_backend(
+    mode=os.environ.get('BACKEND_MODE', 'http'),
+    base_url=os.environ.get('BACKEND_URL', 'http://localhost:5001')
+)
+
+# Exchange rates are cached in memory and snapshotted to disk
+exchange_rates = ExchangeRateProvider(
+    api_key=os.environ.get('EXCHANGE_RATE_API_KEY'),
+    ttl=int(os.environ.get('EXCHANGE_RATE_TTL', 6 * 3600)),
+    snapshot_path=os.environ.get(
+        'EXCHANGE_RATE_SNAPSHOT',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exchange_rates.json')
+    )
+)
+
+fanout = FanOut()
+
+# Rendered product cards and currency options, keyed by the versions they depend on
+fragments = FragmentCache(max_entries=app.config['FRAGMENT_CACHE_SIZE'])
+
+# Product listing
+def listing_filters():
+    return {name: request.args[name] for name in ('search', 'category') if request.args.get(name)}
+
+def fetch_product_page(filters, page):
+    params = dict(filters, page=page, per_page=app.config['PRODUCTS_PER_PAGE'])
+    response = backend.products(params)
+    response.raise_for_status()
+    return response.json()
+
+def fetch_categories():
+    response = backend.categories()
+    response.raise_for_status()
+    return response.json().get('categories', [])
+
+def next_page_number(page):
+    current = page.get('current_page', 1)
+    return current + 1 if current < page.get('pages', 0) else None
+
+def render_product_cards(page):
+    products = page.get('products', [])
+    # Cards show an add-to-cart form or a login link depending on the session
+    key = ('cards', page.get('version'), tuple(p['id'] for p in products), 'user_id' in session)
+    
+    def render():
+        return render_template('_product_cards.html', products=products)
+    
+    if key[1] is None:
+        return render()
+    return fragments.get_or_render(key, render)
+
+def render_currency_options(conversion_rates):
+    if not conversion_rates:
+        return ''
+    key = ('currencies', exchange_rates.version)
+    return fragments.get_or_render(
+        key, lambda: render_template('_currency_options.html', conversion_rates=conversion_rates)
+    )
 
 # Routes
 @app.route('/')
 def home():
-    # Fetch products from backend API
-    response = requests.get('http://localhost:5001/products')
-    products = response.json().get('products', [])
+    filters = listing_filters()
+    page_number = max(request.args.get('page', 1, type=int), 1)
     
-    # Fetch exchange rates from the API
-    exchange_response = requests.get('https://v6.exchangerate-api.com/v6/919bb0c364d3ce45f2fc9bda/latest/USD')
-    exchange_data = exchange_response.json()
-    conversion_rates = exchange_data.get('conversion_rates', {})
+    # Products, categories and exchange rates are fetched in parallel
+    results = fanout.fetch_all({
+        'products': lambda: fetch_product_page(filters, page_number),
+        'categories': fetch_categories,
+        'conversion_rates': exchange_rates.rates
+    }, deadline=app.config['PAGE_DEADLINE'])
     
-    return render_template('home.html', products=products, conversion_rates=conversion_rates)
+    if 'products' not in results:
+        flash('Products are temporarily unavailable, please try again shortly.', 'error')
+    page = results.get('products', {'products': [], 'pages': 0, 'current_page': page_number})
+    conversion_rates = results.get('conversion_rates', {})
+    
+    return render_template(
+        'home.html',
+        page=page,
+        filters=filters,
+        next_page=next_page_number(page),
+        product_cards=render_product_cards(page),
+        categories=results.get('categories', []),
+        conversion_rates=conversion_rates,
+        currency_options=render_currency_options(conversion_rates)
+    )
+
+def backend_error_status(error):
+    """Status the backend answered with, whichever backend client raised ``error``."""
+    if isinstance(error, BackendError):
+        return error.status_code
+    response = getattr(error, 'response', None)
+    return None if response is None else response.status_code
+
+@app.route('/products/page')
+def product_page():
+    """Just the cards for one page, appended by the home page's infinite scroll."""
+    try:
+        page = fetch_product_page(listing_filters(), max(request.args.get('page', 1, type=int), 1))
+    except (BackendError, requests.exceptions.HTTPError) as e:
+        # The backend rejected the filters; asking again won't help. Anything
+        # else is the backend failing and goes to the error handlers
+        if not 400 <= (backend_error_status(e) or 0) < 500:
+            raise
+        return Response('Invalid product filters\n', status=400, mimetype='text/plain')
+    response = Response(render_product_cards(page), mimetype='text/html')
+    response.headers['X-Next-Page'] = str(next_page_number(page) or '')
+    return response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -29,7 +166,7 @@ def login():
             'username': request.form['username'],
             'password': request.form['password']
         }
-        response = requests.post(f'{API_URL}/login', json=data)
+        response = backend.login(data)
         
         if response.status_code == 200:
             user_data = response.json()
@@ -50,7 +187,7 @@ def register():
             'email': request.form['email'],
             'password': request.form['password']
         }
-        response = requests.post(f'{API_URL}/register', json=data)
+        response = backend.register(data)
         
         if response.status_code == 201:
             flash('Registration successful! Please login.', 'success')
@@ -72,9 +209,27 @@ def cart():
         flash('Please login to view cart', 'error')
         return redirect(url_for('login'))
     
-    response = requests.get(f'{API_URL}/cart', params={'user_id': session['user_id']})
-    cart_items = response.json().get('cart_items', [])
-    return render_template('cart.html', cart_items=cart_items)
+    response = backend.cart(session['user_id'])
+    data = response.json()
+    return render_template('cart.html', cart_items=data.get('cart_items', []), totals=data.get('totals'))
+
+def apply_cart_changes(operations, success_message, failure_message):
+    """Send ``operations`` as one batch and render the cart it returns.
+
+    The batch response already holds the updated cart and totals, so there
+    is no redirect and no second fetch of the cart.
+    """
+    if not operations:
+        return redirect(url_for('cart'))
+    
+    response = backend.update_cart({'user_id': session['user_id'], 'operations': operations})
+    if response.status_code != 200:
+        flash(failure_message, 'error')
+        return redirect(url_for('cart'))
+    
+    flash(success_message, 'success')
+    data = response.json()
+    return render_template('cart.html', cart_items=data.get('cart_items', []), totals=data.get('totals'))
 
 @app.route('/cart/add/<product_id>', methods=['POST'])
 def add_to_cart(product_id):
@@ -88,7 +243,9 @@ def add_to_cart(product_id):
         'quantity': int(request.form.get('quantity', 1))
     }
     
-    response = requests.post(f'{API_URL}/cart/add', json=data)
+    # Adding is not idempotent, so this one still redirects rather than
+    # leaving a page that re-adds the item on refresh
+    response = backend.add_to_cart(data)
     if response.status_code == 200:
         flash('Item added to cart!', 'success')
     else:
@@ -96,36 +253,39 @@ def add_to_cart(product_id):
     
     return redirect(url_for('cart'))
 
-@app.route('/cart/update/<cart_item_id>', methods=['POST'])
-def update_cart_item(cart_item_id):
+@app.route('/cart/save', methods=['POST'])
+def save_cart():
+    """Apply every quantity change and removal from the cart form at once."""
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    data = {
-        'cart_item_id': cart_item_id,
-        'quantity': int(request.form['quantity'])
-    }
+    operations = []
+    for cart_item_id in request.form.getlist('cart_item_id', type=int):
+        if request.form.get(f'remove-{cart_item_id}'):
+            operations.append({'op': 'remove', 'cart_item_id': cart_item_id})
+            continue
+        # Only quantities the shopper actually changed are sent
+        quantity = request.form.get(f'quantity-{cart_item_id}', type=int)
+        if quantity is not None and quantity != request.form.get(f'current-{cart_item_id}', type=int):
+            operations.append({'op': 'update', 'cart_item_id': cart_item_id, 'quantity': max(quantity, 0)})
     
-    response = requests.put(f'{API_URL}/cart/update', json=data)
-    if response.status_code == 200:
-        flash('Cart updated successfully!', 'success')
-    else:
-        flash('Failed to update cart', 'error')
+    return apply_cart_changes(operations, 'Cart updated successfully!', 'Failed to update cart')
+
+@app.route('/cart/update/<int:cart_item_id>', methods=['POST'])
+def update_cart_item(cart_item_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
     
-    return redirect(url_for('cart'))
+    operations = [{'op': 'update', 'cart_item_id': cart_item_id, 'quantity': int(request.form['quantity'])}]
+    return apply_cart_changes(operations, 'Cart updated successfully!', 'Failed to update cart')
 
-@app.route('/cart/remove/<cart_item_id>')
+@app.route('/cart/remove/<int:cart_item_id>')
 def remove_from_cart(cart_item_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    response = requests.delete(f'{API_URL}/cart/remove', params={'cart_item_id': cart_item_id})
-    if response.status_code == 200:
-        flash('Item removed from cart!', 'success')
-    else:
-        flash('Failed to remove item from cart', 'error')
-    
-    return redirect(url_for('cart'))
+    operations = [{'op': 'remove', 'cart_item_id': cart_item_id}]
+    return apply_cart_changes(operations, 'Item removed from cart!', 'Failed to remove item from cart')
 
 @app.route('/checkout', methods=['GET'])
 def checkout():
@@ -133,14 +293,16 @@ def checkout():
         flash('Please login to checkout', 'error')
         return redirect(url_for('login'))
     
-    response = requests.get(f'{API_URL}/cart', params={'user_id': session['user_id']})
+    response = backend.cart(session['user_id'])
     cart_items = response.json().get('cart_items', [])
     
     if not cart_items:
         flash('Your cart is empty', 'error')
         return redirect(url_for('cart'))
     
-    return render_template('checkout.html', cart_items=cart_items)
+    # Lets the backend recognise a resubmitted or retried order
+    idempotency_key = uuid.uuid4().hex
+    return render_template('checkout.html', cart_items=cart_items, idempotency_key=idempotency_key)
 
 @app.route('/place-order', methods=['POST'])
 def place_order():
@@ -163,30 +325,23 @@ def place_order():
         'user_id': session['user_id'],
         'shipping_info': shipping_info
     }
+    if request.form.get('idempotency_key'):
+        data['idempotency_key'] = request.form['idempotency_key']
     
-    response = requests.post(f'{API_URL}/checkout', json=data)
+    response = backend.checkout(data)
     
-    if response.status_code == 200:
+    if response.status_code in (200, 202):
         order_data = response.json()
         order_id = order_data.get('order_id')
         
+        # Async checkout: the order is queued and gets priced shortly
+        if order_data.get('status') == 'pending':
+            return render_template('order_pending.html', order_id=order_id)
+        
         # Get order details
-        order_response = requests.get(f'{API_URL}/orders/{order_id}')
+        order_response = backend.order(order_id)
         if order_response.status_code == 200:
-            order = order_response.json()
-            # Rename 'items' to 'order_items' to avoid conflict with dict.items() method
-            order['order_items'] = order['items']
-            del order['items']
-            
-            # Calculate subtotal from order items
-            subtotal = sum(item['price'] for item in order['order_items'])
-            
-            # Add missing fields needed by the template
-            order['subtotal'] = subtotal
-            order['shipping'] = 5.0  # Same as in backend_api.py
-            order['tax'] = subtotal * 0.1  # Same as in backend_api.py
-            
-            return render_template('order_confirmation.html', order=order)
+            return render_template('order_confirmation.html', order=confirmation_details(order_response.json()))
         
         flash('Order placed successfully!', 'success')
         return render_template('order_confirmation.html')
@@ -194,6 +349,73 @@ def place_order():
         flash('Failed to place order. Please try again.', 'error')
         return redirect(url_for('checkout'))
 
+def confirmation_details(order):
+    # Copy, since the backend client may hand out a cached payload
+    order = dict(order)
+    # Rename 'items' to 'order_items' to avoid conflict with dict.items() method
+    order['order_items'] = order['items']
+    del order['items']
+    
+    # Calculate subtotal from order items
+    subtotal = sum(item['price'] for item in order['order_items'])
+    
+    # Add missing fields needed by the template
+    order['subtotal'] = subtotal
+    order['shipping'] = 5.0  # Same as in backend_api.py
+    order['tax'] = subtotal * 0.1  # Same as in backend_api.py
+    return order
+
+@app.route('/orders/<int:order_id>')
+def order_page(order_id):
+    """Where the pending-order page lands once the order is processed."""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    response = backend.order(order_id)
+    if response.status_code != 200 or response.json().get('user_id') != session['user_id']:
+        flash('Order not found', 'error')
+        return redirect(url_for('home'))
+    
+    order = response.json()
+    if order['status'] == 'pending':
+        return render_template('order_pending.html', order_id=order_id)
+    if order['status'] == 'failed':
+        flash('We could not place your order; its items are back in your cart.', 'error')
+        return redirect(url_for('cart'))
+    return render_template('order_confirmation.html', order=confirmation_details(order))
+
+status_waiters = threading.BoundedSemaphore(app.config['ORDER_STATUS_MAX_WAITERS'])
+
+@app.route('/orders/<int:order_id>/status')
+def order_status(order_id):
+    """Long-polled by the pending-order page.
+
+    Exempt from admission control, so long-polls have their own limit like
+    the backend's: past ORDER_STATUS_MAX_WAITERS the current status is
+    returned at once and the page polls again after a pause.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    wait = min(request.args.get('wait', 0, type=float), app.config['ORDER_STATUS_WAIT'])
+    if wait > 0 and status_waiters.acquire(blocking=False):
+        try:
+            response = backend.order_status(order_id, wait=wait)
+        finally:
+            status_waiters.release()
+    else:
+        response = backend.order_status(order_id, wait=0)
+    data = response.json()
+    if response.status_code != 200 or data.get('user_id') != session['user_id']:
+        return jsonify({'error': 'Order not found'}), 404
+    return jsonify({'order_id': order_id, 'status': data['status']})
+
+@app.errorhandler(BackendError)
+@app.errorhandler(requests.exceptions.RequestException)
+def upstream_unavailable(error):
+    app.logger.warning('Upstream request failed: %s', error)
+    return 'Service temporarily unavailable, please try again shortly.', 503
+
 # Create templates directory
 def create_templates():
     templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
@@ -0,0 +1,35 @@
+import os
+import sys
+
+# Run with: gunicorn -c gunicorn.conf.py backend_api:app
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+
+# Import the app once in the master. Whatever it builds before the fork,
+# like the product catalog, is shared copy-on-write by every worker.
+preload_app = True
+
+
+def _app_module(server):
+    app_uri = getattr(server.app, 'app_uri', None) or ''
+    module = sys.modules.get(app_uri.split(':', 1)[0])
+    if module is None:
+        module = sys.modules.get(getattr(server.app.wsgi(), 'import_name', None))
+    return module
+
+
+def when_ready(server):
+    # Runs once in the master, before the first worker is forked. The app
+    # module's prepare_for_fork() migrates the database and loads shared state.
+    prepare = getattr(_app_module(server), 'prepare_for_fork', None)
+    if prepare is not None:
+        prepare()
+
+
+def post_fork(server, worker):
+    # Background threads don't survive the fork; each worker starts its own
+    # catalog sync (CATALOG_SOURCE=local) before it takes a request. Only the
+    # worker holding the sync lease actually fetches the feed.
+    start = getattr(_app_module(server), 'start_catalog_sync', None)
+    if start is not None:
+        start()
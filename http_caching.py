@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+
+from flask import jsonify, make_response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset(['application/json', 'application/x-ndjson', 'text/html'])
+# Compression suffixes added to a representation's ETag
+ETAG_SUFFIXES = ('', '-gzip', '-br')
+
+
+def make_etag(*parts):
+    """Strong ETag value (unquoted) derived from ``parts``."""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def not_modified(etag):
+    """True when the request's If-None-Match already names ``etag``.
+
+    Matches the compressed variants too, so a client that received the
+    gzip representation can still revalidate.
+    """
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    return any(if_none_match.contains_weak(etag + suffix) for suffix in ETAG_SUFFIXES)
+
+
+def cached_json(etag, cache_control, build):
+    """Answer 304 if the client already holds ``etag``, else jsonify ``build()``.
+
+    ``build`` returns a (payload, status) pair and is only called when the
+    body is actually needed.
+    """
+    if not_modified(etag):
+        response = make_response('', 304)
+    else:
+        payload, status = build()
+        response = jsonify(payload)
+        response.status_code = status
+        if status != 200:
+            return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def init_compression(app, min_size=1024, mimetypes=COMPRESSIBLE_MIMETYPES, level=6):
+    """Compress large responses with brotli or gzip, as the client accepts."""
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or response.mimetype not in mimetypes
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        encoding = _negotiate_encoding()
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            response.set_data(brotli.compress(body, quality=min(level, 11)))
+        else:
+            response.set_data(gzip.compress(body, compresslevel=level))
+        response.headers['Content-Encoding'] = encoding
+
+        # Each encoding is a different representation, so it gets its own strong ETag
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(f'{etag}-{encoding}')
+        return response
+
+    return compress_response
@@ -0,0 +1,264 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Methods that are safe to send again after a connection error or 5xx
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+# Statuses that mean the host itself is unreachable or overloaded. Only
+# these, connection errors and timeouts count toward its circuit breaker;
+# a 500 is one request's bug and says nothing about the rest of the host.
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a host's circuit is open."""
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail immediately. After ``reset_timeout`` seconds one
+    trial call is let through; success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a trial call that proved nothing either way; the next call may try again."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+            'max_latency': self.max_latency
+        }
+
+
+class HttpClient:
+    """Shared HTTP client with a keep-alive connection pool per host.
+
+    Every call gets connect/read timeouts, idempotent calls are retried with
+    jittered exponential backoff, and each host sits behind its own circuit
+    breaker.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2,
+                 pool_size=10, failure_threshold=5, reset_timeout=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._breakers = {}
+        self._stats = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call ``callback(host, elapsed, failed)`` after every attempt."""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """Send a request; pass ``idempotent=True`` to allow retrying a POST
+        that carries its own idempotency key."""
+        method = method.upper()
+        host = urlsplit(url).netloc
+        session, breaker, stats = self._host(host)
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = self.retries + 1 if idempotent else 1
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                with self._lock:
+                    stats.rejected += 1
+                raise CircuitOpenError(f'Upstream {host} is unavailable (circuit open)')
+            if attempt:
+                with self._lock:
+                    stats.retries += 1
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                self._record(host, stats, time.perf_counter() - started, failed=True)
+                breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise
+                continue
+
+            # A 503 with Retry-After is the host shedding load, not failing:
+            # it neither trips the breaker nor gets retried straight away
+            shed = response.status_code == 503 and 'Retry-After' in response.headers
+            failed = response.status_code >= 500 and not shed
+            unavailable = response.status_code in RETRY_STATUSES and not shed
+            self._record(host, stats, time.perf_counter() - started, failed=failed)
+            if unavailable:
+                breaker.record_failure()
+            elif shed:
+                # The host is up but busy: neither closes the circuit nor
+                # reopens it, and must not leave a half-open trial stuck
+                breaker.release_trial()
+            else:
+                breaker.record_success()
+            if unavailable and attempt + 1 < attempts:
+                response.close()
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            result = {host: stats.to_dict() for host, stats in self._stats.items()}
+        for host in result:
+            result[host]['circuit'] = self._breakers[host].state
+        return result
+
+    def close(self):
+        """Drop pooled connections; sessions reconnect on their next request.
+
+        Call this before forking so no two processes share a socket.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.close()
+
+    def _host(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._stats[host] = HostStats()
+            return session, self._breakers[host], self._stats[host]
+
+    def _record(self, host, stats, elapsed, failed):
+        with self._lock:
+            stats.requests += 1
+            stats.total_latency += elapsed
+            stats.max_latency = max(stats.max_latency, elapsed)
+            if failed:
+                stats.errors += 1
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(host, elapsed, failed)
+
+
+# Process-wide client shared by both apps
+client = HttpClient(
+    connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.environ.get('HTTP_READ_TIMEOUT', 10)),
+    retries=int(os.environ.get('HTTP_RETRIES', 2)),
+    pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10))
+)
+
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return client.post(url, **kwargs)
+
+
+def put(url, **kwargs):
+    return client.put(url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return client.patch(url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return client.delete(url, **kwargs)
+
+
+def stats():
+    return client.stats()
+
+
+def close():
+    client.close()
@@ -0,0 +1,292 @@
+"""Request timing metrics for both Flask apps, exposed on /metrics.
+
+Each request gets a breakdown of where its time went: upstream HTTP calls,
+SQL statements, template rendering and password hashing. Totals per
+component feed Prometheus histograms, and requests over
+``slow_request_seconds`` are logged with their breakdown.
+
+Metrics live in process memory, so under gunicorn every worker reports
+its own numbers; Prometheus adds them up across scrape targets.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, request, template_rendered
+from sqlalchemy import event
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def lines(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, key, [('le', le)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+
+# Process-wide registry shared by both apps
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.',
+    ('app', 'method', 'route', 'status')
+)
+COMPONENT_DURATION = registry.histogram(
+    'http_request_component_seconds', 'Time one request spent in each component.',
+    ('app', 'route', 'component')
+)
+COMPONENT_CALLS = registry.counter(
+    'http_request_component_calls_total', 'Upstream calls, SQL statements, renders and hashes made by requests.',
+    ('app', 'route', 'component')
+)
+UPSTREAM_DURATION = registry.histogram(
+    'upstream_request_duration_seconds', 'Outbound HTTP call latency.', ('host', 'outcome')
+)
+SQL_DURATION = registry.histogram(
+    'sql_query_duration_seconds', 'SQL statement execution time.', ('operation',)
+)
+TEMPLATE_DURATION = registry.histogram(
+    'template_render_seconds', 'Jinja template render time.', ('template',)
+)
+PASSWORD_HASH_DURATION = registry.histogram(
+    'password_hash_seconds', 'Password hashing and verification time.', ('operation',)
+)
+
+
+class RequestBreakdown:
+    """Seconds and call counts per component for one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.components = {}
+
+    def add(self, component, seconds):
+        # Fan-out threads report into the same breakdown
+        with self._lock:
+            total, calls = self.components.get(component, (0.0, 0))
+            self.components[component] = (total + seconds, calls + 1)
+
+    def describe(self):
+        with self._lock:
+            items = sorted(self.components.items())
+        return ' '.join(f'{name}={total:.3f}s/{calls}' for name, (total, calls) in items) or 'no components'
+
+
+_breakdown = contextvars.ContextVar('request_breakdown', default=None)
+_template_starts = threading.local()
+
+
+def current_breakdown():
+    return _breakdown.get()
+
+
+def record(component, seconds):
+    """Attribute ``seconds`` spent in ``component`` to the current request."""
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add(component, seconds)
+
+
+@contextmanager
+def timed(component, histogram=None, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record(component, elapsed)
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+
+
+def _upstream_finished(host, elapsed, failed):
+    UPSTREAM_DURATION.observe(elapsed, host=host, outcome='error' if failed else 'ok')
+    record('upstream', elapsed)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    SQL_DURATION.observe(elapsed, operation=statement.lstrip().split(None, 1)[0].upper())
+    record('sql', elapsed)
+
+
+def _sql_failed(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def instrument_engine(engine):
+    """Time every SQL statement ``engine`` runs."""
+    for name, listener in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute),
+                           ('handle_error', _sql_failed)):
+        if not event.contains(engine, name, listener):
+            event.listen(engine, name, listener)
+
+
+def _template_started(sender, template, context, **extra):
+    starts = getattr(_template_starts, 'stack', None)
+    if starts is None:
+        starts = _template_starts.stack = []
+    starts.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    starts = getattr(_template_starts, 'stack', None)
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    TEMPLATE_DURATION.observe(elapsed, template=template.name or 'string')
+    record('template', elapsed)
+
+
+def metrics_view():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app, name, slow_request_seconds=None):
+    """Record request, upstream and template timings for ``app`` and serve /metrics.
+
+    SQL timing is separate: pass the engine to instrument_engine().
+    """
+    http_client.client.add_listener(_upstream_finished)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_token = _breakdown.set(RequestBreakdown())
+
+    @app.after_request
+    def note_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_timer(error=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        breakdown = _breakdown.get()
+        _breakdown.reset(g.pop('metrics_token'))
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        status = g.pop('metrics_status', 500)
+
+        REQUEST_DURATION.observe(elapsed, app=name, method=request.method, route=route, status=str(status))
+        for component, (seconds, calls) in breakdown.components.items():
+            COMPONENT_DURATION.observe(seconds, app=name, route=route, component=component)
+            COMPONENT_CALLS.inc(calls, app=name, route=route, component=component)
+
+        if slow_request_seconds and elapsed >= slow_request_seconds:
+            logger.warning('Slow request %s %s -> %s took %.3fs: %s',
+                           request.method, route, status, elapsed, breakdown.describe())
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
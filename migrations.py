@@ -0,0 +1,116 @@
+from sqlalchemy import inspect, text
+
+# Schema upgrades for databases created by an older version of the app.
+# db.create_all() only creates missing tables, so new columns and indexes
+# on existing tables are added here. Every step checks before it changes
+# anything, so upgrade_schema() is safe to run on every start.
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_order_idempotency_key(conn):
+    if 'idempotency_key' not in _columns(conn, 'order'):
+        conn.execute(text('ALTER TABLE "order" ADD COLUMN idempotency_key VARCHAR(64)'))
+
+
+def add_order_version(conn):
+    if 'version' not in _columns(conn, 'order'):
+        conn.execute(text('ALTER TABLE "order" ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+def add_product_version(conn):
+    if inspect(conn).has_table('product') and 'version' not in _columns(conn, 'product'):
+        conn.execute(text('ALTER TABLE product ADD COLUMN version INTEGER NOT NULL DEFAULT 0'))
+
+
+# FTS5 index over the searched product columns, SQLite only. unicode61 with
+# '_' as a word character and accents kept splits and case-folds words the
+# way product_search.tokenize() does, so '"tok"*' prefix queries match what
+# ProductIndex matches. catalog_sync.sync_catalog() keeps it current.
+PRODUCT_FTS_DDL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5('
+    'product_id UNINDEXED, title, description, category, '
+    "tokenize=\"unicode61 remove_diacritics 0 tokenchars '_'\")"
+)
+
+
+def add_product_fts(conn):
+    if conn.dialect.name != 'sqlite' or not inspect(conn).has_table('product'):
+        return
+    if inspect(conn).has_table('product_fts'):
+        return
+    conn.execute(text(PRODUCT_FTS_DDL))
+    # The original product table had no description column
+    description = 'description' if 'description' in _columns(conn, 'product') else 'NULL'
+    conn.execute(text(
+        'INSERT INTO product_fts (product_id, title, description, category)'
+        f' SELECT id, title, {description}, category FROM product'
+    ))
+
+
+def _indexes(conn, table):
+    return {index['name'] for index in inspect(conn).get_indexes(table)}
+
+
+def unique_cart_item_per_product(conn):
+    if 'ux_cart_item_user_product' in _indexes(conn, 'cart_item'):
+        return
+    # Older versions could create duplicate rows for the same product;
+    # fold them into the oldest row before the unique index goes on.
+    conn.execute(text(
+        'UPDATE cart_item SET quantity = ('
+        '  SELECT SUM(COALESCE(dup.quantity, 1)) FROM cart_item AS dup'
+        '  WHERE dup.user_id = cart_item.user_id AND dup.product_id = cart_item.product_id'
+        ') WHERE id IN ('
+        '  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1'
+        ')'
+    ))
+    conn.execute(text(
+        'DELETE FROM cart_item WHERE id NOT IN ('
+        '  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id'
+        ')'
+    ))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX ux_cart_item_user_product ON cart_item (user_id, product_id)'
+    ))
+
+
+def index_product_category(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_product_category ON product (category)'))
+
+
+def scope_idempotency_key_to_user(conn):
+    # Keys used to be unique across all users, so one user's key could
+    # look up another user's order
+    conn.execute(text('DROP INDEX IF EXISTS ix_order_idempotency_key'))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_order_user_idempotency_key ON "order" (user_id, idempotency_key)'
+    ))
+
+
+def index_order_history(conn):
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_order_user_created ON "order" (user_id, created_at, id)'
+    ))
+    if inspect(conn).has_table('order_item'):
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_order_item_order ON order_item (order_id)'))
+
+
+MIGRATIONS = [
+    add_order_idempotency_key,
+    unique_cart_item_per_product,
+    index_product_category,
+    add_order_version,
+    index_order_history,
+    scope_idempotency_key_to_user,
+    add_product_version,
+    add_product_fts,
+]
+
+
+def upgrade_schema(engine):
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
@@ -0,0 +1,190 @@
+"""Durable queue of orders waiting to be priced, kept in the app's database.
+
+In async checkout mode the checkout request only takes the cart and queues
+a job. Worker threads, in the web process or in ``process_orders.py``,
+claim jobs and finish the order. A job is claimed with one
+UPDATE ... RETURNING, so any number of threads and processes can share
+the queue. A job whose worker died is claimed again once its lease runs
+out. Finishing an order deletes its job in the same transaction, and only
+while the claim that finished it still holds the lease; a worker that was
+overtaken raises LeaseLost and its transaction is rolled back. So each
+order is finalized exactly once, even if a slow worker outlives its lease.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """The job was claimed again after this claim's lease ran out."""
+
+
+class OrderQueue:
+    def __init__(self, model, lease=60, max_attempts=5, backoff=2.0, clock=datetime.utcnow):
+        self.model = model
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._clock = clock
+
+    def enqueue(self, session, order_id, items):
+        """Queue ``items`` ((product_id, quantity) pairs) for ``order_id``; caller commits."""
+        session.add(self.model(
+            order_id=order_id,
+            payload=json.dumps([list(item) for item in items]),
+            status='queued',
+            attempts=0,
+            available_at=self._clock()
+        ))
+
+    def claim(self, session):
+        """Take the oldest runnable job and commit the claim, or return None."""
+        job = self.model
+        now = self._clock()
+        runnable = or_(
+            and_(job.status == 'queued', job.available_at <= now),
+            and_(job.status == 'processing', job.locked_at < now - timedelta(seconds=self.lease))
+        )
+        oldest = select(job.id).where(runnable).order_by(job.id).limit(1).scalar_subquery()
+        claimed = session.execute(
+            update(job)
+            .where(job.id == oldest)
+            .values(status='processing', locked_at=now, attempts=job.attempts + 1)
+            .returning(job.id, job.order_id, job.payload, job.attempts, job.locked_at)
+            .execution_options(synchronize_session=False)
+        ).first()
+        session.commit()
+        return claimed
+
+    def items(self, claimed):
+        return [tuple(item) for item in json.loads(claimed.payload)]
+
+    def _held(self, claimed):
+        # Still this claim's job: nobody has claimed it again since
+        return and_(self.model.id == claimed.id, self.model.locked_at == claimed.locked_at)
+
+    def complete(self, session, claimed):
+        """Delete the finished job; raises LeaseLost if it was claimed again. Caller commits."""
+        result = session.execute(
+            delete(self.model).where(self._held(claimed)).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            raise LeaseLost(f'Job {claimed.id} was claimed again')
+
+    def retry(self, session, claimed, error):
+        """Schedule another attempt; returns False once attempts are used up. Caller commits.
+
+        Raises LeaseLost if the job was claimed again in the meantime.
+        """
+        exhausted = claimed.attempts >= self.max_attempts
+        values = {'last_error': str(error)[:1000], 'locked_at': None}
+        if exhausted:
+            values['status'] = 'failed'
+        else:
+            delay = self.backoff * (2 ** (claimed.attempts - 1))
+            values.update(status='queued', available_at=self._clock() + timedelta(seconds=delay))
+        result = session.execute(
+            update(self.model).where(self._held(claimed)).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            raise LeaseLost(f'Job {claimed.id} was claimed again')
+        return not exhausted
+
+    def stats(self, session):
+        counts = dict(session.execute(
+            select(self.model.status, func.count()).group_by(self.model.status)
+        ).all())
+        return {status: counts.get(status, 0) for status in ('queued', 'processing', 'failed')}
+
+
+class OrderWorkers:
+    """Threads that claim queued orders and pass them to ``handler``.
+
+    ``handler(claimed)`` finishes the order and commits. If it raises, the
+    job is retried with backoff. Once its attempts run out,
+    ``on_failure(claimed)`` runs in the transaction that marks it failed.
+    With ``workers=0`` nothing runs in the background and callers drive
+    run_once() themselves.
+    """
+
+    def __init__(self, app, db, queue, handler, on_failure=None, workers=2, poll_interval=1.0):
+        self.app = app
+        self.db = db
+        self.queue = queue
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._threads_pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._updated = threading.Condition()
+
+    def run_once(self):
+        """Process one job; False when the queue had nothing runnable."""
+        with self.app.app_context():
+            session = self.db.session
+            claimed = self.queue.claim(session)
+            if claimed is None:
+                return False
+            try:
+                try:
+                    self.handler(claimed)
+                except LeaseLost:
+                    raise
+                except Exception as e:
+                    session.rollback()
+                    logger.exception('Order %s failed (attempt %s)', claimed.order_id, claimed.attempts)
+                    if not self.queue.retry(session, claimed, e) and self.on_failure is not None:
+                        self.on_failure(claimed)
+                    session.commit()
+            except LeaseLost:
+                # Another worker owns the job now; drop everything this one did
+                session.rollback()
+                logger.warning('Order %s: lease lost to another worker', claimed.order_id)
+        with self._updated:
+            self._updated.notify_all()
+        return True
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so each process starts its own
+        if not self.workers or self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            self._stop.clear()
+            for n in range(self.workers):
+                threading.Thread(target=self._run, name=f'order-worker-{n}', daemon=True).start()
+            self._threads_pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wake idle workers, e.g. right after a job was queued."""
+        self._wake.set()
+
+    def wait_for_update(self, timeout):
+        """Block until a worker in this process finishes a job, or ``timeout``."""
+        with self._updated:
+            self._updated.wait(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception('Order worker error')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Werkzeug's own default, spelled out so stored hashes can be compared to it
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class HasherBusy(Exception):
+    """Raised instead of queueing once the hashing backlog is full."""
+
+
+class PasswordHasher:
+    """Runs password hashing off the request thread on a bounded process pool.
+
+    Hashing is CPU-bound, so it runs in worker processes. A burst of logins
+    then can't starve the threads serving carts and checkouts. At most
+    ``workers + max_queue`` hashes are in flight; anything beyond that
+    raises HasherBusy straight away instead of piling up. With
+    ``workers=0`` hashing runs inline.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_queue=32):
+        self.method = method
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._method_prefix = None
+        self._stats = {'hashed': 0, 'verified': 0, 'rejected': 0}
+
+    def hash(self, password):
+        result = self._run(generate_password_hash, password, self.method)
+        self._count('hashed')
+        return result
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        result = self._run(check_password_hash, pwhash, password)
+        self._count('verified')
+        return result
+
+    def needs_rehash(self, pwhash):
+        """True when ``pwhash`` was made with a different method or cost."""
+        return pwhash.split('$', 1)[0] != self._configured_prefix()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _configured_prefix(self):
+        if self._method_prefix is None:
+            # Short forms like 'scrypt' expand to their full parameters
+            if self.method.count(':') >= 2:
+                self._method_prefix = self.method
+            else:
+                self._method_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._method_prefix
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HasherBusy('Password hashing queue is full')
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def _pool(self):
+        # Created lazily and per process, so pools never leak across a
+        # gunicorn fork
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+from backend_api import app, db, fail_order, finalize_order, order_queue
+from order_queue import OrderWorkers
+
+parser = argparse.ArgumentParser(description='Price and store orders queued by async checkout.')
+parser.add_argument('--workers', type=int, default=2, help='Worker threads in this process')
+parser.add_argument('--poll-interval', type=float, default=1.0,
+                    help='Seconds an idle worker waits before checking the queue again')
+parser.add_argument('--drain', action='store_true',
+                    help='Process everything queued right now and exit')
+args = parser.parse_args()
+
+with app.app_context():
+    db.create_all()
+
+workers = OrderWorkers(app, db, order_queue, finalize_order, on_failure=fail_order,
+                       workers=args.workers, poll_interval=args.poll_interval)
+if args.drain:
+    processed = 0
+    while workers.run_once():
+        processed += 1
+    print(f'Processed {processed} queued orders.')
+else:
+    workers.ensure_started()
+    while True:
+        time.sleep(60)
@@ -0,0 +1,184 @@
+import bisect
+import re
+
+TOKEN_RE = re.compile(r'\w+')
+
+# sort parameter -> (field, descending)
+SORT_OPTIONS = {
+    'price': ('price', False),
+    '-price': ('price', True),
+    'rating': ('rating', False),
+    '-rating': ('rating', True),
+    'title': ('title', False),
+    '-title': ('title', True),
+}
+
+MAX_PER_PAGE = 100
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def fts_prefix_query(text):
+    """FTS5 MATCH expression for ``text``: every token starts some word, as ProductIndex matches.
+
+    Returns '' when there is nothing to search for. Tokens are ``\\w+`` runs,
+    so quoting them is enough to keep FTS5 operators out.
+    """
+    return ' '.join(f'"{token}"*' for token in tokenize(text))
+
+
+def _float_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+class ProductQuery:
+    """Search, filter, sort and pagination parameters for /products."""
+
+    def __init__(self, search=None, category=None, min_price=None, max_price=None,
+                 min_rating=None, sort=None, page=1, per_page=20):
+        if sort is not None and sort not in SORT_OPTIONS:
+            raise ValueError(f'Unsupported sort: {sort}')
+        self.search = search or None
+        self.category = category or None
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_rating = min_rating
+        self.sort = sort
+        self.page = max(page, 1)
+        self.per_page = min(max(per_page, 1), MAX_PER_PAGE)
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a query from request args; raises ValueError on bad input."""
+        return cls(
+            search=args.get('search'),
+            category=args.get('category'),
+            min_price=_float_arg(args, 'min_price'),
+            max_price=_float_arg(args, 'max_price'),
+            min_rating=_float_arg(args, 'min_rating'),
+            sort=args.get('sort') or None,
+            page=int(args.get('page', 1)),
+            per_page=int(args.get('per_page', 20))
+        )
+
+    @property
+    def offset(self):
+        return (self.page - 1) * self.per_page
+
+    def pages(self, total):
+        return (total + self.per_page - 1) // self.per_page
+
+
+def _price(product):
+    return product.get('price')
+
+
+def _rating(product):
+    return (product.get('rating') or {}).get('rate')
+
+
+def _title(product):
+    return (product.get('title') or '').lower()
+
+
+_SORT_FIELDS = {'price': _price, 'rating': _rating, 'title': _title}
+
+
+class ProductIndex:
+    """In-memory inverted index over one catalog snapshot.
+
+    Built once per snapshot; queries only walk the postings that match and
+    only materialize the products on the requested page.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        postings = {}
+        categories = {}
+        for position, product in enumerate(products):
+            tokens = set(tokenize(product.get('title')))
+            tokens.update(tokenize(product.get('description')))
+            tokens.update(tokenize(product.get('category')))
+            for token in tokens:
+                postings.setdefault(token, []).append(position)
+            categories.setdefault(product.get('category'), []).append(position)
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+        self._categories = categories
+        self._orders = {}
+
+    def categories(self):
+        return sorted(c for c in self._categories if c)
+
+    def search(self, query):
+        """Return (products on the requested page, total matches)."""
+        matched = list(self._matching_positions(query))
+        page = matched[query.offset:query.offset + query.per_page]
+        return [self.products[position] for position in page], len(matched)
+
+    def iter_search(self, query):
+        """Lazily yield every matching product in order, ignoring pagination."""
+        for position in self._matching_positions(query):
+            yield self.products[position]
+
+    def _matching_positions(self, query):
+        candidates = None
+        for token in tokenize(query.search):
+            matches = self._prefix_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return
+        if query.category is not None:
+            in_category = set(self._categories.get(query.category, ()))
+            candidates = in_category if candidates is None else candidates & in_category
+
+        if query.sort:
+            order = self._order(query.sort)
+        elif candidates is not None:
+            order = sorted(candidates)
+        else:
+            order = range(len(self.products))
+
+        for position in order:
+            if (candidates is None or position in candidates) and self._passes_filters(position, query):
+                yield position
+
+    def _prefix_matches(self, token):
+        # The last word a user types is often incomplete, so match on prefixes
+        matches = set()
+        start = bisect.bisect_left(self._vocabulary, token)
+        for word in self._vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            matches.update(self._postings[word])
+        return matches
+
+    def _passes_filters(self, position, query):
+        product = self.products[position]
+        price = product.get('price')
+        if query.min_price is not None and (price is None or price < query.min_price):
+            return False
+        if query.max_price is not None and (price is None or price > query.max_price):
+            return False
+        if query.min_rating is not None:
+            rating = _rating(product)
+            if rating is None or rating < query.min_rating:
+                return False
+        return True
+
+    def _order(self, sort):
+        order = self._orders.get(sort)
+        if order is None:
+            field, descending = SORT_OPTIONS[sort]
+            key = _SORT_FIELDS[field]
+            present = [i for i in range(len(self.products)) if key(self.products[i]) is not None]
+            missing = [i for i in range(len(self.products)) if key(self.products[i]) is None]
+            present.sort(key=lambda i: key(self.products[i]), reverse=descending)
+            # Products without a value always sort last
+            order = self._orders[sort] = present + missing
+        return order
@@ -0,0 +1,148 @@
+"""Sales totals kept up to date as orders are confirmed.
+
+Three rollup tables hold running sums: orders, units and revenue per day,
+per product per day, and per user over their lifetime. Checkout adds each
+order to them in its own transaction, so reports never have to scan
+orders. rebuild() recomputes them from the orders table in chunks, for
+databases that had orders before the rollups existed.
+"""
+from collections import defaultdict
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+class SalesTally:
+    """Sums for a batch of orders, ready to be added to the rollups."""
+
+    def __init__(self):
+        # day -> [orders, units, revenue]
+        self.days = defaultdict(lambda: [0, 0, 0.0])
+        # (product_id, day) -> [orders, units, revenue]
+        self.products = defaultdict(lambda: [0, 0, 0.0])
+        # user_id -> [orders, units, revenue, first placed_at, last placed_at]
+        self.users = {}
+
+    def add_order(self, user_id, placed_at, total, items):
+        """Count one order; ``items`` are order item dicts or rows.
+
+        An order item's price is its line total, quantity already included.
+        """
+        day = placed_at.date()
+        units = 0
+        seen = set()
+        for item in items:
+            quantity = item['quantity'] or 0
+            units += quantity
+            product = self.products[item['product_id'], day]
+            if item['product_id'] not in seen:
+                product[0] += 1
+                seen.add(item['product_id'])
+            product[1] += quantity
+            product[2] += item['price']
+
+        totals = self.days[day]
+        totals[0] += 1
+        totals[1] += units
+        totals[2] += total
+
+        user = self.users.get(user_id)
+        if user is None:
+            self.users[user_id] = [1, units, total, placed_at, placed_at]
+        else:
+            user[0] += 1
+            user[1] += units
+            user[2] += total
+            user[3] = min(user[3], placed_at)
+            user[4] = max(user[4], placed_at)
+
+    def __bool__(self):
+        return bool(self.days)
+
+
+class SalesRollups:
+    def __init__(self, daily, product_daily, user_totals):
+        self.daily = daily
+        self.product_daily = product_daily
+        self.user_totals = user_totals
+
+    def record(self, session, tally):
+        """Add ``tally`` to the rollups with one upsert per table; caller commits."""
+        if not tally:
+            return
+        self._add(session, self.daily, ['day'], [
+            {'day': day, 'orders': orders, 'units': units, 'revenue': revenue}
+            for day, (orders, units, revenue) in tally.days.items()
+        ])
+        self._add(session, self.product_daily, ['product_id', 'day'], [
+            {'product_id': product_id, 'day': day, 'orders': orders, 'units': units, 'revenue': revenue}
+            for (product_id, day), (orders, units, revenue) in tally.products.items()
+        ])
+        self._add(session, self.user_totals, ['user_id'], [
+            {'user_id': user_id, 'orders': orders, 'units': units, 'revenue': revenue,
+             'first_order_at': first, 'last_order_at': last}
+            for user_id, (orders, units, revenue, first, last) in tally.users.items()
+        ])
+
+    def rebuild(self, session, order, order_item, order_job, chunk_size=1000, progress=None):
+        """Recompute every rollup from ``order`` rows; returns the number of orders counted.
+
+        The rollups are emptied, and the newest order id noted, in one
+        transaction. Checkouts committed after that add themselves as usual.
+        Older orders are then read by id in chunks of ``chunk_size``, each
+        chunk in a short transaction of its own. Orders still queued at the
+        start are left to the order workers, which count them once confirmed.
+        """
+        for model in (self.daily, self.product_daily, self.user_totals):
+            session.execute(delete(model))
+        high_water = session.execute(select(func.max(order.id))).scalar() or 0
+        queued = set(session.execute(
+            select(order_job.order_id).where(order_job.order_id <= high_water)
+        ).scalars())
+        session.commit()
+
+        counted = 0
+        last_id = 0
+        while last_id < high_water:
+            orders = session.execute(
+                select(order.id, order.user_id, order.created_at, order.total)
+                .where(order.id > last_id, order.id <= high_water, order.status != 'failed')
+                .order_by(order.id)
+                .limit(chunk_size)
+            ).all()
+            if not orders:
+                break
+            last_id = orders[-1].id
+            orders = [row for row in orders if row.id not in queued]
+
+            items = defaultdict(list)
+            for item in session.execute(
+                select(order_item.order_id, order_item.product_id, order_item.price, order_item.quantity)
+                .where(order_item.order_id.in_([row.id for row in orders]))
+            ):
+                items[item.order_id].append(item._mapping)
+
+            tally = SalesTally()
+            for row in orders:
+                tally.add_order(row.user_id, row.created_at, row.total, items[row.id])
+            self.record(session, tally)
+            session.commit()
+            counted += len(orders)
+            if progress is not None:
+                progress(counted, last_id, high_water)
+        return counted
+
+    @staticmethod
+    def _add(session, model, keys, rows):
+        stmt = sqlite_insert(model)
+        set_ = {
+            name: getattr(model, name) + getattr(stmt.excluded, name)
+            for name in ('orders', 'units', 'revenue')
+        }
+        if 'first_order_at' in rows[0]:
+            set_['first_order_at'] = func.min(model.first_order_at, stmt.excluded.first_order_at)
+            set_['last_order_at'] = func.max(model.last_order_at, stmt.excluded.last_order_at)
+        session.execute(
+            stmt.on_conflict_do_update(index_elements=[getattr(model, key) for key in keys], set_=set_),
+            rows
+        )
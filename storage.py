@@ -0,0 +1,72 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+
+# Connect-time PRAGMAs per profile. 'concurrent' is tuned for several
+# gunicorn workers sharing one database file. 'default' keeps SQLite's own
+# settings and is only useful for comparison.
+SQLITE_PROFILES = {
+    'default': {},
+    'concurrent': {
+        # Readers no longer block the writer and the writer no longer blocks readers
+        'journal_mode': 'WAL',
+        # With WAL, fsync on checkpoint only; a crash can lose the last commits but never corrupts
+        'synchronous': 'NORMAL',
+        # Wait for the write lock instead of failing with "database is locked"
+        'busy_timeout': 5000,
+        # 20 MB page cache per connection (negative values are KiB)
+        'cache_size': -20000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def database_uri(default_path):
+    return os.environ.get('DATABASE_URL', f'sqlite:///{default_path}')
+
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+
+def is_memory_database(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+
+def engine_options(uri, profile='concurrent'):
+    """SQLAlchemy engine options suited to the database behind ``uri``."""
+    if not is_sqlite(uri):
+        return {'pool_pre_ping': True}
+    if is_memory_database(uri):
+        # Every connection would get its own empty in-memory database
+        return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+
+    busy_timeout = SQLITE_PROFILES[profile].get('busy_timeout')
+    connect_args = {'check_same_thread': False}
+    if busy_timeout is not None:
+        connect_args['timeout'] = busy_timeout / 1000
+    # A small pool of long-lived connections keeps the per-connection page
+    # cache and mmap warm. SQLite has a single writer, so a large pool
+    # would only add lock contention.
+    return {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 30,
+        'connect_args': connect_args
+    }
+
+
+def install_sqlite_pragmas(engine, profile='concurrent'):
+    pragmas = SQLITE_PROFILES[profile]
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
@@ -0,0 +1,28 @@
+import argparse
+import time
+
+from backend_api import app, create_database, db, JobLease, Product
+from catalog_sync import CatalogSyncJob
+
+parser = argparse.ArgumentParser(description='Mirror the external product catalog into the local Product table.')
+parser.add_argument('--interval', type=int, default=0,
+                    help='Keep running and resync every INTERVAL seconds (default: sync once and exit)')
+args = parser.parse_args()
+
+create_database()
+
+# Shares the lease with the web workers' sync threads, so only one of them syncs
+job = CatalogSyncJob(
+    app, db, Product, args.interval,
+    max_prune_ratio=app.config['CATALOG_SYNC_MAX_PRUNE'], lease_model=JobLease
+)
+while True:
+    if args.interval and not job.acquire_lease():
+        print('Catalog sync skipped: another process holds the sync lease.')
+    else:
+        result = job.run_once()
+        print(f"Catalog synced: {result['inserted']} inserted, {result['updated']} updated, "
+              f"{result['deleted']} deleted, {result['unchanged']} unchanged.")
+    if not args.interval:
+        break
+    time.sleep(args.interval)
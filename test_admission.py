@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from admission import BULK, CRITICAL, EXEMPT, NORMAL, AdmissionController, Shed, init_admission
+
+
+def queue_in_background(controller, route, priority, results):
+    def run():
+        try:
+            results.append((route, controller.acquire(route, priority)))
+        except Shed as e:
+            results.append((route, e.reason))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # Let it reach the queue before the next one
+    time.sleep(0.05)
+    return thread
+
+
+def test_checkout_is_admitted_before_queued_catalog_reads():
+    controller = AdmissionController(limit=1, min_limit=1, max_limit=1, max_queue=2, queue_timeout=5)
+    assert controller.acquire('/home', NORMAL) == 'admitted'
+
+    results = []
+    bulk = queue_in_background(controller, '/products', BULK, results)
+    normal = queue_in_background(controller, '/cart', NORMAL, results)
+    # The queue is full; checkout displaces the least important waiter
+    checkout = queue_in_background(controller, '/api/checkout', CRITICAL, results)
+    bulk.join()
+    assert results == [('/products', 'displaced')]
+
+    controller.release('/home', 0.01)
+    checkout.join()
+    controller.release('/api/checkout', 0.01)
+    normal.join()
+    assert results[1:] == [('/api/checkout', 'queued'), ('/cart', 'queued')]
+    controller.release('/cart', 0.01)
+    stats = controller.stats()
+    assert (stats['admitted'], stats['queued'], stats['shed'], stats['in_flight']) == (1, 2, 1, 0)
+
+
+def test_route_cap_leaves_room_for_other_routes():
+    controller = AdmissionController(limit=4, route_limits={'/products': 1}, queue_timeout=0.01)
+    controller.acquire('/products', BULK)
+    with pytest.raises(Shed):
+        controller.acquire('/products', BULK)
+    assert controller.acquire('/api/checkout', CRITICAL) == 'admitted'
+
+
+def test_limit_backs_off_when_slow_and_recovers_when_fast():
+    now = [0.0]
+    controller = AdmissionController(limit=10, min_limit=2, target_latency=0.5, backoff=0.5,
+                                     clock=lambda: now[0])
+    for _ in range(3):
+        controller.acquire('/cart')
+        controller.release('/cart', 2.0)
+    # Cut once; further cuts wait target_latency
+    assert controller.limit == 5
+    now[0] = 1.0
+    controller.acquire('/cart')
+    controller.release('/cart', 2.0)
+    assert controller.limit == 2
+
+    for _ in range(40):
+        controller.acquire('/cart')
+        controller.release('/cart', 0.01)
+    assert controller.limit > 2
+
+
+def test_shed_requests_get_503_with_retry_after():
+    app = Flask(__name__)
+    app.config.update(ADMISSION_LIMIT=1, ADMISSION_MAX_QUEUE=0, ADMISSION_QUEUE_TIMEOUT=0.01,
+                      ADMISSION_TARGET_LATENCY=1.0, ADMISSION_BULK_LIMIT=1)
+    controller = init_admission(app, 'test', priorities=[('/metrics', EXEMPT)])
+    app.add_url_rule('/cart', 'cart', lambda: 'ok')
+    app.add_url_rule('/metrics', 'metrics', lambda: 'metrics')
+    client = app.test_client()
+
+    assert client.get('/cart').status_code == 200
+    # A fast request may have grown the limit already
+    for _ in range(controller.limit):
+        controller.acquire('/cart')
+    response = client.get('/cart')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert client.get('/metrics').status_code == 200
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import text
 from frontend_app import app
 
 @pytest.fixture
@@ -26,3 +27,160 @@ def test_cart(client):
 def test_checkout(client):
     response = client.get('/checkout')
     assert response.status_code in [200, 302]
+
+
+def test_login_against_the_local_backend(client, monkeypatch):
+    import backend_api
+    import frontend_app
+    from backend_client import LocalBackend
+
+    # The in-process backend, so login has a real user to check
+    monkeypatch.setattr(frontend_app, 'backend', LocalBackend())
+    user = {'username': 'login-test', 'email': 'login-test@example.com', 'password': 'secret'}
+    assert frontend_app.backend.register(user).status_code == 201
+    try:
+        response = client.post('/login', data={'username': 'login-test', 'password': 'secret'})
+        assert response.status_code == 302
+        assert response.headers['Location'] == '/'
+        with client.session_transaction() as session:
+            assert session['username'] == 'login-test'
+
+        response = client.post('/login', data={'username': 'login-test', 'password': 'wrong'})
+        assert response.status_code == 200
+        assert b'Invalid username or password' in response.data
+    finally:
+        # Only this test's user; the database is shared with other tests
+        with backend_api.app.app_context():
+            backend_api.User.query.filter_by(username='login-test').delete()
+            backend_api.db.session.commit()
+            backend_api.db.session.remove()
+
+
+def test_fanout_returns_partial_results_at_deadline():
+    import time
+    from fanout import FanOut
+
+    def slow():
+        time.sleep(1)
+        return 'late'
+
+    def broken():
+        raise RuntimeError('upstream down')
+
+    started = time.perf_counter()
+    results = FanOut().fetch_all({'fast': lambda: 'ok', 'slow': slow, 'broken': broken}, deadline=0.2)
+    assert time.perf_counter() - started < 0.9
+    assert results == {'fast': 'ok'}
+
+
+def test_local_backend_calls_service_functions_directly():
+    import backend_api
+    from backend_client import LocalBackend
+    from test_backend import ORIGINAL_SCHEMA
+
+    # Start from a database made by the original version of the app
+    with backend_api.app.app_context():
+        backend_api.db.drop_all()
+        with backend_api.db.engine.begin() as conn:
+            for statement in ORIGINAL_SCHEMA:
+                conn.execute(text(statement))
+    backend = LocalBackend()
+    response = backend.login({'username': 'no-such-user', 'password': 'secret'})
+    assert response.status_code == 401
+    assert response.json() == {'error': 'Invalid username or password'}
+    assert backend.order(0).status_code == 404
+
+
+def test_load_test_runs_offline_against_stubbed_upstreams():
+    from benchmarks.load_test import run_load_test
+
+    report = run_load_test(target='frontend', users=2, seconds=1, catalog_size=20)
+    assert set(report['routes']) == {'home', 'add_to_cart', 'cart', 'checkout', 'place_order'}
+    assert report['total']['requests'] > 0
+    assert report['total']['errors'] == 0
+    assert report['total']['p50'] <= report['total']['p99']
+
+
+def test_home_paginates_and_reuses_rendered_fragments(monkeypatch):
+    import backend_api
+    import frontend_app
+    from backend_client import LocalBackend
+    from exchange_rates import ExchangeRateProvider
+
+    backend_api.create_database()
+    backend_api.catalog_cache.prime([
+        {'_id': f'p{i}', 'title': f'Item {i}', 'category': 'lips' if i % 2 else 'eyes',
+         'description': 'Nice', 'price': 1.0 + i, 'image': f'p{i}.png', 'rating': {'rate': 4.0, 'count': 1}}
+        for i in range(30)
+    ])
+    monkeypatch.setattr(frontend_app, 'backend', LocalBackend())
+    monkeypatch.setattr(frontend_app, 'exchange_rates', ExchangeRateProvider('key', fetch=lambda: {'USD': 1.0, 'EUR': 0.9}))
+    monkeypatch.setitem(frontend_app.app.config, 'PRODUCTS_PER_PAGE', 10)
+    client = frontend_app.app.test_client()
+
+    html = client.get('/', query_string={'category': 'lips'}).get_data(as_text=True)
+    assert html.count('card h-100 product-card') == 10
+    assert 'loading="lazy"' in html
+    assert 'data-next-page="2"' in html
+    assert '<option value="0.9"' in html
+
+    misses = frontend_app.fragments.stats()['misses']
+    client.get('/', query_string={'category': 'lips'})
+    assert frontend_app.fragments.stats()['misses'] == misses
+
+    more = client.get('/products/page', query_string={'category': 'lips', 'page': 2})
+    assert more.headers['X-Next-Page'] == ''
+    assert more.get_data(as_text=True).count('card h-100 product-card') == 5
+    backend_api.catalog_cache.invalidate()
+
+
+def test_product_page_answers_400_when_the_backend_rejects_the_filters(monkeypatch):
+    import requests
+    import frontend_app
+    from backend_client import BackendResponse
+
+    class StubBackend:
+        def __init__(self, response):
+            self.response = response
+
+        def products(self, params):
+            return self.response
+
+    client = frontend_app.app.test_client()
+    # LocalBackend raises BackendError; HttpBackend's requests raise HTTPError
+    rejected = requests.Response()
+    rejected.status_code = 400
+    for response in (BackendResponse(400, {'error': 'Invalid query parameters'}), rejected):
+        monkeypatch.setattr(frontend_app, 'backend', StubBackend(response))
+        assert client.get('/products/page', query_string={'page': 2}).status_code == 400
+
+    monkeypatch.setattr(frontend_app, 'backend', StubBackend(BackendResponse(500, {'error': 'down'})))
+    assert client.get('/products/page', query_string={'page': 2}).status_code == 503
+
+
+def test_order_status_long_polls_are_capped_per_process(monkeypatch):
+    import threading
+    import frontend_app
+    from backend_client import BackendResponse
+
+    class StubBackend:
+        def __init__(self):
+            self.waits = []
+
+        def order_status(self, order_id, wait=0):
+            self.waits.append(wait)
+            return BackendResponse(200, {'order_id': order_id, 'user_id': 1, 'status': 'pending'})
+
+    backend = StubBackend()
+    monkeypatch.setattr(frontend_app, 'backend', backend)
+    monkeypatch.setattr(frontend_app, 'status_waiters', threading.BoundedSemaphore(1))
+    client = frontend_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    assert client.get('/orders/7/status?wait=60').get_json()['status'] == 'pending'
+    # Every waiter slot taken: answered without holding the thread
+    frontend_app.status_waiters.acquire()
+    assert client.get('/orders/7/status?wait=60').status_code == 200
+    frontend_app.status_waiters.release()
+    assert backend.waits == [frontend_app.app.config['ORDER_STATUS_WAIT'], 0]
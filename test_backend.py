@@ -0,0 +1,740 @@
+import asyncio
+import gc
+import gzip
+import json
+import runpy
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text, update
+
+import backend_api
+from migrations import upgrade_schema
+
+# Tables as created by the original version of backend_api.py
+ORIGINAL_SCHEMA = [
+    'CREATE TABLE product (id VARCHAR(100) PRIMARY KEY, title VARCHAR(255) NOT NULL, '
+    'category VARCHAR(100))',
+    'CREATE TABLE cart_item (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+    'product_id VARCHAR(100) NOT NULL, quantity INTEGER, added_at DATETIME)',
+    'CREATE TABLE "order" (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+    'total FLOAT NOT NULL, status VARCHAR(50), shipping_address TEXT, created_at DATETIME)',
+]
+
+
+PRODUCTS = [
+    {'_id': 'p1', 'title': 'Lipstick', 'category': 'lips', 'description': 'Matte red',
+     'price': 10.0, 'rentprice': None, 'size': None, 'image': 'lipstick.png',
+     'rating': {'rate': 4.5, 'count': 12}},
+    {'_id': 'p2', 'title': 'Mascara', 'category': 'eyes', 'description': 'Volume',
+     'price': 15.0, 'rentprice': None, 'size': None, 'image': 'mascara.png',
+     'rating': {'rate': 4.0, 'count': 3}},
+]
+SHIPPING_INFO = {'address': '1 Main St', 'city': 'Springfield', 'state': 'IL', 'zip': '62701'}
+
+
+@pytest.fixture
+def client():
+    backend_api.create_database()
+    backend_api.catalog_cache.prime(PRODUCTS)
+    yield backend_api.app.test_client()
+    with backend_api.app.app_context():
+        backend_api.db.session.remove()
+        backend_api.db.drop_all()
+    backend_api.catalog_cache.invalidate()
+
+
+@pytest.fixture
+def user_id(client):
+    client.post('/api/register', json={'username': 'alice', 'email': 'alice@example.com', 'password': 'pw'})
+    return client.post('/api/login', json={'username': 'alice', 'password': 'pw'}).get_json()['user_id']
+
+
+def original_database(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        for statement in ORIGINAL_SCHEMA:
+            conn.execute(text(statement))
+    return engine
+
+
+def test_upgrade_schema_adds_missing_columns_and_indexes(tmp_path):
+    engine = original_database(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO product (id, title, category) VALUES ('p1', 'Lipstick', 'lips')"))
+    upgrade_schema(engine)
+    upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    assert 'idempotency_key' in {c['name'] for c in inspector.get_columns('order')}
+    indexes = {i['name']: i for i in inspector.get_indexes('order')}
+    assert 'ix_order_idempotency_key' not in indexes
+    assert indexes['ux_order_user_idempotency_key']['unique']
+    assert indexes['ux_order_user_idempotency_key']['column_names'] == ['user_id', 'idempotency_key']
+    assert indexes['ix_order_user_created']['column_names'] == ['user_id', 'created_at', 'id']
+    assert 'version' in {c['name'] for c in inspector.get_columns('product')}
+    # Existing products are backfilled into the full-text index, once
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT product_id FROM product_fts WHERE product_fts MATCH 'lip*'")).all() == [('p1',)]
+
+
+def test_gunicorn_master_migrates_before_forking():
+    with backend_api.app.app_context():
+        backend_api.db.drop_all()
+        with backend_api.db.engine.begin() as conn:
+            for statement in ORIGINAL_SCHEMA:
+                conn.execute(text(statement))
+    backend_api.catalog_cache.prime(PRODUCTS)
+
+    class Server:
+        class app:
+            app_uri = 'backend_api:app'
+
+    try:
+        runpy.run_path('gunicorn.conf.py')['when_ready'](Server)
+    finally:
+        gc.unfreeze()
+    with backend_api.app.app_context():
+        assert 'version' in {c['name'] for c in inspect(backend_api.db.engine).get_columns('order')}
+        backend_api.db.drop_all()
+    backend_api.catalog_cache.invalidate()
+
+
+def test_gunicorn_workers_start_the_local_catalog_sync(client, monkeypatch):
+    job = backend_api.catalog_sync_job
+    synced = threading.Event()
+
+    def fetch():
+        synced.set()
+        return PRODUCTS
+
+    monkeypatch.setitem(backend_api.app.config, 'CATALOG_SOURCE', 'local')
+    monkeypatch.setattr(job, 'fetch', fetch)
+    monkeypatch.setattr(job, '_thread_pid', None)
+
+    class Server:
+        class app:
+            app_uri = 'backend_api:app'
+
+    runpy.run_path('gunicorn.conf.py')['post_fork'](Server, None)
+    try:
+        assert synced.wait(5)
+        for _ in range(50):
+            if job.last_result is not None:
+                break
+            time.sleep(0.01)
+        assert job.last_result['inserted'] + job.last_result['unchanged'] == 2
+    finally:
+        job.stop()
+
+
+def test_catalog_sync_runs_in_one_process_at_a_time(client):
+    from catalog_sync import CatalogSyncJob
+
+    now = [datetime(2024, 1, 1)]
+    job = CatalogSyncJob(
+        backend_api.app, backend_api.db, backend_api.Product, 60,
+        lease_model=backend_api.JobLease, clock=lambda: now[0]
+    )
+    assert job.acquire_lease()
+    # Renewed by its holder
+    assert job.acquire_lease()
+    with backend_api.app.app_context():
+        backend_api.db.session.execute(update(backend_api.JobLease).values(holder='other-host:1'))
+        backend_api.db.session.commit()
+    assert not job.acquire_lease()
+    # Taken over once the holder has missed two intervals
+    now[0] += timedelta(seconds=121)
+    assert job.acquire_lease()
+
+
+def test_upgrade_schema_merges_duplicate_cart_rows(tmp_path):
+    engine = original_database(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO cart_item (user_id, product_id, quantity) VALUES "
+            "(1, 'p1', 2), (1, 'p1', 3), (1, 'p2', 1), (2, 'p1', 1)"
+        ))
+
+    upgrade_schema(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            'SELECT user_id, product_id, quantity FROM cart_item ORDER BY user_id, product_id'
+        )).all()
+    assert [tuple(r) for r in rows] == [(1, 'p1', 5), (1, 'p2', 1), (2, 'p1', 1)]
+    indexes = {i['name']: i for i in inspect(engine).get_indexes('cart_item')}
+    assert indexes['ux_cart_item_user_product']['unique']
+
+
+def test_add_to_cart_increments_existing_row(client, user_id):
+    for quantity in (2, 3):
+        response = client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': quantity})
+        assert response.status_code == 200
+    assert client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'nope'}).status_code == 404
+
+    items = client.get('/api/cart', query_string={'user_id': user_id}).get_json()['cart_items']
+    assert [(i['product']['id'], i['quantity']) for i in items] == [('p1', 5)]
+
+
+def test_checkout_is_idempotent_and_clears_cart(client, user_id):
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': 2})
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p2'})
+    data = {'user_id': user_id, 'shipping_info': SHIPPING_INFO, 'idempotency_key': 'abc123'}
+
+    first = client.post('/api/checkout', json=data).get_json()
+    retry = client.post('/api/checkout', json=data).get_json()
+    assert first == retry
+    assert first['total'] == pytest.approx(35 + 5 + 3.5)
+
+    order = client.get(f"/api/orders/{first['order_id']}").get_json()
+    assert sorted((i['product_id'], i['quantity'], i['price']) for i in order['items']) == [
+        ('p1', 2, 20.0), ('p2', 1, 15.0)
+    ]
+    assert client.get('/api/cart', query_string={'user_id': user_id}).get_json()['cart_items'] == []
+    assert client.post('/api/checkout', json=dict(data, idempotency_key='other')).status_code == 400
+
+    # Another user's key is just a new key for this user
+    client.post('/api/register', json={'username': 'mallory', 'email': 'mallory@example.com', 'password': 'pw'})
+    other_id = client.post('/api/login', json={'username': 'mallory', 'password': 'pw'}).get_json()['user_id']
+    client.post('/api/cart/add', json={'user_id': other_id, 'product_id': 'p2'})
+    other = client.post('/api/checkout', json=dict(data, user_id=other_id)).get_json()
+    assert other['order_id'] != first['order_id']
+    assert other['total'] == pytest.approx(15 + 5 + 1.5)
+
+
+def test_concurrent_checkout_retry_gets_the_first_attempts_order(client, user_id, monkeypatch):
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    data = {'user_id': user_id, 'shipping_info': SHIPPING_INFO, 'idempotency_key': 'retry-1'}
+    lookup = backend_api.catalog_lookup
+    first = []
+
+    def first_attempt_commits_meanwhile(product_ids):
+        # The retry has passed the idempotency check; now the first attempt finishes
+        if not first:
+            monkeypatch.setattr(backend_api, 'catalog_lookup', lookup)
+            thread = threading.Thread(target=lambda: first.append(client.post('/api/checkout', json=data)))
+            thread.start()
+            thread.join()
+        return lookup(product_ids)
+
+    monkeypatch.setattr(backend_api, 'catalog_lookup', first_attempt_commits_meanwhile)
+    retry = client.post('/api/checkout', json=data)
+    assert first[0].status_code == 200
+    assert retry.status_code == 200
+    assert retry.get_json()['order_id'] == first[0].get_json()['order_id']
+
+
+def test_products_are_filtered_and_paginated(client):
+    response = client.get('/products', query_string={'search': 'mas', 'per_page': 1})
+    body = response.get_json()
+    assert [p['id'] for p in body['products']] == ['p2']
+    assert (body['total'], body['pages'], body['current_page']) == (1, 1, 1)
+    assert client.get('/products', query_string={'page': 'x'}).status_code == 400
+
+
+def test_local_and_remote_catalogs_match_search_terms_alike(client, monkeypatch):
+    from catalog_sync import sync_catalog
+
+    feed = PRODUCTS + [
+        {'_id': 'p3', 'title': 'Red-Lip Gloss', 'category': 'lips', 'description': 'Glossy finish',
+         'price': 8.0, 'rating': {'rate': 3.0, 'count': 1}},
+        {'_id': 'p4', 'title': 'brush set', 'category': 'tools', 'description': 'Stick-free bristles',
+         'price': 20.0, 'rating': {'rate': 4.8, 'count': 40}},
+    ]
+    backend_api.catalog_cache.prime(feed)
+    with backend_api.app.app_context():
+        sync_catalog(backend_api.db.session, backend_api.Product, feed)
+
+    def search(term):
+        products = client.get('/products', query_string={'search': term}).get_json()['products']
+        return [p['id'] for p in products]
+
+    def sorted_by(sort):
+        products = client.get('/products', query_string={'sort': sort}).get_json()['products']
+        return [p['id'] for p in products]
+
+    terms = ['stick', 'lip', 'LIP gl', 'mat red', 'vol', 'tool', 'ipst', 'and', '"lip']
+    sorts = ['title', '-title']
+    remote = {term: search(term) for term in terms}
+    remote_sorted = {sort: sorted_by(sort) for sort in sorts}
+    monkeypatch.setitem(backend_api.app.config, 'CATALOG_SOURCE', 'local')
+    assert {term: search(term) for term in terms} == remote
+    # Titles sort case-insensitively in both
+    assert {sort: sorted_by(sort) for sort in sorts} == remote_sorted
+    assert remote_sorted['title'][0] == 'p4'
+    # Words match on their start only, never mid-word
+    assert remote['stick'] == ['p4']
+
+    # The full-text index follows changed and pruned products
+    with backend_api.app.app_context():
+        sync_catalog(backend_api.db.session, backend_api.Product, [dict(feed[3], title='Comb')] + feed[:2])
+    assert (search('brush'), search('comb'), search('gloss')) == ([], ['p4'], [])
+    assert remote['lip'] == ['p1', 'p3']
+    assert remote['ipst'] == []
+
+
+def test_sqlite_connections_use_concurrent_profile(client):
+    with backend_api.app.app_context():
+        with backend_api.db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+
+
+def test_concurrent_workers_write_without_lock_errors():
+    from benchmarks.sqlite_stress import run_stress
+
+    result = run_stress('concurrent', workers=4, requests_per_worker=50)
+    assert result['locked'] == 0
+    assert result['ok'] == result['requests']
+
+
+def test_login_upgrades_hash_when_parameters_change(client, user_id, monkeypatch):
+    from password_hashing import PasswordHasher
+
+    monkeypatch.setattr(backend_api, 'password_hasher', PasswordHasher('pbkdf2:sha256:2000', workers=0))
+    assert client.post('/api/login', json={'username': 'alice', 'password': 'pw'}).status_code == 200
+    with backend_api.app.app_context():
+        user = backend_api.db.session.get(backend_api.User, user_id)
+        assert user.password_hash.startswith('pbkdf2:sha256:2000$')
+    assert client.post('/api/login', json={'username': 'alice', 'password': 'bad'}).status_code == 401
+
+
+def test_login_succeeds_when_the_hash_upgrade_finds_the_hasher_busy(client, user_id, monkeypatch):
+    from password_hashing import HasherBusy, PasswordHasher
+
+    hasher = PasswordHasher('pbkdf2:sha256:2000', workers=0)
+
+    def busy(password):
+        raise HasherBusy()
+
+    monkeypatch.setattr(hasher, 'hash', busy)
+    monkeypatch.setattr(backend_api, 'password_hasher', hasher)
+    assert client.post('/api/login', json={'username': 'alice', 'password': 'pw'}).status_code == 200
+    with backend_api.app.app_context():
+        user = backend_api.db.session.get(backend_api.User, user_id)
+        # Left for a later login to upgrade
+        assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+def test_register_rejects_duplicate_username_or_email(client, user_id):
+    taken_name = {'username': 'alice', 'email': 'new@example.com', 'password': 'pw'}
+    taken_email = {'username': 'bob', 'email': 'alice@example.com', 'password': 'pw'}
+    assert client.post('/api/register', json=taken_name).get_json() == {'error': 'Username already exists'}
+    assert client.post('/api/register', json=taken_email).get_json() == {'error': 'Email already exists'}
+
+
+def test_password_hasher_pool_round_trip_and_backpressure():
+    from password_hashing import HasherBusy, PasswordHasher
+
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_queue=0)
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.needs_rehash(pwhash)
+
+    hasher._slots.acquire()  # simulate a hash already in flight
+    with pytest.raises(HasherBusy):
+        hasher.verify(pwhash, 'secret')
+    assert hasher.stats()['rejected'] == 1
+
+
+def test_products_support_conditional_get_and_gzip(client):
+    first = client.get('/products', headers={'Accept-Encoding': 'gzip'})
+    assert first.headers['Cache-Control'] == 'public, max-age=30'
+    etag = first.headers['ETag']
+
+    revalidated = client.get('/products', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+    backend_api.catalog_cache.prime(PRODUCTS[:1])
+    assert client.get('/products', headers={'If-None-Match': etag}).status_code == 200
+
+    backend_api.catalog_cache.prime([dict(PRODUCTS[0], _id=f'p{i}') for i in range(40)])
+    compressed = client.get('/products', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'].endswith('-gzip"')
+
+
+def test_local_catalog_products_revalidate_compressed_etags(client, monkeypatch):
+    from catalog_sync import sync_catalog
+
+    feed = [dict(PRODUCTS[0], _id=f'p{i}') for i in range(40)]
+    monkeypatch.setitem(backend_api.app.config, 'CATALOG_SOURCE', 'local')
+    with backend_api.app.app_context():
+        sync_catalog(backend_api.db.session, backend_api.Product, feed)
+
+    compressed = client.get('/products', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    etag = compressed.headers['ETag']
+    assert etag.endswith('-gzip"')
+    assert client.get('/products', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    # A sync that changes a product changes the ETag
+    with backend_api.app.app_context():
+        sync_catalog(backend_api.db.session, backend_api.Product, [dict(feed[0], price=99.0)] + feed[1:])
+    assert client.get('/products', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 200
+
+
+def test_order_etag_changes_with_status(client, user_id):
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    order_id = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO}).get_json()['order_id']
+
+    etag = client.get(f'/api/orders/{order_id}').headers['ETag']
+    assert client.get(f'/api/orders/{order_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    with backend_api.app.app_context():
+        backend_api.db.session.get(backend_api.Order, order_id).status = 'shipped'
+        backend_api.db.session.commit()
+    response = client.get(f'/api/orders/{order_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'shipped'
+
+
+def test_user_orders_page_by_cursor_newest_first(client, user_id):
+    created = [datetime(2024, 1, day) for day in (1, 2, 2, 3, 4)]
+    with backend_api.app.app_context():
+        session = backend_api.db.session
+        for n, created_at in enumerate(created):
+            order = backend_api.Order(user_id=user_id, total=n, status='confirmed', created_at=created_at)
+            order.items.append(backend_api.OrderItem(product_id='p1', product_title='Lipstick', price=10.0, quantity=n + 1))
+            session.add(order)
+        session.commit()
+        plan = ' '.join(str(row) for row in session.execute(text(
+            'EXPLAIN QUERY PLAN SELECT id FROM "order" WHERE user_id = 1 AND created_at < :c '
+            'ORDER BY created_at DESC, id DESC LIMIT 3'), {'c': created[-1]}))
+    assert 'ix_order_user_created' in plan and 'TEMP B-TREE' not in plan
+
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 2, 'include': 'items'}
+        if cursor:
+            params['before'] = cursor
+        page = client.get(f'/api/users/{user_id}/orders', query_string=params).get_json()
+        seen += [(order['id'], order['items'][0]['quantity']) for order in page['orders']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [(5, 5), (4, 4), (3, 3), (2, 2), (1, 1)]
+
+    assert 'items' not in client.get(f'/api/users/{user_id}/orders').get_json()['orders'][0]
+    assert client.get(f'/api/users/{user_id}/orders', query_string={'before': 'nope'}).status_code == 400
+    assert client.get('/api/users/999/orders').status_code == 404
+
+
+def test_sales_rollups_follow_checkout_and_match_a_rebuild(client, user_id, monkeypatch):
+    checkout = {'user_id': user_id, 'shipping_info': SHIPPING_INFO}
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': 2})
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p2'})
+    client.post('/api/checkout', json=checkout)
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    client.post('/api/checkout', json=checkout)
+    # Queued orders only count once a worker confirms them
+    assert client.get('/api/reports/sales').get_json()['totals']['orders'] == 1
+    backend_api.order_workers.run_once()
+
+    def reports():
+        return (
+            client.get('/api/reports/sales').get_json()['totals'],
+            client.get('/api/reports/products/p1/sales').get_json()['totals'],
+            client.get('/api/reports/products/top', query_string={'by': 'units'}).get_json()['products'],
+            client.get(f'/api/reports/users/{user_id}').get_json()
+        )
+
+    live = reports()
+    daily, p1, top, user = live
+    assert daily == {'orders': 2, 'units': 4, 'revenue': pytest.approx(35 * 1.1 + 5 + 10 * 1.1 + 5)}
+    assert p1 == {'orders': 2, 'units': 3, 'revenue': pytest.approx(30.0)}
+    assert [(p['product_id'], p['units']) for p in top] == [('p1', 3), ('p2', 1)]
+    assert (user['orders'], user['units']) == (2, 4)
+
+    with backend_api.app.app_context():
+        assert backend_api.sales_rollups.rebuild(
+            backend_api.db.session, backend_api.Order, backend_api.OrderItem, backend_api.OrderJob, chunk_size=1
+        ) == 2
+    assert reports() == live
+    assert client.get('/api/reports/sales', query_string={'start': '2024-01-01'}).status_code == 400
+
+
+def test_exports_stream_incrementally_from_watermark(client, user_id):
+    checkout = {'user_id': user_id, 'shipping_info': SHIPPING_INFO}
+    for product_id in ('p1', 'p2'):
+        client.post('/api/cart/add', json={'user_id': user_id, 'product_id': product_id})
+        client.post('/api/checkout', json=checkout)
+
+    response = client.get('/api/exports/orders', query_string={'batch_size': 1})
+    orders = [json.loads(line) for line in response.data.splitlines()]
+    assert [order['status'] for order in orders] == ['confirmed', 'confirmed']
+    watermark = response.headers['X-Export-Watermark']
+    assert watermark == str(orders[-1]['id'])
+
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': 3})
+    client.post('/api/checkout', json=checkout)
+    response = client.get('/api/exports/order_items',
+                          query_string={'format': 'csv', 'gzip': 1, 'after': 2})
+    assert response.mimetype == 'application/gzip'
+    lines = gzip.decompress(response.data).decode().splitlines()
+    assert lines[0] == 'id,order_id,product_id,product_title,price,quantity'
+    assert [line.split(',')[2:] for line in lines[1:]] == [['p1', 'Lipstick', '30.0', '3']]
+    assert client.get('/api/exports/orders', query_string={'after': watermark}).data.count(b'\n') == 1
+    assert client.get('/api/exports/users').status_code == 404
+
+
+def test_orders_export_waits_for_pending_async_orders(client, user_id, monkeypatch):
+    checkout = {'user_id': user_id, 'shipping_info': SHIPPING_INFO}
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    first = client.post('/api/checkout', json=checkout).get_json()['order_id']
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p2'})
+    client.post('/api/checkout', json=checkout)
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'sync')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    client.post('/api/checkout', json=checkout)
+
+    # The pending order and everything after it wait for the next export
+    response = client.get('/api/exports/orders')
+    assert [json.loads(line)['id'] for line in response.data.splitlines()] == [first]
+    watermark = response.headers['X-Export-Watermark']
+    assert watermark == str(first)
+
+    assert backend_api.order_workers.run_once()
+    response = client.get('/api/exports/orders', query_string={'after': watermark})
+    orders = [json.loads(line) for line in response.data.splitlines()]
+    assert [order['status'] for order in orders] == ['confirmed', 'confirmed']
+    assert orders[0]['total'] == pytest.approx(15 * 1.1 + 5)
+
+
+def test_products_stream_as_ndjson_or_chunked_array(client):
+    import json
+
+    ndjson = client.get('/products', query_string={'sort': '-price'}, headers={'Accept': 'application/x-ndjson'})
+    assert ndjson.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in ndjson.data.splitlines()] == ['p2', 'p1']
+
+    array = client.get('/products', query_string={'stream': '1', 'category': 'lips'})
+    assert [p['id'] for p in json.loads(array.data)['products']] == ['p1']
+
+
+def test_metrics_break_down_request_time(client, user_id):
+    import metrics
+
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    body = client.get('/metrics').get_data(as_text=True)
+    assert client.get('/metrics').content_type.startswith('text/plain; version=0.0.4')
+    assert 'http_request_duration_seconds_count{app="backend",method="POST",route="/api/cart/add",status="200"}' in body
+    assert 'http_request_component_seconds_count{app="backend",route="/api/login",component="password_hash"}' in body
+    assert 'http_request_component_calls_total{app="backend",route="/api/cart/add",component="sql"}' in body
+    assert 'sql_query_duration_seconds_bucket{operation="INSERT",le="+Inf"}' in body
+
+    breakdown = metrics.RequestBreakdown()
+    breakdown.add('sql', 0.002)
+    breakdown.add('sql', 0.003)
+    assert breakdown.describe() == 'sql=0.005s/2'
+
+
+def test_cart_patch_applies_batch_atomically(client, user_id):
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    cart = client.get('/api/cart', query_string={'user_id': user_id}).get_json()
+    p1_item = cart['cart_items'][0]['id']
+
+    response = client.patch('/api/cart', json={'user_id': user_id, 'operations': [
+        {'op': 'update', 'cart_item_id': p1_item, 'quantity': 3},
+        {'op': 'add', 'product_id': 'p2', 'quantity': 2},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted((i['product']['id'], i['quantity']) for i in body['cart_items']) == [('p1', 3), ('p2', 2)]
+    assert body['totals']['subtotal'] == pytest.approx(60.0)
+    assert body['totals']['total'] == pytest.approx(60 + 5 + 6)
+
+    # A failing operation rolls back the ones before it
+    failed = client.patch('/api/cart', json={'user_id': user_id, 'operations': [
+        {'op': 'remove', 'product_id': 'p2'},
+        {'op': 'update', 'cart_item_id': 9999, 'quantity': 1},
+    ]})
+    assert (failed.status_code, failed.get_json()['operation']) == (404, 1)
+    bad = client.patch('/api/cart', json={'user_id': user_id, 'operations': [{'op': 'add', 'product_id': 'p1', 'quantity': 0}]})
+    assert bad.status_code == 400
+
+    emptied = client.patch('/api/cart', json={'user_id': user_id, 'operations': [
+        {'op': 'remove', 'product_id': 'p2'},
+        {'op': 'update', 'cart_item_id': p1_item, 'quantity': 0},
+    ]}).get_json()
+    assert emptied['cart_items'] == []
+    assert emptied['totals']['total'] == 0
+
+
+def test_async_checkout_queues_order_for_workers(client, user_id, monkeypatch):
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': 2})
+    data = {'user_id': user_id, 'shipping_info': SHIPPING_INFO, 'idempotency_key': 'async-1'}
+
+    response = client.post('/api/checkout', json=data)
+    assert response.status_code == 202
+    order_id = response.get_json()['order_id']
+    assert response.get_json()['status'] == 'pending'
+    assert client.post('/api/checkout', json=data).get_json()['order_id'] == order_id
+    assert client.get('/api/cart', query_string={'user_id': user_id}).get_json()['cart_items'] == []
+    assert client.get('/api/orders/queue').get_json()['queued'] == 1
+
+    assert backend_api.order_workers.run_once()
+    assert not backend_api.order_workers.run_once()
+    status = client.get(f'/api/orders/{order_id}/status', query_string={'wait': 5}).get_json()
+    assert (status['status'], status['total']) == ('confirmed', pytest.approx(20 + 5 + 2))
+    assert [i['product_id'] for i in client.get(f'/api/orders/{order_id}').get_json()['items']] == ['p1']
+
+
+def test_async_order_claimed_again_after_its_lease_is_finalized_once(client, user_id, monkeypatch):
+    from datetime import timedelta
+    from order_queue import LeaseLost
+
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1', 'quantity': 2})
+    order_id = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO}).get_json()['order_id']
+
+    queue = backend_api.order_queue
+    with backend_api.app.app_context():
+        session = backend_api.db.session
+        slow = queue.claim(session)
+        monkeypatch.setattr(queue, '_clock', lambda: datetime.utcnow() + timedelta(seconds=queue.lease + 1))
+        fast = queue.claim(session)
+        assert fast.id == slow.id
+
+        # The overtaken worker can no longer finish the order, before or after the other one
+        with pytest.raises(LeaseLost):
+            backend_api.finalize_order(slow)
+        session.rollback()
+        backend_api.finalize_order(fast)
+        with pytest.raises(LeaseLost):
+            backend_api.finalize_order(slow)
+        session.rollback()
+
+        items = session.execute(
+            backend_api.select(backend_api.OrderItem.product_id, backend_api.OrderItem.quantity)
+            .where(backend_api.OrderItem.order_id == order_id)
+        ).all()
+        assert [tuple(item) for item in items] == [('p1', 2)]
+        assert session.get(backend_api.UserSales, user_id).orders == 1
+
+
+def test_async_order_that_keeps_failing_returns_items_to_cart(client, user_id, monkeypatch):
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    monkeypatch.setattr(backend_api.order_queue, 'max_attempts', 1)
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p2'})
+    order_id = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO}).get_json()['order_id']
+
+    def catalog_down(product_ids):
+        raise backend_api.requests.exceptions.ConnectionError('catalog down')
+
+    monkeypatch.setattr(backend_api, 'catalog_lookup', catalog_down)
+    assert backend_api.order_workers.run_once()
+    assert client.get(f'/api/orders/{order_id}/status').get_json()['status'] == 'failed'
+    assert client.get('/api/orders/queue').get_json()['failed'] == 1
+    monkeypatch.undo()
+    items = client.get('/api/cart', query_string={'user_id': user_id}).get_json()['cart_items']
+    assert [(i['product']['id'], i['quantity']) for i in items] == [('p2', 1)]
+
+
+def test_order_status_long_polls_have_their_own_limit(client, user_id, monkeypatch):
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    order_id = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO}).get_json()['order_id']
+    monkeypatch.setattr(backend_api, 'status_waiters', threading.BoundedSemaphore(1))
+
+    assert backend_api.status_waiters.acquire(blocking=False)
+    started = time.monotonic()
+    # The only waiter slot is taken, so this answers without waiting
+    response = client.get(f'/api/orders/{order_id}/status', query_string={'wait': 5})
+    assert response.get_json()['status'] == 'pending'
+    assert time.monotonic() - started < 1
+    backend_api.status_waiters.release()
+
+
+def asgi_request(app, method, path, query=b'', body=b'', headers=()):
+    """Run one request through an ASGI app; returns (status, headers, body)."""
+    messages = []
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(b'content-type', b'application/json')] + list(headers), 'http_version': '1.1'}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            await asyncio.sleep(3600)
+        request_sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await app(scope, receive, send)
+        start = messages[0]
+        return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+    return run()
+
+
+def test_asgi_app_waits_for_the_catalog_once_then_serves_flask(client):
+    import backend_asgi
+
+    fetches = []
+
+    async def slow_feed():
+        fetches.append(1)
+        await asyncio.sleep(0.05)
+        return PRODUCTS
+
+    app = backend_asgi.BackendASGI(backend_api.app, threads=2, fetch_catalog=slow_feed)
+    backend_api.catalog_cache.invalidate()
+
+    async def burst():
+        return await asyncio.gather(*(asgi_request(app, 'GET', '/products') for _ in range(50)))
+
+    responses = asyncio.run(burst())
+    assert len(fetches) == 1
+    assert {status for status, _, _ in responses} == {200}
+    assert json.loads(responses[0][2])['total'] == 2
+
+    async def more():
+        registered = await asgi_request(app, 'POST', '/api/register', body=json.dumps(
+            {'username': 'bob', 'email': 'bob@example.com', 'password': 'pw'}).encode())
+        streamed = await asgi_request(app, 'GET', '/products', headers=[(b'accept', b'application/x-ndjson')])
+        return registered, streamed
+
+    registered, streamed = asyncio.run(more())
+    assert registered[0] == 201
+    assert [json.loads(line)['id'] for line in streamed[2].splitlines()] == ['p1', 'p2']
+    assert len(fetches) == 1
+    app.executor.shutdown()
+
+
+def test_asgi_order_status_long_poll_waits_without_a_pool_thread(client, user_id, monkeypatch):
+    import backend_asgi
+
+    monkeypatch.setitem(backend_api.app.config, 'CHECKOUT_MODE', 'async')
+    client.post('/api/cart/add', json={'user_id': user_id, 'product_id': 'p1'})
+    order_id = client.post('/api/checkout', json={'user_id': user_id, 'shipping_info': SHIPPING_INFO}).get_json()['order_id']
+    app = backend_asgi.BackendASGI(backend_api.app, threads=1)
+    app.order_status.interval = 0.02
+
+    async def scenario():
+        polls = [asyncio.ensure_future(asgi_request(app, 'GET', f'/api/orders/{order_id}/status', query=b'wait=5'))
+                 for _ in range(3)]
+        await asyncio.sleep(0.1)
+        # The only pool thread is free while the polls wait
+        cart = await asgi_request(app, 'GET', '/api/cart', query=f'user_id={user_id}'.encode())
+        assert not any(poll.done() for poll in polls)
+        await asyncio.get_running_loop().run_in_executor(None, backend_api.order_workers.run_once)
+        return cart, await asyncio.gather(*polls)
+
+    cart, polls = asyncio.run(scenario())
+    assert cart[0] == 200
+    assert {json.loads(body)['status'] for _, _, body in polls} == {'confirmed'}
+
+    missing = asyncio.run(asgi_request(app, 'GET', '/api/orders/999/status', query=b'wait=5'))
+    assert missing[0] == 404
+    app.executor.shutdown()
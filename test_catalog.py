@@ -0,0 +1,232 @@
+import threading
+
+import pytest
+from catalog import CatalogCache
+from catalog_store import CatalogStore
+
+PRODUCTS = [
+    {'_id': 'p1', 'title': 'Lipstick', 'price': 10.0, 'image': 'lipstick.png'},
+    {'_id': 'p2', 'title': 'Mascara', 'price': 15.0, 'image': 'mascara.png'},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_catalog_cache_serves_fresh_copy_without_refetching():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return PRODUCTS
+
+    cache = CatalogCache(fetch=fetch, ttl=60, clock=FakeClock())
+    assert cache.by_id()['p1']['title'] == 'Lipstick'
+    assert [p['_id'] for p in cache.products()] == ['p1', 'p2']
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_catalog_cache_serves_stale_copy_while_refreshing():
+    clock = FakeClock()
+    refreshed = threading.Event()
+    versions = iter([PRODUCTS, PRODUCTS[:1]])
+
+    def fetch():
+        try:
+            return next(versions)
+        finally:
+            if clock.now:
+                refreshed.set()
+
+    cache = CatalogCache(fetch=fetch, ttl=60, stale_ttl=600, clock=clock)
+    cache.get()
+    clock.now = 120
+    assert len(cache.products()) == 2
+    assert refreshed.wait(5)
+    for _ in range(50):
+        if cache.stats()['refreshes'] == 2:
+            break
+        threading.Event().wait(0.01)
+    assert len(cache.products()) == 1
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_catalog_cache_keeps_the_store_when_a_refresh_is_unchanged():
+    clock = FakeClock()
+    feeds = iter([PRODUCTS, [dict(p) for p in PRODUCTS], PRODUCTS[:1]])
+    cache = CatalogCache(fetch=lambda: next(feeds), ttl=60, stale_ttl=0, clock=clock)
+    first = cache.get()
+
+    # Same contents, fresh objects: the preloaded store is kept
+    clock.now = 100
+    second = cache.get()
+    assert second is not first
+    assert second.store is first.store
+
+    clock.now = 200
+    assert cache.get().store is not first.store
+    assert len(cache.products()) == 1
+
+
+def test_catalog_cache_coalesces_concurrent_misses():
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return PRODUCTS
+
+    cache = CatalogCache(fetch=fetch, ttl=60, clock=FakeClock())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.products())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    while cache.stats()['misses'] < 8:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert cache.stats()['coalesced'] == 7
+
+
+def test_catalog_store_keeps_feed_shape_with_compact_records():
+    feed = PRODUCTS + [
+        {'_id': 'p3', 'title': 'Blush', 'category': 'cheeks', 'description': 'Soft pink',
+         'price': 8.0, 'rating': {'rate': 3.5, 'count': 2}},
+        {'_id': 'p1', 'title': 'Duplicate', 'price': 99.0},
+    ]
+    store = CatalogStore(feed)
+
+    assert [r.id for r in store.records] == ['p1', 'p2', 'p3']
+    assert store.price('p1') == 10.0
+    assert store.price('missing') is None
+    assert 'p3' in store and store.get('missing') is None
+
+    blush = store['p3']
+    assert not hasattr(blush, '__dict__')
+    assert blush['description'] == 'Soft pink'
+    assert blush.get('rating') == {'rate': 3.5, 'count': 2}
+    assert blush.get('unknown', 'x') == 'x'
+    assert blush.to_dict() == dict(feed[2], rentprice=None, size=None, image=None)
+
+
+def test_catalog_cache_raises_when_nothing_cached():
+    def fetch():
+        raise RuntimeError('upstream down')
+
+    cache = CatalogCache(fetch=fetch, clock=FakeClock())
+    with pytest.raises(RuntimeError):
+        cache.get()
+    assert cache.stats()['refresh_errors'] == 1
+
+
+def test_sync_catalog_only_touches_changed_rows(tmp_path):
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+    from catalog_sync import sync_catalog
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "sync.db"}'
+    db = SQLAlchemy(app)
+
+    class Product(db.Model):
+        id = db.Column(db.String(100), primary_key=True)
+        title = db.Column(db.String(255), nullable=False)
+        category = db.Column(db.String(100))
+        description = db.Column(db.Text)
+        price = db.Column(db.Float)
+        rentprice = db.Column(db.Float)
+        size = db.Column(db.String(50))
+        image = db.Column(db.String(255))
+        rating_rate = db.Column(db.Float)
+        rating_count = db.Column(db.Integer)
+        version = db.Column(db.Integer, nullable=False, default=0)
+
+    with app.app_context():
+        db.create_all()
+        assert sync_catalog(db.session, Product, PRODUCTS) == {
+            'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'kept': 0
+        }
+        changed = [dict(PRODUCTS[0], price=12.0), {'_id': 'p3', 'title': 'Blush'}]
+        assert sync_catalog(db.session, Product, changed) == {
+            'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 0, 'kept': 0
+        }
+        assert db.session.get(Product, 'p1').price == 12.0
+        assert db.session.get(Product, 'p2') is None
+        assert sync_catalog(db.session, Product, changed)['unchanged'] == 2
+
+
+def test_sync_catalog_refuses_to_prune_an_empty_or_truncated_feed(tmp_path):
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+    from catalog_sync import sync_catalog
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "sync.db"}'
+    db = SQLAlchemy(app)
+
+    class Product(db.Model):
+        id = db.Column(db.String(100), primary_key=True)
+        title = db.Column(db.String(255), nullable=False)
+        category = db.Column(db.String(100))
+        description = db.Column(db.Text)
+        price = db.Column(db.Float)
+        rentprice = db.Column(db.Float)
+        size = db.Column(db.String(50))
+        image = db.Column(db.String(255))
+        rating_rate = db.Column(db.Float)
+        rating_count = db.Column(db.Integer)
+        version = db.Column(db.Integer, nullable=False, default=0)
+
+    feed = [{'_id': f'p{i}', 'title': f'Product {i}'} for i in range(10)]
+    with app.app_context():
+        db.create_all()
+        sync_catalog(db.session, Product, feed)
+        assert sync_catalog(db.session, Product, [])['kept'] == 10
+        truncated = sync_catalog(db.session, Product, feed[:4])
+        assert (truncated['deleted'], truncated['kept']) == (0, 6)
+        assert Product.query.count() == 10
+
+        # A small removal is still pruned
+        assert sync_catalog(db.session, Product, feed[:8])['deleted'] == 2
+        assert Product.query.count() == 8
+
+
+def test_product_index_search_filter_sort_and_paginate():
+    from product_search import ProductIndex, ProductQuery
+
+    products = [
+        {'_id': 'a', 'title': 'Red Lipstick', 'category': 'lips', 'description': 'Matte finish',
+         'price': 12.0, 'rating': {'rate': 4.5, 'count': 10}},
+        {'_id': 'b', 'title': 'Pink Lipstick', 'category': 'lips', 'description': 'Glossy',
+         'price': 8.0, 'rating': {'rate': 3.9, 'count': 4}},
+        {'_id': 'c', 'title': 'Volume Mascara', 'category': 'eyes', 'description': 'Long lasting',
+         'price': 20.0, 'rating': {'rate': 4.8, 'count': 31}},
+    ]
+    index = ProductIndex(products)
+
+    page, total = index.search(ProductQuery(search='lipst', sort='price'))
+    assert [p['_id'] for p in page] == ['b', 'a']
+    assert total == 2
+
+    page, total = index.search(ProductQuery(category='lips', min_rating=4.0))
+    assert [p['_id'] for p in page] == ['a']
+
+    page, total = index.search(ProductQuery(sort='-rating', page=2, per_page=2))
+    assert [p['_id'] for p in page] == ['b']
+    assert total == 3
+    assert ProductQuery(per_page=2).pages(total) == 2
+
+    assert index.search(ProductQuery(search='lasting matte'))[1] == 0
+    assert index.categories() == ['eyes', 'lips']
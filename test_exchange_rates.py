@@ -0,0 +1,54 @@
+import time
+
+from exchange_rates import ExchangeRateProvider
+
+RATES = {'USD': 1, 'EUR': 0.92, 'INR': 83.1}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rates_are_served_from_snapshot_without_calling_api(tmp_path):
+    snapshot = str(tmp_path / 'rates.json')
+    clock = FakeClock()
+    first = ExchangeRateProvider('key', snapshot_path=snapshot, fetch=lambda: RATES, clock=clock)
+    assert first.rates() == RATES
+
+    def failing_fetch():
+        raise RuntimeError('rates API down')
+
+    # A fresh process with a broken API still renders rates from disk
+    second = ExchangeRateProvider('key', snapshot_path=snapshot, fetch=failing_fetch, clock=clock)
+    assert second.rates() == RATES
+    assert second.stats()['snapshot_loads'] == 1
+    assert second.stats()['refreshes'] == 0
+
+
+def test_rates_without_api_key_or_snapshot_are_empty(tmp_path):
+    provider = ExchangeRateProvider(None, snapshot_path=str(tmp_path / 'rates.json'))
+    assert provider.rates() == {}
+
+
+def test_stale_rates_are_served_while_refreshing(tmp_path):
+    clock = FakeClock()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return RATES
+
+    provider = ExchangeRateProvider('key', ttl=60, snapshot_path=str(tmp_path / 'rates.json'),
+                                    fetch=fetch, clock=clock)
+    provider.rates()
+    clock.now += 120
+    assert provider.rates() == RATES
+    for _ in range(100):
+        if len(calls) == 2:
+            break
+        time.sleep(0.01)
+    assert len(calls) == 2
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+import requests
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker_opens_and_allows_one_trial_after_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    clock.now = 31
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_client_fails_fast_once_host_is_unhealthy():
+    client = HttpClient(connect_timeout=0.5, retries=1, backoff=0, failure_threshold=2)
+    # Nothing listens on port 1, so every attempt is refused
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('http://127.0.0.1:1/products')
+    with pytest.raises(CircuitOpenError):
+        client.get('http://127.0.0.1:1/products')
+
+    stats = client.stats()['127.0.0.1:1']
+    assert stats['requests'] == 2
+    assert stats['errors'] == 2
+    assert stats['retries'] == 1
+    assert stats['rejected'] == 1
+    assert stats['circuit'] == 'open'
+
+
+def test_load_shedding_503_is_not_a_failure():
+    client = HttpClient(retries=2, backoff=0, failure_threshold=1)
+    session, breaker, _ = client._host('backend:5001')
+    calls = []
+
+    def shed(method, url, **kwargs):
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
+
+    session.request = shed
+    assert client.get('http://backend:5001/products').status_code == 503
+    assert len(calls) == 1
+    assert breaker.state == 'closed'
+
+
+def test_application_500_does_not_open_the_circuit():
+    client = HttpClient(retries=2, backoff=0, failure_threshold=1)
+    session, breaker, _ = client._host('backend:5001')
+    statuses = iter([500, 500, 502, 200])
+
+    def respond(method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = next(statuses)
+        response.raw = io.BytesIO(b'')
+        return response
+
+    session.request = respond
+    # A handler's bug is reported, not retried, and the host stays usable
+    assert client.get('http://backend:5001/api/cart').status_code == 500
+    assert client.get('http://backend:5001/products').status_code == 500
+    assert breaker.state == 'closed'
+    assert client.stats()['backend:5001']['errors'] == 2
+
+    # A bad gateway is the host itself; it trips the breaker
+    with pytest.raises(CircuitOpenError):
+        client.get('http://backend:5001/products')
+    assert breaker.state == 'open'
+
+
+def test_shed_503_on_the_half_open_trial_lets_a_later_call_retry():
+    clock = FakeClock()
+    client = HttpClient(retries=0, backoff=0, failure_threshold=1, reset_timeout=30)
+    session, _, _ = client._host('backend:5001')
+    breaker = client._breakers['backend:5001'] = CircuitBreaker(1, 30, clock=clock)
+    statuses = iter([502, 503, 200])
+
+    def respond(method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = next(statuses)
+        if response.status_code == 503:
+            response.headers['Retry-After'] = '1'
+        return response
+
+    session.request = respond
+    client.get('http://backend:5001/products')
+    assert breaker.state == 'open'
+
+    clock.now = 31
+    assert client.get('http://backend:5001/products').status_code == 503
+    assert breaker.state == 'half_open'
+    # The shed trial didn't hold on to the trial slot
+    assert client.get('http://backend:5001/products').status_code == 200
+    assert breaker.state == 'closed'